@@ -0,0 +1,227 @@
+"""
+asyncio-native Bitcoin Reserve API client.
+
+Mirrors the endpoints in `client.py` but takes its config and api_token explicitly
+(no Flask app or request context needed), so one event loop can drive many
+users' requests concurrently:
+
+    async with aiohttp.ClientSession() as session:
+        clients = [
+            AsyncBitcoinReserveClient(config, api_token, session=session)
+            for api_token in api_tokens
+        ]
+        balances = await asyncio.gather(*[c.get_fiat_balances() for c in clients])
+
+Requires the optional `aiohttp` dependency:
+    pip install kdmukai_bitcoinreserve[async]
+"""
+import asyncio
+import json
+import logging
+import time
+
+from decimal import Decimal
+from typing import List
+
+from .api_config import BitcoinReserveApiConfig
+from .exceptions import (
+    BitcoinReserveApiException,
+    BitcoinReserveApiRateLimitException,
+    BitcoinReserveApiTransientException,
+)
+from .metrics import api_metrics
+from .resilience import classify_error_response
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBitcoinReserveClient:
+    def __init__(
+        self,
+        config: BitcoinReserveApiConfig,
+        api_token: str,
+        session: "aiohttp.ClientSession" = None,
+    ):
+        """
+        Pass in a shared `session` to pool connections across many clients (e.g.
+        one per user); otherwise the client opens its own on first use and
+        `close()` (or `async with`) closes it.
+        """
+        if aiohttp is None:
+            raise ImportError(
+                "AsyncBitcoinReserveClient requires aiohttp: pip install kdmukai_bitcoinreserve[async]"
+            )
+        self.config = config
+        self.api_token = api_token
+        self._session = session
+        self._owns_session = session is None
+
+    @staticmethod
+    def create_session(config: BitcoinReserveApiConfig) -> "aiohttp.ClientSession":
+        """A keep-alive session sized and timed out according to `config`"""
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=config.pool_size),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=config.connect_timeout, sock_read=config.read_timeout
+            ),
+        )
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        if self._session is None:
+            self._session = self.create_session(self.config)
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _send_request(
+        self, endpoint: str, method: str, headers: dict, json_payload: dict
+    ) -> dict:
+        """A single attempt; see `BitcoinReserveClient._send_request`"""
+        status_code = None
+        bytes_received = 0
+        start = time.monotonic()
+        try:
+            async with self._get_session().request(
+                method,
+                self.config.api_url + endpoint,
+                headers=headers,
+                json=json_payload,
+            ) as response:
+                status_code = response.status
+                body = await response.read()
+                bytes_received = len(body)
+                if response.status != 200:
+                    raise classify_error_response(
+                        response.status, body.decode(errors="replace"), response.headers
+                    )
+                return json.loads(body)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            raise BitcoinReserveApiTransientException(repr(e)) from e
+        except ValueError as e:
+            raise BitcoinReserveApiException(
+                f"Invalid response from {endpoint}: {repr(e)}"
+            ) from e
+        except aiohttp.ClientError as e:
+            # e.g. a payload or redirect error; worth another try
+            raise BitcoinReserveApiTransientException(repr(e)) from e
+        finally:
+            api_metrics.observe(
+                method,
+                endpoint,
+                status_code,
+                time.monotonic() - start,
+                bytes_received=bytes_received,
+            )
+
+    async def authenticated_request(
+        self, endpoint: str, method: str = "GET", json_payload: dict = {}
+    ) -> dict:
+        """Same retry / circuit breaker behavior as `BitcoinReserveClient.authenticated_request`"""
+        logger.debug(f"{method} endpoint: {endpoint}")
+
+        # Must explicitly set User-Agent; Swan firewall blocks all requests with "python".
+        auth_header = {
+            "User-Agent": "Specter Desktop",
+            "Authorization": "Token " + self.api_token,
+        }
+
+        retry_policy = self.config.get_retry_policy()
+        circuit_breaker = self.config.get_circuit_breaker()
+        attempt = 0
+        while True:
+            circuit_breaker.before_request()
+            try:
+                result = await self._send_request(
+                    endpoint, method, auth_header, json_payload
+                )
+                circuit_breaker.record_success()
+                return result
+            except BitcoinReserveApiTransientException as e:
+                if isinstance(e, BitcoinReserveApiRateLimitException):
+                    circuit_breaker.record_inconclusive()
+                else:
+                    circuit_breaker.record_failure()
+                delay = retry_policy.get_delay(attempt, method, e)
+                if delay is None:
+                    logger.error(
+                        f"endpoint: {endpoint} | method: {method} | giving up after {attempt + 1} attempt(s): {e}"
+                    )
+                    raise e
+                api_metrics.record_retry(method, endpoint)
+                await asyncio.sleep(delay)
+                attempt += 1
+            except BitcoinReserveApiException as e:
+                circuit_breaker.record_success()
+                logger.error(f"endpoint: {endpoint} | method: {method} | {e}")
+                raise e
+            except asyncio.CancelledError:
+                # Says nothing about the host, but a cancelled probe must still
+                # settle the breaker rather than leave it half-open
+                circuit_breaker.record_inconclusive()
+                raise
+            except BaseException:
+                circuit_breaker.record_failure()
+                raise
+
+    async def get_fiat_balances(self) -> dict:
+        return await self.authenticated_request("/user/balance")
+
+    async def create_quote(
+        self, fiat_amount: Decimal, withdrawal_address: str, fiat_currency: str = "EUR"
+    ) -> dict:
+        return await self.authenticated_request(
+            "/user/order/quote",
+            method="POST",
+            json_payload={
+                "fiat_currency": fiat_currency,
+                "fiat_deliver_amount": str(fiat_amount),
+                "withdrawal_address": withdrawal_address,
+                "withdrawal_method": "ONCHAIN",
+            },
+        )
+
+    async def confirm_order(self, quote_id: str) -> dict:
+        return await self.authenticated_request(
+            "/user/order/confirm", method="POST", json_payload={"quote_id": quote_id}
+        )
+
+    async def get_order_status(self, order_id: str) -> dict:
+        return await self.authenticated_request(
+            "/user/order/status", method="GET", json_payload={"order_id": order_id}
+        )
+
+    async def get_transactions(self, page_num: int = 0) -> list:
+        """See `client.get_transactions`; the first entry is the summary data"""
+        return await self.authenticated_request(f"/api/user/transactions/{page_num}")
+
+    async def get_transaction(self, transaction_id: str) -> dict:
+        return await self.authenticated_request(
+            f"/api/user/transaction/{transaction_id}"
+        )
+
+    async def get_transactions_details(
+        self, transaction_ids: List[str], max_concurrency: int = None
+    ) -> list:
+        """`get_transaction` for each id, at most `max_concurrency` in flight; in order"""
+        semaphore = asyncio.Semaphore(max_concurrency or self.config.sync_concurrency)
+
+        async def fetch(transaction_id: str) -> dict:
+            async with semaphore:
+                return await self.get_transaction(transaction_id)
+
+        return await asyncio.gather(*[fetch(tx_id) for tx_id in transaction_ids])
@@ -0,0 +1,209 @@
+import datetime
+import threading
+
+from array import array
+from typing import TYPE_CHECKING, Dict, Iterable, List, Tuple
+
+from .models import (
+    TransactionDetails,
+    TransactionSummary,
+    get_currency_exponent,
+    to_minor_units,
+)
+
+if TYPE_CHECKING:
+    from .storage import BitcoinReserveTransactionStore
+
+
+# Purchases in these statuses didn't happen and don't count
+EXCLUDED_TRANSACTION_STATUSES = ("FAILED", "CANCELLED", "CANCELED", "REJECTED", "EXPIRED")
+
+PERIODS = ("day", "week", "month", "year")
+
+
+def get_period_start(timestamp: float, period: str) -> str:
+    """The (local) start date of the day / week / month / year `timestamp` falls in"""
+    date = datetime.date.fromtimestamp(timestamp)
+    if period == "week":
+        date -= datetime.timedelta(days=date.weekday())
+    elif period == "month":
+        date = date.replace(day=1)
+    elif period == "year":
+        date = date.replace(month=1, day=1)
+    return date.isoformat()
+
+
+def _ratios(sats: int, fiat: int, currency: str) -> dict:
+    """
+    Average cost (fiat minor units per BTC), sats per fiat unit and the fiat
+    currency's exponent (to display its minor units with)
+    """
+    exponent = get_currency_exponent(currency)
+    return {
+        "average_price": round(fiat * 100_000_000 / sats) if sats else None,
+        "sats_per_fiat": round(sats * 10**exponent / fiat, 2) if fiat else None,
+        "fiat_exponent": exponent,
+    }
+
+
+class BitcoinReserveAnalytics:
+    """
+    Cost basis / DCA aggregates over a user's MARKET BUY records.
+
+    Keeps a columnar copy of the purchases: one typed `array` per field (time,
+    sats, fiat spent, trade fee, withdrawal fee, fiat currency, included), with
+    a row per purchase. Amounts are ints in minor units (sats, cents). Totals
+    per fiat currency are kept up to date incrementally as `add()` is handed the
+    sync's new / changed transactions; a changed purchase is updated in place and
+    its previous values are taken back out of the totals. Per-period aggregates
+    are computed on request in a single pass over the columns.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+        self.times = array("d")
+        self.sats = array("q")
+        self.fiat_spent = array("q")
+        self.trade_fees = array("q")
+        self.withdrawal_fees = array("q")
+        self.currency_ids = array("H")
+        self.included = array("b")
+        self.currencies = []
+        self._totals = {}
+
+    @classmethod
+    def from_store(cls, store: "BitcoinReserveTransactionStore") -> "BitcoinReserveAnalytics":
+        analytics = cls()
+        analytics.add(
+            (row["summary"], row["transaction_time"], row["details"])
+            for row in store.get_transactions(transaction_type="MARKET BUY")
+            if row["details"]
+        )
+        return analytics
+
+    def _get_currency_id(self, currency: str) -> int:
+        if currency not in self.currencies:
+            self.currencies.append(currency)
+        return self.currencies.index(currency)
+
+    def _add_to_totals(self, row: int, sign: int):
+        if not self.included[row]:
+            return
+        currency = self.currencies[self.currency_ids[row]]
+        totals = self._totals.setdefault(
+            currency,
+            {"purchases": 0, "sats": 0, "fiat_spent": 0, "trade_fees": 0, "withdrawal_fees": 0},
+        )
+        totals["purchases"] += sign
+        totals["sats"] += sign * self.sats[row]
+        totals["fiat_spent"] += sign * self.fiat_spent[row]
+        totals["trade_fees"] += sign * self.trade_fees[row]
+        totals["withdrawal_fees"] += sign * self.withdrawal_fees[row]
+
+    def add(self, transactions: Iterable[Tuple[dict, float, dict]]) -> int:
+        """
+        Add or update (summary, transaction_time, details) entries; anything that
+        isn't a MARKET BUY with details is ignored. Returns the number of purchases
+        added or updated.
+        """
+        count = 0
+        with self._lock:
+            for summary, transaction_time, details in transactions:
+                if not details:
+                    continue
+                summary = TransactionSummary(summary) if isinstance(summary, dict) else summary
+                details = TransactionDetails(details) if isinstance(details, dict) else details
+                if (summary.transaction_type or details.transaction_type) != "MARKET BUY":
+                    continue
+
+                values = (
+                    transaction_time,
+                    details.sats_bought or 0,
+                    details.fiat_spent or 0,
+                    # Not in the documented detail record, but counted if it's there
+                    to_minor_units(details.get("trade_fee_amount"), details.fiat_currency) or 0,
+                    sum(withdrawal.withdrawal_fee or 0 for withdrawal in details.withdrawals),
+                    self._get_currency_id(details.fiat_currency or ""),
+                    summary.transaction_status not in EXCLUDED_TRANSACTION_STATUSES,
+                )
+                columns = (
+                    self.times,
+                    self.sats,
+                    self.fiat_spent,
+                    self.trade_fees,
+                    self.withdrawal_fees,
+                    self.currency_ids,
+                    self.included,
+                )
+                row = self._rows.get(summary.transaction_id)
+                if row is None:
+                    row = self._rows[summary.transaction_id] = len(self.times)
+                    for column, value in zip(columns, values):
+                        column.append(value)
+                else:
+                    self._add_to_totals(row, -1)
+                    for column, value in zip(columns, values):
+                        column[row] = value
+                self._add_to_totals(row, 1)
+                count += 1
+        return count
+
+    def __len__(self):
+        with self._lock:
+            return len(self.times)
+
+    def get_totals(self) -> Dict[str, dict]:
+        """
+        Per fiat currency: number of purchases, sats bought, fiat spent, trade and
+        withdrawal fees, average price (fiat minor units per BTC), sats per fiat
+        unit and the currency's exponent
+        """
+        with self._lock:
+            return {
+                currency: dict(
+                    totals, **_ratios(totals["sats"], totals["fiat_spent"], currency)
+                )
+                for currency, totals in self._totals.items()
+                if totals["purchases"]
+            }
+
+    def get_periods(self, period: str = "month") -> List[dict]:
+        """The same aggregates per day / week / month / year and currency, oldest first"""
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+        periods = {}
+        with self._lock:
+            for row, (transaction_time, currency_id, included) in enumerate(
+                zip(self.times, self.currency_ids, self.included)
+            ):
+                if not included:
+                    continue
+                key = (get_period_start(transaction_time, period), self.currencies[currency_id])
+                totals = periods.get(key)
+                if totals is None:
+                    totals = periods[key] = [0, 0, 0, 0, 0]
+                totals[0] += 1
+                totals[1] += self.sats[row]
+                totals[2] += self.fiat_spent[row]
+                totals[3] += self.trade_fees[row]
+                totals[4] += self.withdrawal_fees[row]
+        return [
+            dict(
+                period_start=period_start,
+                currency=currency,
+                purchases=purchases,
+                sats=sats,
+                fiat_spent=fiat_spent,
+                trade_fees=trade_fees,
+                withdrawal_fees=withdrawal_fees,
+                **_ratios(sats, fiat_spent, currency),
+            )
+            for (period_start, currency), (
+                purchases,
+                sats,
+                fiat_spent,
+                trade_fees,
+                withdrawal_fees,
+            ) in sorted(periods.items())
+        ]
@@ -0,0 +1,453 @@
+"""
+Bitcoin Reserve API client that needs no Flask app or request context.
+
+A `BitcoinReserveClient` is built from a `BitcoinReserveApiConfig` and a credential
+provider, both plain picklable objects, so it can be handed to (or constructed in)
+a worker process:
+
+    client = BitcoinReserveClient(config, ApiTokenCredentials(api_token))
+    with ProcessPoolExecutor() as executor:
+        executor.submit(fetch_sync_changes, client, cursor)
+
+The module functions in `client.py` are thin wrappers that build one from the
+Flask app config and the current user's credentials.
+
+Connection pools, the response cache, circuit breakers and request limiters are
+process-wide and looked up on use; they're never part of a pickled client.
+"""
+import hashlib
+import json
+import logging
+import os
+import requests
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Iterator, List
+from requests.adapters import HTTPAdapter
+
+from .api_config import BitcoinReserveApiConfig
+from .cache import TTLCache
+from .exceptions import (
+    BitcoinReserveApiException,
+    BitcoinReserveApiRateLimitException,
+    BitcoinReserveApiTransientException,
+)
+from .metrics import api_metrics
+from .models import TransactionSummary
+from .resilience import IDEMPOTENT_METHODS, SingleFlight, classify_error_response
+
+
+logger = logging.getLogger(__name__)
+
+
+# One pooled keep-alive Session per process, shared by every thread
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size: int = 10) -> requests.Session:
+    """
+    Returns the process-wide `requests.Session` used for all Bitcoin Reserve API
+    calls. Connections are kept alive and reused so that each call doesn't pay for
+    a new TCP+TLS handshake; `pool_size` only applies when the Session is created.
+
+    The Session is rebuilt if we find ourselves in a forked child process; urllib3
+    connection pools must not be shared across processes.
+    """
+    global _session, _session_pid
+    if _session is not None and _session_pid == os.getpid():
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Connection": "keep-alive"})
+            _session = session
+            _session_pid = os.getpid()
+    return _session
+
+
+def close_session():
+    """Drop the pooled Session (e.g. on shutdown or after a config change)"""
+    global _session, _session_pid
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _session_pid = None
+
+
+# Short-lived cache of GET responses; see BitcoinReserveClient.cached_request()
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache(max_entries: int = 1024) -> TTLCache:
+    """The process-wide response cache; `max_entries` only applies when it's created"""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = TTLCache(max_entries=max_entries)
+    return _response_cache
+
+
+# Identical GETs in flight at the same time share one upstream call; see
+# BitcoinReserveClient.authenticated_request()
+_single_flight = None
+_single_flight_pid = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """
+    The process-wide SingleFlight. Rebuilt in a forked child, where the threads
+    making the parent's in-flight calls don't exist and would never finish them.
+    """
+    global _single_flight, _single_flight_pid
+    if _single_flight is not None and _single_flight_pid == os.getpid():
+        return _single_flight
+    with _single_flight_lock:
+        if _single_flight is None or _single_flight_pid != os.getpid():
+            _single_flight = SingleFlight()
+            _single_flight_pid = os.getpid()
+    return _single_flight
+
+
+def cache_owner(api_token: str) -> str:
+    # Cache entries (and request limiter slots) are per user; key on a digest
+    # rather than the token itself
+    return hashlib.sha256(api_token.encode()).hexdigest()[:16]
+
+
+class ApiTokenCredentials:
+    """
+    Credential provider for a fixed api_token. Anything with a `get_api_token()`
+    method will do; this one is picklable, so mind where you send it.
+    """
+
+    def __init__(self, api_token: str):
+        self.api_token = api_token
+
+    def get_api_token(self) -> str:
+        return self.api_token
+
+    def __repr__(self):
+        # Keep the token out of logs and tracebacks
+        return f"{self.__class__.__name__}(api_token=...)"
+
+
+class BitcoinReserveClient:
+    def __init__(self, config: BitcoinReserveApiConfig, credentials):
+        self.config = config
+        self.credentials = credentials
+
+    @classmethod
+    def for_api_token(
+        cls, config: BitcoinReserveApiConfig, api_token: str
+    ) -> "BitcoinReserveClient":
+        return cls(config, ApiTokenCredentials(api_token))
+
+    @property
+    def api_token(self) -> str:
+        return self.credentials.get_api_token()
+
+    def _request_key(self, endpoint: str, method: str, json_payload: dict) -> tuple:
+        """Identifies identical requests by the same user (for caching / coalescing)"""
+        return (
+            cache_owner(self.api_token),
+            endpoint,
+            method,
+            json.dumps(json_payload, sort_keys=True, default=str),
+        )
+
+    def _send_request(
+        self, endpoint: str, method: str, headers: dict, json_payload: dict
+    ) -> dict:
+        """
+        A single attempt. Every failure is raised as a BitcoinReserveApiException;
+        the ones worth retrying as BitcoinReserveApiTransientException.
+        """
+        response = None
+        start = time.monotonic()
+        try:
+            response = get_session(self.config.pool_size).request(
+                method=method,
+                url=self.config.api_url + endpoint,
+                headers=headers,
+                json=json_payload,
+                timeout=(self.config.connect_timeout, self.config.read_timeout),
+            )
+            if response.status_code != 200:
+                raise classify_error_response(
+                    response.status_code, response.text, response.headers
+                )
+            return response.json()
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise BitcoinReserveApiTransientException(repr(e)) from e
+        except ValueError as e:
+            # 200 but the body isn't json (requests' JSONDecodeError is a ValueError too)
+            raise BitcoinReserveApiException(f"Invalid response from {endpoint}: {repr(e)}") from e
+        except requests.RequestException as e:
+            # e.g. ChunkedEncodingError, TooManyRedirects: the exchange broke down
+            # somewhere along the way; worth another try
+            raise BitcoinReserveApiTransientException(repr(e)) from e
+        finally:
+            api_metrics.observe(
+                method,
+                endpoint,
+                response.status_code if response is not None else None,
+                time.monotonic() - start,
+                bytes_sent=len(response.request.body or b"") if response is not None else 0,
+                bytes_received=len(response.content) if response is not None else 0,
+            )
+
+    def authenticated_request(
+        self, endpoint: str, method: str = "GET", json_payload: dict = {}
+    ) -> dict:
+        """
+        Transient failures are retried per the configured RetryPolicy (idempotent
+        requests only, except for 429s) and tracked by the API host's CircuitBreaker,
+        which fails fast with BitcoinReserveApiCircuitOpenException while the
+        upstream is down.
+
+        At most `config.max_concurrent_requests` are in flight at once across all
+        users in this process; see FairRequestLimiter.
+
+        Idempotent requests are coalesced: if the same user already has an identical
+        request in flight (several tabs, or a sync and a page render at once), this
+        waits for it and shares its result or exception rather than sending another.
+        """
+        if method not in IDEMPOTENT_METHODS:
+            return self._authenticated_request(endpoint, method, json_payload)
+
+        key = self._request_key(endpoint, method, json_payload)
+        result, shared = get_single_flight().do(
+            key, lambda: self._authenticated_request(endpoint, method, json_payload)
+        )
+        if shared:
+            logger.debug(f"{method} endpoint: {endpoint} | shared an in-flight request")
+            api_metrics.record_coalesced(method, endpoint)
+        return result
+
+    def _authenticated_request(
+        self, endpoint: str, method: str, json_payload: dict
+    ) -> dict:
+        logger.debug(f"{method} endpoint: {endpoint}")
+        api_token = self.api_token
+
+        # Must explicitly set User-Agent; Swan firewall blocks all requests with "python".
+        auth_header = {
+            "User-Agent": "Specter Desktop",
+            "Authorization": "Token " + api_token,
+        }
+
+        retry_policy = self.config.get_retry_policy()
+        circuit_breaker = self.config.get_circuit_breaker()
+        request_limiter = self.config.get_request_limiter()
+        owner = cache_owner(api_token)
+        attempt = 0
+        while True:
+            circuit_breaker.before_request()
+            try:
+                # Holds one of the process-wide slots only while the request is in flight
+                with request_limiter.slot(owner):
+                    result = self._send_request(endpoint, method, auth_header, json_payload)
+                circuit_breaker.record_success()
+                return result
+            except BitcoinReserveApiTransientException as e:
+                if isinstance(e, BitcoinReserveApiRateLimitException):
+                    # Throttled (maybe just this user): the host is up, so this
+                    # mustn't open the circuit for everyone. Retry-After is honored
+                    # by the retry policy.
+                    circuit_breaker.record_inconclusive()
+                else:
+                    circuit_breaker.record_failure()
+                delay = retry_policy.get_delay(attempt, method, e)
+                if delay is None:
+                    logger.error(
+                        f"endpoint: {endpoint} | method: {method} | giving up after {attempt + 1} attempt(s): {e}"
+                    )
+                    raise e
+                logger.warning(
+                    f"endpoint: {endpoint} | method: {method} | retrying in {delay:.2f}s: {e}"
+                )
+                api_metrics.record_retry(method, endpoint)
+                time.sleep(delay)
+                attempt += 1
+            except BitcoinReserveApiException as e:
+                # The upstream is up; it just didn't like this request
+                circuit_breaker.record_success()
+                logger.error(
+                    f"endpoint: {endpoint} | method: {method} | payload: {json.dumps(json_payload, default=str)} | {e}"
+                )
+                raise e
+            except BaseException:
+                # Anything unexpected still has to settle the breaker; a half-open
+                # probe that never reports back would keep the circuit from closing
+                circuit_breaker.record_failure()
+                raise
+
+    def cached_request(
+        self, endpoint: str, method: str = "GET", json_payload: dict = {}
+    ) -> dict:
+        """
+        `authenticated_request` served from the response cache, keyed on
+        (user, endpoint, payload). Each endpoint's TTL is configured in
+        `config.cache_ttls`; endpoints not listed there aren't cached.
+        """
+        ttl = self.config.cache_ttls.get(endpoint)
+        if not ttl:
+            return self.authenticated_request(
+                endpoint, method=method, json_payload=json_payload
+            )
+
+        key = self._request_key(endpoint, method, json_payload)
+        cache = get_response_cache(self.config.cache_max_entries)
+        hit, response = cache.get(key)
+        if hit:
+            return response
+
+        response = self.authenticated_request(
+            endpoint, method=method, json_payload=json_payload
+        )
+        cache.set(key, response, ttl)
+        return response
+
+    def invalidate_cache(self):
+        """Drop this user's cached responses"""
+        owner = cache_owner(self.api_token)
+        get_response_cache(self.config.cache_max_entries).invalidate(
+            lambda key: key[0] == owner
+        )
+
+    def get_fiat_balances(self) -> dict:
+        return self.cached_request("/user/balance")
+
+    def create_quote(
+        self, fiat_amount: Decimal, withdrawal_address: str, fiat_currency: str = "EUR"
+    ) -> dict:
+        return self.authenticated_request(
+            "/user/order/quote",
+            method="POST",
+            json_payload={
+                "fiat_currency": fiat_currency,
+                "fiat_deliver_amount": str(fiat_amount),
+                "withdrawal_address": withdrawal_address,
+                "withdrawal_method": "ONCHAIN",
+            },
+        )
+
+    def confirm_order(self, quote_id: str) -> dict:
+        response = self.authenticated_request(
+            "/user/order/confirm",
+            method="POST",
+            json_payload={"quote_id": quote_id},
+        )
+
+        # Balance and order statuses have changed; don't serve stale copies
+        self.invalidate_cache()
+        return response
+
+    def get_order_status(self, order_id: str, use_cache: bool = True) -> dict:
+        request = self.cached_request if use_cache else self.authenticated_request
+        return request(
+            "/user/order/status", method="GET", json_payload={"order_id": order_id}
+        )
+
+    def get_transactions(self, page_num: int = 0) -> list:
+        """One page of summary rows; the first entry is the page summary"""
+        return self.authenticated_request(f"/api/user/transactions/{page_num}")
+
+    def iter_transactions(
+        self, since: float = None, prefetch: bool = True
+    ) -> Iterator[TransactionSummary]:
+        """
+        Lazily walks every page of `get_transactions`, yielding the transaction
+        summary rows (the per-page summary entry is skipped) as TransactionSummary,
+        each with its `transaction_time` already parsed.
+
+        The API lists transactions newest first, so if `since` is specified we stop
+        as soon as we reach a transaction that is older than that timestamp.
+        Transactions at exactly `since` are still yielded; the caller decides if
+        it's seen them.
+
+        With `prefetch` the next page is requested in the background while the
+        caller is still working through the current one.
+        """
+        executor = None
+        next_page = None
+        if prefetch:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bitcoinreserve")
+
+        try:
+            page_num = 0
+            num_seen = 0
+            page = self.get_transactions(page_num)
+            while page:
+                summary = page[0]
+                total_transaction_count = summary.get("total_transaction_count", 0)
+                rows = [TransactionSummary(row) for row in page[1:]]
+                if not rows:
+                    return
+                num_seen += len(rows)
+
+                has_next_page = num_seen < total_transaction_count
+                if since is not None and rows[-1].transaction_time < since:
+                    # We'll stop somewhere on this page; don't bother with the next one
+                    has_next_page = False
+                if has_next_page and executor:
+                    next_page = executor.submit(self.get_transactions, page_num + 1)
+
+                for tx in rows:
+                    if since is not None and tx.transaction_time < since:
+                        # Everything from here on is older than what the caller already has
+                        return
+                    yield tx
+
+                if not has_next_page:
+                    return
+                page_num += 1
+                if next_page:
+                    page = next_page.result()
+                    next_page = None
+                else:
+                    page = self.get_transactions(page_num)
+        finally:
+            if next_page:
+                next_page.cancel()
+            if executor:
+                executor.shutdown(wait=False)
+
+    def get_transaction(self, transaction_id: str) -> dict:
+        return self.authenticated_request(f"/api/user/transaction/{transaction_id}")
+
+    def get_transactions_details(
+        self, transaction_ids: List[str], max_workers: int = None
+    ) -> list:
+        """
+        Fetches the `get_transaction` detail record for each id, up to `max_workers`
+        (default: `config.sync_concurrency`) requests in flight at once. Results are
+        returned in the same order as `transaction_ids`; the first failed fetch is
+        re-raised.
+        """
+        if not transaction_ids:
+            return []
+
+        if max_workers is None:
+            max_workers = self.config.sync_concurrency
+        max_workers = max(1, min(max_workers, len(transaction_ids)))
+        if max_workers == 1:
+            return [self.get_transaction(transaction_id) for transaction_id in transaction_ids]
+
+        with ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="bitcoinreserve"
+        ) as executor:
+            return list(executor.map(self.get_transaction, transaction_ids))
@@ -0,0 +1,104 @@
+from dataclasses import dataclass, field
+from typing import Mapping
+
+from .config import BaseConfig
+from .resilience import (
+    CircuitBreaker,
+    FairRequestLimiter,
+    RetryPolicy,
+    get_circuit_breaker,
+    get_request_limiter,
+)
+
+
+@dataclass(frozen=True)
+class BitcoinReserveApiConfig:
+    """
+    Everything a Bitcoin Reserve API client needs to know, decoupled from the Flask
+    app config so that it can be built once and handed to code running outside of
+    an app context (e.g. pickled into a worker process; see BitcoinReserveClient).
+    The defaults are config.BaseConfig's.
+    """
+
+    api_url: str = BaseConfig.BITCOIN_RESERVE_API_URL
+    pool_size: int = BaseConfig.BITCOIN_RESERVE_API_POOL_SIZE
+    connect_timeout: float = BaseConfig.BITCOIN_RESERVE_API_CONNECT_TIMEOUT
+    read_timeout: float = BaseConfig.BITCOIN_RESERVE_API_READ_TIMEOUT
+    sync_concurrency: int = BaseConfig.BITCOIN_RESERVE_SYNC_CONCURRENCY
+    max_concurrent_requests: int = BaseConfig.BITCOIN_RESERVE_API_MAX_CONCURRENT_REQUESTS
+    max_retries: int = BaseConfig.BITCOIN_RESERVE_API_MAX_RETRIES
+    backoff_base: float = BaseConfig.BITCOIN_RESERVE_API_BACKOFF_BASE
+    backoff_max: float = BaseConfig.BITCOIN_RESERVE_API_BACKOFF_MAX
+    max_retry_after: float = BaseConfig.BITCOIN_RESERVE_API_MAX_RETRY_AFTER
+    circuit_failure_threshold: int = BaseConfig.BITCOIN_RESERVE_API_CIRCUIT_FAILURE_THRESHOLD
+    circuit_reset_timeout: float = BaseConfig.BITCOIN_RESERVE_API_CIRCUIT_RESET_TIMEOUT
+    cache_ttls: Mapping[str, float] = field(
+        default_factory=lambda: dict(BaseConfig.BITCOIN_RESERVE_CACHE_TTLS)
+    )
+    cache_max_entries: int = BaseConfig.BITCOIN_RESERVE_CACHE_MAX_ENTRIES
+
+    @classmethod
+    def from_app_config(cls, config) -> "BitcoinReserveApiConfig":
+        """Build from a Flask `app.config` (or any dict) using the BITCOIN_RESERVE_* keys"""
+        defaults = cls()
+        return cls(
+            api_url=config.get("BITCOIN_RESERVE_API_URL", defaults.api_url),
+            pool_size=config.get("BITCOIN_RESERVE_API_POOL_SIZE", defaults.pool_size),
+            connect_timeout=config.get(
+                "BITCOIN_RESERVE_API_CONNECT_TIMEOUT", defaults.connect_timeout
+            ),
+            read_timeout=config.get(
+                "BITCOIN_RESERVE_API_READ_TIMEOUT", defaults.read_timeout
+            ),
+            sync_concurrency=config.get(
+                "BITCOIN_RESERVE_SYNC_CONCURRENCY", defaults.sync_concurrency
+            ),
+            max_concurrent_requests=config.get(
+                "BITCOIN_RESERVE_API_MAX_CONCURRENT_REQUESTS",
+                defaults.max_concurrent_requests,
+            ),
+            max_retries=config.get(
+                "BITCOIN_RESERVE_API_MAX_RETRIES", defaults.max_retries
+            ),
+            backoff_base=config.get(
+                "BITCOIN_RESERVE_API_BACKOFF_BASE", defaults.backoff_base
+            ),
+            backoff_max=config.get(
+                "BITCOIN_RESERVE_API_BACKOFF_MAX", defaults.backoff_max
+            ),
+            max_retry_after=config.get(
+                "BITCOIN_RESERVE_API_MAX_RETRY_AFTER", defaults.max_retry_after
+            ),
+            circuit_failure_threshold=config.get(
+                "BITCOIN_RESERVE_API_CIRCUIT_FAILURE_THRESHOLD",
+                defaults.circuit_failure_threshold,
+            ),
+            circuit_reset_timeout=config.get(
+                "BITCOIN_RESERVE_API_CIRCUIT_RESET_TIMEOUT",
+                defaults.circuit_reset_timeout,
+            ),
+            cache_ttls=dict(config.get("BITCOIN_RESERVE_CACHE_TTLS", defaults.cache_ttls)),
+            cache_max_entries=config.get(
+                "BITCOIN_RESERVE_CACHE_MAX_ENTRIES", defaults.cache_max_entries
+            ),
+        )
+
+    def get_retry_policy(self) -> RetryPolicy:
+        return RetryPolicy(
+            max_retries=self.max_retries,
+            backoff_base=self.backoff_base,
+            backoff_max=self.backoff_max,
+            max_retry_after=self.max_retry_after,
+        )
+
+    def get_circuit_breaker(self) -> CircuitBreaker:
+        return get_circuit_breaker(
+            self.api_url,
+            failure_threshold=self.circuit_failure_threshold,
+            reset_timeout=self.circuit_reset_timeout,
+        )
+
+    def get_request_limiter(self) -> FairRequestLimiter:
+        return get_request_limiter(
+            self.api_url, max_concurrent=self.max_concurrent_requests
+        )
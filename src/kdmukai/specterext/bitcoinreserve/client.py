@@ -1,57 +1,78 @@
-import json
+"""
+Bitcoin Reserve API calls on behalf of the current user (or an explicit
+`api_token`), configured from the Flask app config.
+
+Each function is a thin wrapper around a `BitcoinReserveClient` (see api_client.py);
+code that has to run without an app or request context (e.g. in a worker process)
+should use a client directly.
+"""
 import logging
-import requests
 
 from decimal import Decimal
+from typing import Iterator, List
 from flask import current_app as app
-from werkzeug.wrappers import auth
 
 from kdmukai.specterext.bitcoinreserve.service import BitcoinReserveService
 
+from .api_client import ApiTokenCredentials, BitcoinReserveClient
+from .api_client import get_response_cache as _get_response_cache
+from .api_config import BitcoinReserveApiConfig
+# Defined here before it moved to exceptions.py; still importable from here
+from .exceptions import BitcoinReserveApiException
+
 
 logger = logging.getLogger(__name__)
 
 
-class BitcoinReserveApiException(Exception):
-    pass
+def get_api_config() -> BitcoinReserveApiConfig:
+    return BitcoinReserveApiConfig.from_app_config(app.config)
+
+
+def get_client(api_token: str = None) -> BitcoinReserveClient:
+    """
+    A client for `api_token` (the current user's, if not specified). `api_token` can
+    be passed in explicitly when calling from a thread that has no request context
+    (and therefore no current_user to look the credentials up for).
+    """
+    if not api_token:
+        api_token = BitcoinReserveService.get_api_credentials().get("api_token")
+    return BitcoinReserveClient(get_api_config(), ApiTokenCredentials(api_token))
+
+
+def get_timeout() -> tuple:
+    """(connect, read) timeouts in seconds; never wait on the upstream indefinitely"""
+    api_config = get_api_config()
+    return (api_config.connect_timeout, api_config.read_timeout)
+
+
+def get_response_cache():
+    return _get_response_cache(get_api_config().cache_max_entries)
+
+
+def invalidate_cache(api_token: str = None):
+    """Drop the user's (the current user's, if not specified) cached responses"""
+    get_client(api_token).invalidate_cache()
 
 
 def authenticated_request(
-    endpoint: str, method: str = "GET", json_payload: dict = {}
+    endpoint: str, method: str = "GET", json_payload: dict = {}, api_token: str = None
 ) -> dict:
-    logger.debug(f"{method} endpoint: {endpoint}")
-
-    api_token = BitcoinReserveService.get_api_credentials().get("api_token")
+    """See BitcoinReserveClient.authenticated_request"""
+    return get_client(api_token).authenticated_request(
+        endpoint, method=method, json_payload=json_payload
+    )
 
-    # Must explicitly set User-Agent; Swan firewall blocks all requests with "python".
-    auth_header = {
-        "User-Agent": "Specter Desktop",
-        "Authorization": "Token " + api_token,
-    }
 
-    url = url=app.config.get("BITCOIN_RESERVE_API_URL") + endpoint
-    logger.debug(url)
-    logger.debug(auth_header)
-
-    try:
-        response = requests.request(
-            method=method,
-            url=url,
-            headers=auth_header,
-            json=json_payload,
-        )
-        if response.status_code != 200:
-            raise BitcoinReserveApiException(f"{response.status_code}: {response.text}")
-        print(json.dumps(response.json(), indent=4))
-        return response.json()
-    except Exception as e:
-        # TODO: tighten up expected Exceptions
-        logger.exception(e)
-        logger.error(
-            f"endpoint: {endpoint} | method: {method} | payload: {json.dumps(json_payload, indent=4)}"
-        )
-        logger.error(f"{response.status_code}: {response.text}")
-        raise e
+def cached_request(
+    endpoint: str, method: str = "GET", json_payload: dict = {}, api_token: str = None
+) -> dict:
+    """
+    `authenticated_request` served from the response cache; each endpoint's TTL is
+    configured in BITCOIN_RESERVE_CACHE_TTLS (endpoints not listed aren't cached).
+    """
+    return get_client(api_token).cached_request(
+        endpoint, method=method, json_payload=json_payload
+    )
 
 
 """
@@ -65,8 +86,8 @@ OUTPUT:
 """
 
 
-def get_fiat_balances():
-    return authenticated_request("/user/balance")
+def get_fiat_balances(api_token: str = None):
+    return get_client(api_token).get_fiat_balances()
 
 
 """
@@ -85,17 +106,14 @@ OUTPUT:
 
 
 def create_quote(
-    fiat_amount: Decimal, withdrawal_address: str, fiat_currency: str = "EUR"
+    fiat_amount: Decimal,
+    withdrawal_address: str,
+    fiat_currency: str = "EUR",
+    api_token: str = None,
 ):
-    return authenticated_request(
-        "/user/order/quote",
-        method="POST",
-        json_payload={
-            "fiat_currency": fiat_currency,
-            "fiat_deliver_amount": fiat_amount,
-            "withdrawal_address": withdrawal_address,
-            "withdrawal_method": "ONCHAIN",
-        },
+    """Usually obtained via the BitcoinReserveQuoteManager, which reuses quotes"""
+    return get_client(api_token).create_quote(
+        fiat_amount, withdrawal_address, fiat_currency=fiat_currency
     )
 
 
@@ -119,10 +137,8 @@ OUTPUT:
 """
 
 
-def confirm_order(quote_id: str):
-    return authenticated_request(
-        "/user/order/confirm", method="POST", json_payload={"quote_id": quote_id}
-    )
+def confirm_order(quote_id: str, api_token: str = None):
+    return get_client(api_token).confirm_order(quote_id)
 
 
 """
@@ -149,13 +165,12 @@ OUTPUT:
 """
 
 
-def get_order_status(order_id: str):
-    return authenticated_request(
-        "/user/order/status", method="GET", json_payload={"order_id": order_id}
-    )
+def get_order_status(order_id: str, api_token: str = None, use_cache: bool = True):
+    """`use_cache=False` for pollers that need every change; see BitcoinReserveOrderWatcher"""
+    return get_client(api_token).get_order_status(order_id, use_cache=use_cache)
 
 
-def get_transactions(page_num: int = 0) -> list:
+def get_transactions(page_num: int = 0, api_token: str = None) -> list:
     """
         First entry is the summary data:
         [
@@ -176,10 +191,17 @@ def get_transactions(page_num: int = 0) -> list:
             {...},
         ]
     """
-    return authenticated_request(f"/api/user/transactions/{page_num}")
+    return get_client(api_token).get_transactions(page_num)
 
 
-def get_transaction(transaction_id: str) -> dict:
+def iter_transactions(
+    since: float = None, prefetch: bool = True, api_token: str = None
+) -> Iterator[dict]:
+    """See BitcoinReserveClient.iter_transactions"""
+    return get_client(api_token).iter_transactions(since=since, prefetch=prefetch)
+
+
+def get_transaction(transaction_id: str, api_token: str = None) -> dict:
     """
         {
             "transaction_type": "MARKET BUY",
@@ -200,4 +222,20 @@ def get_transaction(transaction_id: str) -> dict:
             }
         }
     """
-    return authenticated_request(f"/api/user/transaction/{transaction_id}")
+    return get_client(api_token).get_transaction(transaction_id)
+
+
+def get_transactions_details(
+    transaction_ids: List[str], max_workers: int = None, api_token: str = None
+) -> list:
+    """
+    Fetches the `get_transaction` detail record for each id, up to `max_workers`
+    (default: BITCOIN_RESERVE_SYNC_CONCURRENCY) requests in flight at once. Results
+    are returned in the same order as `transaction_ids`; the first failed fetch is
+    re-raised.
+    """
+    if not transaction_ids:
+        return []
+    return get_client(api_token).get_transactions_details(
+        transaction_ids, max_workers=max_workers
+    )
@@ -10,6 +10,62 @@ class BaseConfig:
     # BITCOIN_RESERVE_API_URL = "http://46.101.227.39"
     BITCOIN_RESERVE_API_URL = "https://bitcoinreserve.com"
 
+    # Max keep-alive connections held open to BITCOIN_RESERVE_API_URL per process
+    BITCOIN_RESERVE_API_POOL_SIZE = 10
+
+    # Seconds to wait for the TCP/TLS connect and for each read, respectively
+    BITCOIN_RESERVE_API_CONNECT_TIMEOUT = 5
+    BITCOIN_RESERVE_API_READ_TIMEOUT = 30
+
+    # Transient failures (timeouts, 5xx, 429) of idempotent requests are retried
+    # with exponential backoff + jitter; a 429's Retry-After is honored up to
+    # BITCOIN_RESERVE_API_MAX_RETRY_AFTER seconds.
+    BITCOIN_RESERVE_API_MAX_RETRIES = 3
+    BITCOIN_RESERVE_API_BACKOFF_BASE = 0.5
+    BITCOIN_RESERVE_API_BACKOFF_MAX = 10
+    BITCOIN_RESERVE_API_MAX_RETRY_AFTER = 30
+
+    # Fail fast for BITCOIN_RESERVE_API_CIRCUIT_RESET_TIMEOUT seconds after this
+    # many consecutive transient failures
+    BITCOIN_RESERVE_API_CIRCUIT_FAILURE_THRESHOLD = 5
+    BITCOIN_RESERVE_API_CIRCUIT_RESET_TIMEOUT = 30
+
+    # In-memory cache of API responses: seconds each endpoint's responses are
+    # reused for (endpoints not listed aren't cached) and max entries overall.
+    BITCOIN_RESERVE_CACHE_TTLS = {
+        "/user/balance": 30,
+        "/user/order/status": 5,
+    }
+    BITCOIN_RESERVE_CACHE_MAX_ENTRIES = 1024
+
+    # Max concurrent transaction-detail requests per user during a sync
+    BITCOIN_RESERVE_SYNC_CONCURRENCY = 4
+    # ...and max requests in flight across all users, shared out round-robin
+    BITCOIN_RESERVE_API_MAX_CONCURRENT_REQUESTS = 8
+
+    # Background sync: seconds between incremental syncs of all users, +/- jitter
+    BITCOIN_RESERVE_SYNC_INTERVAL = 600
+    BITCOIN_RESERVE_SYNC_JITTER = 60
+    # Threads running user syncs off the request thread (users synced at once)
+    BITCOIN_RESERVE_SYNC_WORKERS = 4
+
+    # Balance / holdings time series: [(resolution, horizon), ...] in seconds; raw
+    # samples older than a day are rolled up into hourly points, hourly points
+    # older than a week into daily ones
+    BITCOIN_RESERVE_SERIES_ROLLUPS = [(3600, 24 * 3600), (24 * 3600, 7 * 24 * 3600)]
+
+    # Flash buy quotes are reused until this many seconds before they expire, and
+    # refreshed in the background for as long as they were asked for within the
+    # last BITCOIN_RESERVE_QUOTE_KEEPALIVE seconds (i.e. the page is still open)
+    BITCOIN_RESERVE_QUOTE_EXPIRY_MARGIN = 5
+    BITCOIN_RESERVE_QUOTE_KEEPALIVE = 30
+
+    # Open orders are polled every MIN_INTERVAL seconds after each change, backing
+    # off by BACKOFF per unchanged poll up to MAX_INTERVAL (or the withdrawal_eta)
+    BITCOIN_RESERVE_ORDER_POLL_MIN_INTERVAL = 2
+    BITCOIN_RESERVE_ORDER_POLL_MAX_INTERVAL = 300
+    BITCOIN_RESERVE_ORDER_POLL_BACKOFF = 1.5
+
 class ProductionConfig(BaseConfig):
     ''' This is a extension-based Config for Production '''
     BITCOIN_RESERVE_API_URL = "https://bitcoinreserve.com"
@@ -1,17 +1,31 @@
+import datetime
+import hashlib
 import logging
-from flask import redirect, render_template, request, url_for, flash
+import time
+from decimal import Decimal, InvalidOperation
+from flask import jsonify, redirect, render_template, request, url_for, flash
 from flask import current_app as app
 from flask_login import login_required, current_user
 from functools import wraps
+from typing import TYPE_CHECKING
 
 from cryptoadvance.specter.services.controller import user_secret_decrypted_required
 from cryptoadvance.specter.services.service_encrypted_storage import ServiceEncryptedStorageError
-from cryptoadvance.specter.user import User
-from cryptoadvance.specter.wallet import Wallet
 
-from kdmukai.specterext.bitcoinreserve.client import BitcoinReserveApiException
+# Not from client.py: the API client (and with it the HTTP stack) is only imported
+# by the routes that call the API, on first use, not when the blueprint is loaded
+from kdmukai.specterext.bitcoinreserve.exceptions import (
+    BitcoinReserveApiException,
+    BitcoinReserveQuoteChangedException,
+)
+from kdmukai.specterext.bitcoinreserve.metrics import api_metrics
+from .analytics import PERIODS
+from .export import EXPORT_FORMATS, iter_api_transactions, iter_export, iter_store_transactions
 from .service import BitcoinReserveService
 
+if TYPE_CHECKING:
+    from cryptoadvance.specter.wallet import Wallet
+
 
 logger = logging.getLogger(__name__)
 
@@ -92,21 +106,151 @@ def transactions():
     # The wallet currently configured for ongoing autowithdrawals
     wallet: Wallet = BitcoinReserveService.get_associated_wallet()
 
+    # Served from the locally synced history; no API round trip
+    store = BitcoinReserveService.get_transaction_store()
+
     return render_template(
         "bitcoinreserve/transactions.jinja",
         wallet=wallet,
+        bitcoinreserve_transactions=store.get_transactions(limit=50),
+        bitcoinreserve_transactions_total=store.count(),
         services=app.specter.service_manager.services,
     )
 
 
 
 
+@bitcoinreserve_endpoint.route("/stats")
+@login_required
+@user_secret_decrypted_required
+def stats():
+    """Cost basis, fees and per-period DCA aggregates of the synced purchases"""
+    period = request.args.get("period", "month")
+    if period not in PERIODS:
+        period = "month"
+    analytics = BitcoinReserveService.get_analytics()
+    return render_template(
+        "bitcoinreserve/stats.jinja",
+        totals=analytics.get_totals(),
+        periods=analytics.get_periods(period),
+        period=period,
+        period_choices=PERIODS,
+    )
+
+
 @bitcoinreserve_endpoint.route("/flash_buy")
 @login_required
 @api_key_required
 def flash_buy():
+    wallet: Wallet = BitcoinReserveService.get_associated_wallet()
     return render_template(
-        "bitcoinreserve/index.jinja",
+        "bitcoinreserve/flash_buy.jinja",
+        wallet=wallet,
+        withdrawal_address=wallet.address if wallet else None,
+    )
+
+
+
+def _get_flash_buy_order(args) -> dict:
+    """The (fiat_amount, fiat_currency, withdrawal_address) of a flash buy request"""
+    try:
+        fiat_amount = Decimal(args.get("fiat_amount", ""))
+    except InvalidOperation:
+        raise ValueError("fiat_amount must be a number")
+    if not fiat_amount.is_finite() or fiat_amount <= 0:
+        raise ValueError("fiat_amount must be greater than zero")
+    withdrawal_address = (args.get("withdrawal_address") or "").strip()
+    if not withdrawal_address:
+        raise ValueError("withdrawal_address is required")
+    return dict(
+        fiat_amount=fiat_amount,
+        fiat_currency=(args.get("fiat_currency") or "EUR").upper(),
+        withdrawal_address=withdrawal_address,
+    )
+
+
+@bitcoinreserve_endpoint.route("/flash_buy/quote", methods=["GET"])
+@login_required
+@api_key_required
+def flash_buy_quote():
+    """
+    A quote for the order as json. Served from the quote manager's cache while it's
+    still valid; polling this keeps the quote refreshed in the background.
+    """
+    try:
+        order = _get_flash_buy_order(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    user = app.specter.user_manager.get_user()
+    try:
+        quote = BitcoinReserveService.get_quote_manager().get_quote(
+            user.id,
+            BitcoinReserveService.get_api_credentials().get("api_token"),
+            **order,
+        )
+    except BitcoinReserveApiException as e:
+        logger.debug(repr(e))
+        return jsonify({"error": str(e)}), 502
+
+    return jsonify(_with_expires_in(quote))
+
+
+def _with_expires_in(quote: dict) -> dict:
+    quote["expires_in"] = max(0, int(quote["expiration_time_utc"] - time.time()))
+    return quote
+
+
+@bitcoinreserve_endpoint.route("/flash_buy/confirm", methods=["POST"])
+@login_required
+@api_key_required
+def flash_buy_confirm():
+    """
+    Confirms the quote the user was shown (`quote_id`). If it has been replaced or
+    has expired in the meantime nothing is bought; the 409 response carries the
+    current quote for the user to review and confirm instead.
+    """
+    try:
+        order = _get_flash_buy_order(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    quote_id = request.form.get("quote_id")
+    if not quote_id:
+        return jsonify({"error": "quote_id is required"}), 400
+
+    user = app.specter.user_manager.get_user()
+    try:
+        response = BitcoinReserveService.get_quote_manager().confirm_order(
+            user.id,
+            BitcoinReserveService.get_api_credentials().get("api_token"),
+            quote_id=quote_id,
+            **order,
+        )
+    except BitcoinReserveQuoteChangedException as e:
+        return jsonify({"error": str(e), "quote": _with_expires_in(e.quote)}), 409
+    except BitcoinReserveApiException as e:
+        logger.debug(repr(e))
+        return jsonify({"error": str(e)}), 502
+    return jsonify(response)
+
+
+
+@bitcoinreserve_endpoint.route("/orders/<order_id>/events", methods=["GET"])
+@login_required
+@api_key_required
+def order_events(order_id):
+    """
+    Server-sent events with the order's status whenever it changes, until it's
+    final. All of a user's tabs watching the same order share a single poller.
+    """
+    user = app.specter.user_manager.get_user()
+    subscription = BitcoinReserveService.get_order_watcher().subscribe(
+        user.id, order_id, BitcoinReserveService.get_api_credentials().get("api_token")
+    )
+    return app.response_class(
+        subscription.events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
@@ -145,3 +289,179 @@ def settings_post():
         wallet = current_user.wallet_manager.get_by_alias(used_wallet_alias)
         BitcoinReserveService.set_associated_wallet(wallet)
     return redirect(url_for(f"{ BitcoinReserveService.get_blueprint_name()}.settings_get"))
+
+
+
+def _parse_time_arg(value: str) -> float:
+    """A unix timestamp or an ISO date(time) like "2022-01-18"; same local time as the synced data"""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+@bitcoinreserve_endpoint.route("/transactions/data", methods=["GET"])
+@login_required
+@user_secret_decrypted_required
+def transactions_data():
+    """
+    One page of the locally synced history as json, newest first.
+
+    Query args: `page` (0-based), `per_page` (max 200), `since` / `until` (unix
+    timestamp or ISO date; since <= transaction_time < until), `type` and `status`.
+
+    Sends an ETag derived from the store's revision and the query; a matching
+    If-None-Match gets a 304 without reading any transactions.
+    """
+    try:
+        page = max(0, int(request.args.get("page", 0)))
+        per_page = min(200, max(1, int(request.args.get("per_page", 50))))
+        filters = dict(
+            since=_parse_time_arg(request.args.get("since")),
+            until=_parse_time_arg(request.args.get("until")),
+            transaction_type=request.args.get("type") or None,
+            transaction_status=request.args.get("status") or None,
+        )
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+
+    store = BitcoinReserveService.get_transaction_store()
+    etag = hashlib.sha256(
+        f"{store.path}|{store.get_revision()}|{page}|{per_page}|{sorted(filters.items())}".encode()
+    ).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        total = store.count(**filters)
+        response = jsonify(
+            {
+                "transactions": store.get_transactions(
+                    limit=per_page, offset=page * per_page, **filters
+                ),
+                "page": page,
+                "per_page": per_page,
+                "total": total,
+                "pages": -(-total // per_page),
+            }
+        )
+    response.set_etag(etag)
+    # Private to this user; the browser may keep it but has to revalidate
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@bitcoinreserve_endpoint.route("/transactions/export", methods=["GET"])
+@login_required
+@user_secret_decrypted_required
+def transactions_export():
+    """
+    The full history as a CSV or JSONL download, streamed as it's read.
+
+    Query args: `format` ("csv" or "jsonl"), `since` / `until` (unix timestamp or
+    ISO date; since <= transaction_time < until), `type` and `status`, and `source`:
+    "store" (default; the locally synced history, with detail records) or "api"
+    (the API's summary rows, paged through as they're written out).
+    """
+    export_format = request.args.get("format", "csv")
+    source = request.args.get("source", "store")
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        since = _parse_time_arg(request.args.get("since"))
+        until = _parse_time_arg(request.args.get("until"))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+
+    if source == "store":
+        transactions = iter_store_transactions(
+            BitcoinReserveService.get_transaction_store(),
+            since=since,
+            until=until,
+            transaction_type=request.args.get("type") or None,
+            transaction_status=request.args.get("status") or None,
+        )
+    elif source == "api":
+        from . import client as bitcoinreserve_client
+
+        api_token = BitcoinReserveService.get_api_credentials().get("api_token")
+        if not api_token:
+            return jsonify({"error": "No Bitcoin Reserve API token configured"}), 400
+        # The client needs no app context, so the generator can run after this returns
+        transactions = iter_api_transactions(
+            bitcoinreserve_client.get_client(api_token), since=since, until=until
+        )
+    else:
+        return jsonify({"error": "source must be store or api"}), 400
+
+    filename = f"bitcoinreserve_transactions_{datetime.date.today().isoformat()}.{export_format}"
+    return app.response_class(
+        iter_export(transactions, export_format),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "private, no-store",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+
+@bitcoinreserve_endpoint.route("/holdings/data", methods=["GET"])
+@login_required
+@user_secret_decrypted_required
+def holdings_data():
+    """
+    The balance / holdings time series as json: {metric: [[time, value], ...]},
+    oldest first. Values are ints (sats, fiat minor units); metrics are
+    "balance:<currency>", "sats_bought" and "fiat_spent:<currency>".
+
+    Query args: `since` / `until` (unix timestamp or ISO date) and `metric`
+    (repeatable). Served from the downsampled local series; no API round trip.
+    """
+    try:
+        since = _parse_time_arg(request.args.get("since"))
+        until = _parse_time_arg(request.args.get("until"))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+
+    store = BitcoinReserveService.get_transaction_store()
+    return jsonify(
+        store.get_series(
+            metrics=request.args.getlist("metric") or None, since=since, until=until
+        )
+    )
+
+
+
+@bitcoinreserve_endpoint.route("/transactions/wallet", methods=["GET"])
+@login_required
+@user_secret_decrypted_required
+def wallet_transactions():
+    """
+    The linked wallet's txs that are Bitcoin Reserve withdrawals, each tagged with
+    the order behind it (one index lookup per tx). `?all=1` returns every tx.
+    """
+    wallet: Wallet = BitcoinReserveService.get_associated_wallet()
+    if not wallet:
+        return jsonify([])
+    withdrawal_index = BitcoinReserveService.get_withdrawal_index()
+    include_all = request.args.get("all") == "1"
+    return jsonify(
+        [
+            tx
+            for tx in wallet.txlist(fetch_transactions=False)
+            if withdrawal_index.tag_tx(tx) or include_all
+        ]
+    )
+
+
+
+@bitcoinreserve_endpoint.route("/metrics", methods=["GET"])
+@login_required
+def metrics():
+    """Per-endpoint latency histograms, byte counts, status codes and retries"""
+    if not current_user.is_admin:
+        return jsonify({"error": "Admin only"}), 403
+    return jsonify(api_metrics.snapshot())
@@ -0,0 +1,83 @@
+from typing import Dict, Iterable, Tuple
+
+
+# Transaction statuses that won't change anymore
+FINAL_TRANSACTION_STATUSES = (
+    "DONE",
+    "COMPLETE",
+    "COMPLETED",
+    "FAILED",
+    "CANCELLED",
+    "CANCELED",
+    "REJECTED",
+    "EXPIRED",
+)
+
+
+class SyncCursor:
+    """
+    Where the last sync left off: a time `watermark` plus the id -> status of every
+    transaction at or after it (`seen`).
+
+    Everything older than the watermark is final and already stored locally. The
+    watermark is the oldest transaction that isn't final yet (or, if they all are,
+    the newest one), so `seen` stays small: usually just the newest transaction(s)
+    and whatever is still pending. A sync only has to look at the summary rows from
+    the watermark on, and only fetches details for rows that are new or whose
+    status changed.
+    """
+
+    def __init__(self, watermark: float = None, seen: Dict[str, str] = None):
+        self.watermark = watermark
+        self.seen = seen or {}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SyncCursor":
+        if not data:
+            return cls()
+        return cls(watermark=data.get("watermark"), seen=dict(data.get("seen") or {}))
+
+    def to_dict(self) -> dict:
+        return {"watermark": self.watermark, "seen": dict(self.seen)}
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, SyncCursor)
+            and self.watermark == other.watermark
+            and self.seen == other.seen
+        )
+
+    def is_unchanged(self, tx: dict) -> bool:
+        """True if `tx` was already synced with its current status"""
+        status = self.seen.get(tx.get("transaction_id"))
+        return status is not None and status == tx.get("transaction_status")
+
+    def advance(self, scanned: Iterable[Tuple[dict, float]]) -> "SyncCursor":
+        """
+        The cursor after a sync that scanned every (summary, transaction_time) from
+        this cursor's watermark on.
+        """
+        scanned = list(scanned)
+        if not scanned:
+            return SyncCursor(self.watermark, self.seen)
+
+        pending_times = [
+            transaction_time
+            for tx, transaction_time in scanned
+            if tx.get("transaction_status") not in FINAL_TRANSACTION_STATUSES
+        ]
+        if pending_times:
+            watermark = min(pending_times)
+        else:
+            watermark = max(transaction_time for tx, transaction_time in scanned)
+        if self.watermark is not None:
+            watermark = max(watermark, self.watermark)
+
+        return SyncCursor(
+            watermark,
+            {
+                tx["transaction_id"]: tx.get("transaction_status")
+                for tx, transaction_time in scanned
+                if transaction_time >= watermark
+            },
+        )
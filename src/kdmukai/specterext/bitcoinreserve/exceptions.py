@@ -0,0 +1,40 @@
+class BitcoinReserveApiException(Exception):
+    def __init__(self, message: str = "", status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class BitcoinReserveApiTransientException(BitcoinReserveApiException):
+    """
+    The request failed but may well succeed if tried again later: timeouts,
+    connection errors, 5xx and 429 responses.
+    """
+
+    def __init__(
+        self, message: str = "", status_code: int = None, retry_after: float = None
+    ):
+        super().__init__(message, status_code=status_code)
+        self.retry_after = retry_after
+
+
+class BitcoinReserveApiRateLimitException(BitcoinReserveApiTransientException):
+    """429: the request was rejected unprocessed; wait `retry_after` seconds"""
+
+    pass
+
+
+class BitcoinReserveApiCircuitOpenException(BitcoinReserveApiException):
+    """Too many recent failures talking to the API host; not even trying for now"""
+
+    pass
+
+
+class BitcoinReserveQuoteChangedException(Exception):
+    """
+    The quote the user saw is no longer the one on offer (replaced or expired);
+    `quote` is the current one, to be shown and confirmed instead
+    """
+
+    def __init__(self, quote: dict):
+        super().__init__("The quote has changed; please review the new price")
+        self.quote = quote
@@ -0,0 +1,155 @@
+"""
+Streaming CSV / JSONL export of a user's Bitcoin Reserve history.
+
+Everything here is a generator over (summary, transaction_time, details) entries,
+from the local store or straight from the paginated API, so an export is written
+out to the response as it's read and never held in memory as a whole:
+
+    rows = iter_store_transactions(store, since=since, until=until)
+    return app.response_class(iter_csv(rows), mimetype="text/csv")
+
+Amounts are exported exactly as the API lists them (decimal strings); "None"
+becomes an empty field.
+"""
+import csv
+import datetime
+import io
+import json
+
+from typing import TYPE_CHECKING, Iterable, Iterator, Tuple
+
+from .models import TransactionDetails
+
+if TYPE_CHECKING:
+    from .api_client import BitcoinReserveClient
+    from .storage import BitcoinReserveTransactionStore
+
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+}
+
+CSV_FIELDS = [
+    "transaction_id",
+    "transaction_time",
+    "transaction_type",
+    "transaction_status",
+    "in_currency",
+    "in_amount",
+    "out_currency",
+    "out_amount",
+    "fiat_currency",
+    "fiat_spent",
+    "sats_bought",
+    "trade_fee_amount",
+    "withdrawal_fee",
+    "withdrawal_address",
+    "withdrawal_identifier",
+]
+
+# Rows per chunk handed to the response; one write per row would be a lot of
+# tiny socket writes for a long history
+CHUNK_ROWS = 200
+
+
+def iter_store_transactions(
+    store: "BitcoinReserveTransactionStore", **filters
+) -> Iterator[Tuple[dict, float, dict]]:
+    """The locally synced history, newest first; see store.iter_transactions()"""
+    for row in store.iter_transactions(**filters):
+        yield row["summary"], row["transaction_time"], row["details"]
+
+
+def iter_api_transactions(
+    client: "BitcoinReserveClient", since: float = None, until: float = None
+) -> Iterator[Tuple[dict, float, dict]]:
+    """
+    The history straight from the API, newest first, one page at a time. Only the
+    summary rows are exported (no per-transaction detail requests).
+    """
+    for tx in client.iter_transactions(since=since):
+        transaction_time = tx.transaction_time
+        if until is not None and transaction_time >= until:
+            continue
+        yield tx.to_dict(), transaction_time, None
+
+
+def _value(value) -> str:
+    return "" if value is None or value == "None" else value
+
+
+def to_export_row(summary: dict, transaction_time: float, details: dict) -> dict:
+    """One flat record with CSV_FIELDS, merging the summary row and detail record"""
+    details = details or {}
+    withdrawals = TransactionDetails(details).withdrawals
+    row = {field: _value(summary.get(field, details.get(field))) for field in CSV_FIELDS}
+    row["transaction_time"] = datetime.datetime.fromtimestamp(transaction_time).isoformat(
+        sep=" "
+    )
+    for field in ("withdrawal_fee", "withdrawal_address", "withdrawal_identifier"):
+        # Several withdrawals of one order share a cell
+        row[field] = " ".join(
+            str(_value(withdrawal.get(field)))
+            for withdrawal in withdrawals
+            if _value(withdrawal.get(field)) != ""
+        )
+    return row
+
+
+def _chunked(lines: Iterator[str]) -> Iterator[str]:
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= CHUNK_ROWS:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def iter_csv(transactions: Iterable[Tuple[dict, float, dict]]) -> Iterator[str]:
+    """CSV with a header row, yielded a chunk of rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, lineterminator="\r\n")
+
+    def lines():
+        writer.writeheader()
+        for transaction in transactions:
+            writer.writerow(to_export_row(*transaction))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Just the header if nothing matched
+        yield buffer.getvalue()
+
+    return _chunked(lines())
+
+
+def iter_jsonl(transactions: Iterable[Tuple[dict, float, dict]]) -> Iterator[str]:
+    """
+    One json object per line: the flat export fields plus the full `summary` and
+    `details` records, so nothing the API returned is lost
+    """
+    return _chunked(
+        json.dumps(
+            dict(
+                to_export_row(summary, transaction_time, details),
+                summary=summary,
+                details=details,
+            ),
+            default=str,
+        )
+        + "\n"
+        for summary, transaction_time, details in transactions
+    )
+
+
+def iter_export(
+    transactions: Iterable[Tuple[dict, float, dict]], export_format: str
+) -> Iterator[str]:
+    if export_format == "csv":
+        return iter_csv(transactions)
+    if export_format == "jsonl":
+        return iter_jsonl(transactions)
+    raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
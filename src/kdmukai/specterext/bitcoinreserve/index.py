@@ -0,0 +1,236 @@
+import threading
+
+from typing import TYPE_CHECKING, Iterable, List, Tuple
+
+from .models import TransactionDetails, TransactionSummary
+
+if TYPE_CHECKING:
+    from .storage import BitcoinReserveTransactionStore
+
+
+class WithdrawalEntry:
+    """
+    One withdrawal's merged order metadata. The index holds one of these per
+    withdrawal for the lifetime of the process, hence `__slots__` rather than a
+    dict; amounts are ints (sats / fiat minor units).
+    """
+
+    FIELDS = (
+        "withdrawal_id",
+        "withdrawal_status",
+        "withdrawal_address",
+        "withdrawal_identifier",
+        "withdrawal_time",
+        "out_amount",
+        "out_currency",
+        "order_id",
+        "order_type",
+        "order_time",
+        "sats_bought",
+        "fiat_spent",
+        "fiat_currency",
+    )
+    # The WITHDRAWAL transaction's own record is the authority on these; a MARKET
+    # BUY's nested copy of the withdrawal isn't refetched when only the
+    # withdrawal moves on, so it may be stale
+    WITHDRAWAL_FIELDS = (
+        "withdrawal_status",
+        "withdrawal_address",
+        "withdrawal_identifier",
+    )
+    __slots__ = FIELDS + ("from_withdrawal",)
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        self.from_withdrawal = False
+
+    def update(self, metadata: dict, from_withdrawal: bool = False) -> bool:
+        """
+        Merges in `metadata`'s non-None values; returns True if anything changed.
+        `from_withdrawal` if it's from the WITHDRAWAL transaction's own record.
+        """
+        changed = False
+        for field, value in metadata.items():
+            if value is None or getattr(self, field) == value:
+                continue
+            if (
+                self.from_withdrawal
+                and not from_withdrawal
+                and field in self.WITHDRAWAL_FIELDS
+            ):
+                continue
+            setattr(self, field, value)
+            changed = True
+        self.from_withdrawal = self.from_withdrawal or from_withdrawal
+        return changed
+
+    def to_dict(self) -> dict:
+        return {
+            field: getattr(self, field)
+            for field in self.FIELDS
+            if getattr(self, field) is not None
+        }
+
+
+class BitcoinReserveWithdrawalIndex:
+    """
+    In-memory lookup from on-chain txid (`withdrawal_identifier`) and from
+    withdrawal address to the Bitcoin Reserve order metadata behind it, so that
+    wallet tx rows can be tagged with a dict lookup each instead of a query or scan.
+
+    A MARKET BUY's detail record carries its withdrawal and the WITHDRAWAL is also
+    listed as a transaction of its own; both are merged into a single entry keyed
+    on the withdrawal's transaction_id.
+
+    Built once from the local transaction store, then kept up to date by `add()`
+    as the sync stores new or changed transactions.
+
+    Also tracks which entries still have to be linked to the user's wallet: every
+    entry that's new or changed (including all of them when the index is built)
+    until `mark_linked()`, so a failed link is retried on the next sync.
+    """
+
+    def __init__(self, service_id: str):
+        self.service_id = service_id
+        self._by_withdrawal = {}
+        self._by_txid = {}
+        self._by_address = {}
+        self._unlinked = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_store(
+        cls, service_id: str, store: "BitcoinReserveTransactionStore"
+    ) -> "BitcoinReserveWithdrawalIndex":
+        index = cls(service_id)
+        # Oldest first, in the order they were (most likely) synced
+        index.add(
+            (row["summary"], row["transaction_time"], row["details"])
+            for row in reversed(store.get_transactions())
+            if row["details"]
+        )
+        return index
+
+    @staticmethod
+    def get_withdrawal_metadata(
+        summary: dict, transaction_time: float, details: dict
+    ) -> List[Tuple[str, dict]]:
+        """(withdrawal key, metadata) for each withdrawal in a transaction"""
+        summary = TransactionSummary(summary) if isinstance(summary, dict) else summary
+        details = TransactionDetails(details) if isinstance(details, dict) else details
+        if details is None:
+            return []
+        transaction_id = summary.transaction_id
+        is_withdrawal = summary.transaction_type == "WITHDRAWAL"
+        results = []
+        for index, withdrawal in enumerate(details.withdrawals):
+            serial_number = withdrawal.get("withdrawal_serial_number", index)
+            withdrawal_id = withdrawal.transaction_id or (
+                transaction_id if is_withdrawal else f"{transaction_id}:{serial_number}"
+            )
+            metadata = {
+                "withdrawal_id": withdrawal_id,
+                "withdrawal_status": withdrawal.withdrawal_status
+                or summary.transaction_status,
+                "withdrawal_address": withdrawal.withdrawal_address,
+                "withdrawal_identifier": withdrawal.withdrawal_identifier,
+            }
+            if is_withdrawal:
+                metadata["withdrawal_time"] = transaction_time
+                metadata["out_amount"] = summary.out_amount
+                metadata["out_currency"] = summary.get("out_currency")
+            else:
+                metadata["order_id"] = transaction_id
+                metadata["order_type"] = summary.transaction_type
+                metadata["order_time"] = transaction_time
+                metadata["sats_bought"] = details.sats_bought
+                metadata["fiat_spent"] = details.fiat_spent
+                metadata["fiat_currency"] = details.fiat_currency
+            # Don't let a missing value from one record blank out the other's
+            results.append(
+                (withdrawal_id, {k: v for k, v in metadata.items() if v is not None})
+            )
+        return results
+
+    def add(self, transactions: Iterable[Tuple[dict, float, dict]]) -> List[dict]:
+        """
+        Index (summary, transaction_time, details) entries; `details` may be None.
+        Returns the metadata of every withdrawal entry that was added or changed.
+        """
+        changed = {}
+        with self._lock:
+            for summary, transaction_time, details in transactions:
+                from_withdrawal = summary.get("transaction_type") == "WITHDRAWAL"
+                for withdrawal_id, metadata in self.get_withdrawal_metadata(
+                    summary, transaction_time, details
+                ):
+                    entry = self._by_withdrawal.get(withdrawal_id)
+                    if entry is None:
+                        entry = self._by_withdrawal[withdrawal_id] = WithdrawalEntry()
+                    previous_txid = entry.withdrawal_identifier
+                    if not entry.update(metadata, from_withdrawal=from_withdrawal):
+                        continue
+                    changed[withdrawal_id] = entry
+                    self._unlinked.add(withdrawal_id)
+
+                    if previous_txid not in (None, entry.withdrawal_identifier):
+                        self._by_txid.pop(previous_txid, None)
+                    if entry.withdrawal_identifier:
+                        self._by_txid[entry.withdrawal_identifier] = entry
+                    if entry.withdrawal_address:
+                        self._by_address.setdefault(entry.withdrawal_address, {})[
+                            withdrawal_id
+                        ] = entry
+            return [entry.to_dict() for entry in changed.values()]
+
+    def get_by_txid(self, txid: str) -> dict:
+        with self._lock:
+            entry = self._by_txid.get(txid)
+            return entry.to_dict() if entry else None
+
+    def get_by_address(self, address: str) -> List[dict]:
+        with self._lock:
+            return [entry.to_dict() for entry in self._by_address.get(address, {}).values()]
+
+    def get_unlinked(self) -> List[dict]:
+        """Every entry that was added or changed since it was last marked linked"""
+        with self._lock:
+            return [
+                self._by_withdrawal[withdrawal_id].to_dict()
+                for withdrawal_id in self._unlinked
+            ]
+
+    def mark_linked(self, withdrawal_ids: Iterable[str]):
+        with self._lock:
+            self._unlinked.difference_update(withdrawal_ids)
+
+    def mark_unlinked(self):
+        """e.g. the user associated another wallet; everything has to be linked to it"""
+        with self._lock:
+            self._unlinked = set(self._by_withdrawal)
+
+    def tag_tx(self, tx: dict) -> bool:
+        """
+        Sets `service_id` and our order metadata on a wallet txlist row if it's one
+        of our withdrawals (matched on txid, else on the receiving address).
+        """
+        entry = self.get_by_txid(tx.get("txid"))
+        if entry is None:
+            addresses = tx.get("address")
+            if isinstance(addresses, str):
+                addresses = [addresses]
+            for address in addresses or []:
+                entries = self.get_by_address(address)
+                if entries:
+                    entry = entries[0]
+                    break
+        if entry is None:
+            return False
+        tx["service_id"] = self.service_id
+        tx[self.service_id] = entry
+        return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_withdrawal)
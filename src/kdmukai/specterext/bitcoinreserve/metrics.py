@@ -0,0 +1,108 @@
+import bisect
+import re
+import threading
+
+from collections import defaultdict
+
+
+# Collapse per-id / per-page paths into one metrics series per endpoint
+_ENDPOINT_PATTERNS = [
+    (re.compile(r"^/api/user/transactions/[^/]+$"), "/api/user/transactions/<page_num>"),
+    (re.compile(r"^/api/user/transaction/[^/]+$"), "/api/user/transaction/<transaction_id>"),
+]
+
+
+def endpoint_label(endpoint: str) -> str:
+    for pattern, label in _ENDPOINT_PATTERNS:
+        if pattern.match(endpoint):
+            return label
+    return endpoint
+
+
+class ApiMetrics:
+    """
+    In-process counters for Bitcoin Reserve API calls, per (method, endpoint):
+    request count, latency histogram, bytes sent/received, status codes, retries
+    and calls coalesced into another in-flight one. Recording is a few dict/int
+    updates under a lock; nothing is serialized until `snapshot()` is called.
+    """
+
+    # Upper bounds (seconds) of the latency histogram buckets; the last is +Inf
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _get_series(self, method: str, endpoint: str) -> dict:
+        key = (method, endpoint_label(endpoint))
+        series = self._series.get(key)
+        if series is None:
+            series = {
+                "count": 0,
+                "latency_sum": 0.0,
+                "latency_buckets": [0] * (len(self.LATENCY_BUCKETS) + 1),
+                "bytes_sent": 0,
+                "bytes_received": 0,
+                "status_codes": defaultdict(int),
+                "retries": 0,
+                "coalesced": 0,
+            }
+            self._series[key] = series
+        return series
+
+    def observe(
+        self,
+        method: str,
+        endpoint: str,
+        status_code,
+        latency: float,
+        bytes_sent: int = 0,
+        bytes_received: int = 0,
+    ):
+        """`status_code` is None if no response was received (e.g. timeout)"""
+        bucket = bisect.bisect_left(self.LATENCY_BUCKETS, latency)
+        with self._lock:
+            series = self._get_series(method, endpoint)
+            series["count"] += 1
+            series["latency_sum"] += latency
+            series["latency_buckets"][bucket] += 1
+            series["bytes_sent"] += bytes_sent
+            series["bytes_received"] += bytes_received
+            series["status_codes"][str(status_code) if status_code else "error"] += 1
+
+    def record_retry(self, method: str, endpoint: str):
+        with self._lock:
+            self._get_series(method, endpoint)["retries"] += 1
+
+    def record_coalesced(self, method: str, endpoint: str):
+        with self._lock:
+            self._get_series(method, endpoint)["coalesced"] += 1
+
+    def snapshot(self) -> dict:
+        """json-serializable copy of all series, keyed on "<METHOD> <endpoint>" """
+        bucket_labels = [str(bound) for bound in self.LATENCY_BUCKETS] + ["+Inf"]
+        with self._lock:
+            return {
+                f"{method} {endpoint}": {
+                    "count": series["count"],
+                    "latency_sum": round(series["latency_sum"], 6),
+                    "latency_buckets": dict(
+                        zip(bucket_labels, series["latency_buckets"])
+                    ),
+                    "bytes_sent": series["bytes_sent"],
+                    "bytes_received": series["bytes_received"],
+                    "status_codes": dict(series["status_codes"]),
+                    "retries": series["retries"],
+                    "coalesced": series["coalesced"],
+                }
+                for (method, endpoint), series in self._series.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+
+# Process-wide instance used by the client
+api_metrics = ApiMetrics()
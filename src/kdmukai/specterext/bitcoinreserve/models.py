@@ -0,0 +1,268 @@
+"""
+Compact, typed views of the Bitcoin Reserve API's json records.
+
+Each model wraps the raw json dict it was built from and only parses a field the
+first time it's accessed (the result is kept in a `__slots__` attribute), so
+wrapping a page of a few thousand records costs next to nothing until something
+actually looks at them.
+
+    summary = TransactionSummary(raw)
+    summary.transaction_time    # 1642483715.06865 (float timestamp)
+    summary.out_amount          # 28838 (int, in out_currency's minor units)
+    summary["out_amount"]       # "28838.00000000" (the raw json value)
+
+Amounts are integers in the currency's smallest unit: sats for SATS / BTC, cents
+(etc.) for fiat; "None" and missing amounts are None. Models are read-only
+Mappings over the raw json, so they can be passed to code that expects the dicts;
+`to_dict()` returns the raw json, e.g. for json.dumps().
+"""
+import datetime
+
+from collections.abc import Mapping
+from decimal import Decimal, InvalidOperation
+from typing import List
+
+
+# Decimal places of each currency's smallest unit; fiat not listed uses 2
+CURRENCY_EXPONENTS = {
+    "SATS": 0,
+    "BTC": 8,
+    "JPY": 0,
+}
+TRANSACTION_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def parse_transaction_time(transaction_time: str) -> float:
+    """ "2022-01-18 05:28:35.068650" -> timestamp (naive, i.e. local time)"""
+    try:
+        # Fixed-format fast path (C implementation, no format string to interpret)
+        return datetime.datetime.fromisoformat(transaction_time).timestamp()
+    except ValueError:
+        # e.g. fewer than 6 fraction digits, which fromisoformat rejects before 3.11
+        return datetime.datetime.strptime(
+            transaction_time, TRANSACTION_TIME_FORMAT
+        ).timestamp()
+
+
+def parse_amount(value) -> Decimal:
+    """The API's amounts are strings ("28838.00000000"), floats or "None"""
+    if value is None or value == "None" or value == "":
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return None
+
+
+def to_minor_units(value, currency: str) -> int:
+    """An amount in `currency` as an int of its smallest unit (sats, cents, ...)"""
+    amount = parse_amount(value)
+    if amount is None:
+        return None
+    return int(amount.scaleb(get_currency_exponent(currency)).to_integral_value())
+
+
+def get_currency_exponent(currency: str) -> int:
+    """Decimal places of `currency`'s minor unit; 2 (cents) unless listed otherwise"""
+    return CURRENCY_EXPONENTS.get((currency or "").upper(), 2)
+
+
+def as_dict(record) -> dict:
+    """The raw json dict of a model (or a dict, as is)"""
+    return record.to_dict() if isinstance(record, ApiRecord) else record
+
+
+class _parsed:
+    """
+    A read-only attribute computed from the raw json on first access and then kept
+    in the `_<name>` slot, which the model class must declare.
+    """
+
+    def __init__(self, parse):
+        self.parse = parse
+        self.__doc__ = parse.__doc__
+
+    def __set_name__(self, owner, name):
+        self.slot = f"_{name}"
+
+    def __get__(self, record, owner=None):
+        if record is None:
+            return self
+        try:
+            return getattr(record, self.slot)
+        except AttributeError:
+            value = self.parse(record._raw)
+            setattr(record, self.slot, value)
+            return value
+
+
+class ApiRecord(Mapping):
+    __slots__ = ("_raw",)
+
+    def __init__(self, raw: dict):
+        self._raw = raw if raw is not None else {}
+
+    @classmethod
+    def from_dict(cls, raw: dict):
+        return None if raw is None else cls(raw)
+
+    def to_dict(self) -> dict:
+        return self._raw
+
+    def __getitem__(self, key):
+        return self._raw[key]
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __eq__(self, other):
+        return as_dict(other) == self._raw
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self._raw!r})"
+
+
+def _withdrawals(raw: dict) -> List["Withdrawal"]:
+    """
+    "withdrawals" is a single dict in the API docs but could just as well be a list;
+    a WITHDRAWAL detail record may carry the withdrawal fields itself.
+    """
+    withdrawals = raw.get("withdrawals")
+    if isinstance(withdrawals, dict):
+        withdrawals = [withdrawals] if withdrawals else []
+    elif not isinstance(withdrawals, list):
+        if "withdrawal_address" in raw or "withdrawal_identifier" in raw:
+            withdrawals = [raw]
+        else:
+            withdrawals = []
+    return [Withdrawal(withdrawal) for withdrawal in withdrawals]
+
+
+class TransactionSummary(ApiRecord):
+    """A row of `get_transactions`"""
+
+    __slots__ = ("_transaction_time", "_in_amount", "_out_amount")
+
+    transaction_time = _parsed(
+        lambda raw: parse_transaction_time(raw["transaction_time"])
+    )
+    in_amount = _parsed(lambda raw: to_minor_units(raw.get("in_amount"), raw.get("in_currency")))
+    out_amount = _parsed(lambda raw: to_minor_units(raw.get("out_amount"), raw.get("out_currency")))
+
+    @property
+    def transaction_id(self) -> str:
+        return self._raw.get("transaction_id")
+
+    @property
+    def transaction_type(self) -> str:
+        return self._raw.get("transaction_type")
+
+    @property
+    def transaction_status(self) -> str:
+        return self._raw.get("transaction_status")
+
+
+class Withdrawal(ApiRecord):
+    """A withdrawal, as listed in a detail record or an order status"""
+
+    __slots__ = ("_withdrawal_fee", "_withdrawal_eta")
+
+    # Fees are listed in withdrawal_currency (SATS) where it's specified
+    withdrawal_fee = _parsed(
+        lambda raw: to_minor_units(raw.get("withdrawal_fee"), raw.get("withdrawal_currency", "SATS"))
+    )
+    withdrawal_eta = _parsed(
+        lambda raw: float(raw["withdrawal_eta"]) if raw.get("withdrawal_eta") else None
+    )
+
+    @property
+    def transaction_id(self) -> str:
+        return self._raw.get("transaction_id")
+
+    @property
+    def withdrawal_status(self) -> str:
+        return self._raw.get("withdrawal_status")
+
+    @property
+    def withdrawal_address(self) -> str:
+        return self._raw.get("withdrawal_address")
+
+    @property
+    def withdrawal_identifier(self) -> str:
+        return self._raw.get("withdrawal_identifier")
+
+
+class TransactionDetails(ApiRecord):
+    """A `get_transaction` detail record"""
+
+    __slots__ = ("_sats_bought", "_fiat_spent", "_withdrawals")
+
+    sats_bought = _parsed(lambda raw: to_minor_units(raw.get("sats_bought"), "SATS"))
+    fiat_spent = _parsed(lambda raw: to_minor_units(raw.get("fiat_spent"), raw.get("fiat_currency")))
+    withdrawals = _parsed(_withdrawals)
+
+    @property
+    def transaction_id(self) -> str:
+        return self._raw.get("transaction_id")
+
+    @property
+    def transaction_type(self) -> str:
+        return self._raw.get("transaction_type")
+
+    @property
+    def fiat_currency(self) -> str:
+        return self._raw.get("fiat_currency")
+
+
+class Quote(ApiRecord):
+    """A `create_quote` response"""
+
+    __slots__ = ("_bitcoin_receive_amount", "_trade_fee_amount", "_expiration_time_utc")
+
+    bitcoin_receive_amount = _parsed(
+        lambda raw: to_minor_units(raw.get("bitcoin_receive_amount"), "BTC")
+    )
+    trade_fee_amount = _parsed(
+        lambda raw: to_minor_units(raw.get("trade_fee_amount"), raw.get("trade_fee_currency"))
+    )
+    expiration_time_utc = _parsed(lambda raw: float(raw["expiration_time_utc"]))
+
+    @property
+    def quote_id(self) -> str:
+        return self._raw.get("quote_id")
+
+    @property
+    def trade_fee_currency(self) -> str:
+        return self._raw.get("trade_fee_currency")
+
+
+class Order(ApiRecord):
+    """A `confirm_order` or `get_order_status` response"""
+
+    __slots__ = ("_bitcoin_receive_amount", "_trade_fee_amount", "_withdrawals")
+
+    bitcoin_receive_amount = _parsed(
+        lambda raw: to_minor_units(raw.get("bitcoin_receive_amount"), "BTC")
+    )
+    trade_fee_amount = _parsed(
+        lambda raw: to_minor_units(raw.get("trade_fee_amount"), raw.get("trade_fee_currency"))
+    )
+    # `confirm_order` lists its single withdrawal's fields on the order itself
+    withdrawals = _parsed(_withdrawals)
+
+    @property
+    def order_id(self) -> str:
+        return self._raw.get("order_id")
+
+    @property
+    def order_status(self) -> str:
+        return self._raw.get("order_status")
+
+    @property
+    def quote_id(self) -> str:
+        return self._raw.get("quote_id")
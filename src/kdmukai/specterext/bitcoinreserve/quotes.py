@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+
+from decimal import Decimal
+from typing import Tuple
+
+from .exceptions import BitcoinReserveApiException, BitcoinReserveQuoteChangedException
+from .models import Quote
+from .resilience import SingleFlight
+
+
+logger = logging.getLogger(__name__)
+
+
+class BitcoinReserveQuoteManager:
+    """
+    Keeps each user's latest quote per (fiat amount, currency, withdrawal address)
+    so that the flash buy page can show a price without a round trip and
+    confirming the buy only costs the `confirm_order` call.
+
+    * A quote is handed out until `expiry_margin` seconds before its
+        `expiration_time_utc`.
+    * While a quote keeps being asked for (i.e. the flash buy page is open and
+        polling) it's replaced in the background shortly before it expires. Once
+        nobody has asked for it in `keepalive` seconds it's left to expire.
+    * Concurrent misses for the same key share one `create_quote` call; otherwise
+        the later quote would replace the one the earlier request was shown.
+    * Only the quote the user was shown can be confirmed; a confirm for any other
+        (e.g. replaced in the background since the page last polled) is refused
+        with the current quote instead. A confirmed quote is used up and dropped.
+    """
+
+    def __init__(self, flask_app, expiry_margin: float = 5, keepalive: float = 30):
+        self.app = flask_app
+        self.expiry_margin = expiry_margin
+        self.keepalive = keepalive
+        self._lock = threading.Lock()
+        self._quotes = {}
+        self._last_requested = {}
+        self._timers = {}
+        self._creating = SingleFlight()
+
+    @staticmethod
+    def make_key(
+        user_id: str, fiat_amount, fiat_currency: str, withdrawal_address: str
+    ) -> Tuple[str, str, str, str]:
+        # "100", "100.0" and Decimal("1E+2") are the same order
+        amount = Decimal(str(fiat_amount)).normalize()
+        return (user_id, f"{amount:f}", fiat_currency.upper(), withdrawal_address)
+
+    def _is_fresh(self, quote: Quote) -> bool:
+        return quote.expiration_time_utc - time.time() > self.expiry_margin
+
+    def _create_quote(self, key: tuple, api_token: str) -> Quote:
+        from . import client as bitcoinreserve_client
+
+        user_id, fiat_amount, fiat_currency, withdrawal_address = key
+        return Quote(
+            bitcoinreserve_client.create_quote(
+                Decimal(fiat_amount),
+                withdrawal_address,
+                fiat_currency=fiat_currency,
+                api_token=api_token,
+            )
+        )
+
+    def get_quote(
+        self,
+        user_id: str,
+        api_token: str,
+        fiat_amount,
+        withdrawal_address: str,
+        fiat_currency: str = "EUR",
+    ) -> dict:
+        """A quote that's valid for at least `expiry_margin` more seconds"""
+        key = self.make_key(user_id, fiat_amount, fiat_currency, withdrawal_address)
+        with self._lock:
+            self._last_requested[key] = time.monotonic()
+            quote = self._quotes.get(key)
+            if quote and self._is_fresh(quote):
+                return dict(quote.to_dict())
+
+        quote, _ = self._creating.do(
+            key, lambda: self._get_or_create_quote(key, api_token)
+        )
+        return quote
+
+    def _get_or_create_quote(self, key: tuple, api_token: str) -> dict:
+        # Another request may have stored one since our miss
+        with self._lock:
+            quote = self._quotes.get(key)
+            if quote and self._is_fresh(quote):
+                return dict(quote.to_dict())
+
+        quote = self._create_quote(key, api_token)
+        self._store(key, quote, api_token)
+        return dict(quote.to_dict())
+
+    def take_quote(
+        self,
+        user_id: str,
+        fiat_amount,
+        withdrawal_address: str,
+        fiat_currency: str = "EUR",
+        quote_id: str = None,
+    ) -> Quote:
+        """
+        Removes and returns the cached quote if it's still fresh (and, if specified,
+        is `quote_id`), else None. A quote that isn't `quote_id` is left in place.
+        """
+        key = self.make_key(user_id, fiat_amount, fiat_currency, withdrawal_address)
+        with self._lock:
+            quote = self._quotes.get(key)
+            if quote_id is not None and (quote is None or quote.quote_id != quote_id):
+                return None
+            self._quotes.pop(key, None)
+            self._last_requested.pop(key, None)
+            timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        return quote if quote and self._is_fresh(quote) else None
+
+    def confirm_order(
+        self,
+        user_id: str,
+        api_token: str,
+        fiat_amount,
+        withdrawal_address: str,
+        quote_id: str,
+        fiat_currency: str = "EUR",
+    ) -> dict:
+        """
+        Confirms quote `quote_id` (the one the user was shown) for this order; one
+        upstream call. If that's no longer the cached, still fresh quote, nothing is
+        bought: raises BitcoinReserveQuoteChangedException with the current quote.
+        """
+        from . import client as bitcoinreserve_client
+
+        quote = self.take_quote(
+            user_id, fiat_amount, withdrawal_address, fiat_currency, quote_id=quote_id
+        )
+        if quote is None:
+            raise BitcoinReserveQuoteChangedException(
+                self.get_quote(
+                    user_id, api_token, fiat_amount, withdrawal_address, fiat_currency
+                )
+            )
+        return bitcoinreserve_client.confirm_order(quote.quote_id, api_token=api_token)
+
+    def _store(self, key: tuple, quote: Quote, api_token: str, replacing=None):
+        """
+        Caches `quote` and schedules its refresh. If `replacing` (a refresh timer) is
+        specified, only does so if that timer is still the current one for `key`.
+        """
+        # Refresh a little before the quote stops being handed out
+        delay = max(
+            0.0, quote.expiration_time_utc - time.time() - 2 * self.expiry_margin
+        )
+        timer = threading.Timer(delay, self._refresh, args=(key, api_token))
+        timer.daemon = True
+        with self._lock:
+            if replacing is not None and self._timers.get(key) is not replacing:
+                # Taken or superseded while we were fetching
+                return
+            self._quotes[key] = quote
+            previous = self._timers.pop(key, None)
+            self._timers[key] = timer
+        if previous:
+            previous.cancel()
+        timer.start()
+
+    def _refresh(self, key: tuple, api_token: str):
+        with self._lock:
+            if self._timers.get(key) is not threading.current_thread():
+                # Superseded or taken in the meantime
+                return
+            last_requested = self._last_requested.get(key)
+            if last_requested is None or time.monotonic() - last_requested > self.keepalive:
+                # Nobody's looking at this quote anymore
+                self._timers.pop(key, None)
+                self._quotes.pop(key, None)
+                self._last_requested.pop(key, None)
+                return
+
+        try:
+            with self.app.app_context():
+                quote = self._create_quote(key, api_token)
+        except BitcoinReserveApiException as e:
+            logger.debug(f"Couldn't refresh quote: {e}")
+            with self._lock:
+                if self._timers.get(key) is threading.current_thread():
+                    self._timers.pop(key, None)
+            return
+        self._store(key, quote, api_token, replacing=threading.current_thread())
+
+    def shutdown(self):
+        with self._lock:
+            timers = list(self._timers.values())
+            self._timers = {}
+            self._quotes = {}
+            self._last_requested = {}
+        for timer in timers:
+            timer.cancel()
@@ -0,0 +1,326 @@
+import collections
+import contextlib
+import copy
+import datetime
+import email.utils
+import random
+import threading
+import time
+
+from typing import Any, Callable, Tuple
+from urllib.parse import urlparse
+
+from .exceptions import (
+    BitcoinReserveApiCircuitOpenException,
+    BitcoinReserveApiException,
+    BitcoinReserveApiRateLimitException,
+    BitcoinReserveApiTransientException,
+)
+
+
+# Methods that are safe to send again after an ambiguous failure
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def parse_retry_after(value: str) -> float:
+    """Retry-After is either delta-seconds or an HTTP-date; returns seconds or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(
+        0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    )
+
+
+def classify_error_response(
+    status_code: int, text: str, headers: dict = None
+) -> BitcoinReserveApiException:
+    """The exception to raise for a non-200 response"""
+    message = f"{status_code}: {text}"
+    if status_code == 429:
+        return BitcoinReserveApiRateLimitException(
+            message,
+            status_code=status_code,
+            retry_after=parse_retry_after((headers or {}).get("Retry-After")),
+        )
+    if status_code == 408 or status_code >= 500:
+        return BitcoinReserveApiTransientException(
+            message,
+            status_code=status_code,
+            retry_after=parse_retry_after((headers or {}).get("Retry-After")),
+        )
+    return BitcoinReserveApiException(message, status_code=status_code)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter. Idempotent requests are retried on any
+    transient error; anything else only on 429 (the upstream didn't process it).
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 10,
+        max_retry_after: float = 30,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+
+    def get_delay(
+        self, attempt: int, method: str, error: BitcoinReserveApiException
+    ) -> float:
+        """
+        Seconds to wait before retry number `attempt` (0-based), or None if the
+        request shouldn't be retried.
+        """
+        if attempt >= self.max_retries:
+            return None
+        if not isinstance(error, BitcoinReserveApiTransientException):
+            return None
+        if method.upper() not in IDEMPOTENT_METHODS and not isinstance(
+            error, BitcoinReserveApiRateLimitException
+        ):
+            return None
+
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+        if error.retry_after is not None:
+            if error.retry_after > self.max_retry_after:
+                # Not worth pinning a worker for that long; surface the error instead
+                return None
+            delay = max(delay, error.retry_after)
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a host that keeps failing. After `failure_threshold`
+    consecutive transient failures the circuit opens and requests fail fast with
+    BitcoinReserveApiCircuitOpenException. After `reset_timeout` seconds a single
+    trial request is let through (half-open); its outcome closes or re-opens the
+    circuit. A trial that hasn't reported back within another `reset_timeout` is
+    counted as failed, so a lost probe can't leave the circuit half-open forever.
+
+    Outcomes that say nothing about the host's health (a 429 throttling one user,
+    a cancelled request) are reported with `record_inconclusive()` instead, so
+    that they can't open the circuit for everyone.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitBreaker.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        with self._lock:
+            if self.state == CircuitBreaker.CLOSED:
+                return
+            now = time.monotonic()
+            if (
+                self.state == CircuitBreaker.HALF_OPEN
+                and now - self._probe_started_at >= self.reset_timeout
+            ):
+                # The probe never reported back; back to open as of when it started
+                self.state = CircuitBreaker.OPEN
+                self._opened_at = self._probe_started_at
+            if (
+                self.state == CircuitBreaker.OPEN
+                and now - self._opened_at >= self.reset_timeout
+            ):
+                # Let this one request through to probe the upstream
+                self.state = CircuitBreaker.HALF_OPEN
+                self._probe_started_at = now
+                return
+            raise BitcoinReserveApiCircuitOpenException(
+                "Bitcoin Reserve API is unavailable; try again shortly"
+            )
+
+    def record_success(self):
+        with self._lock:
+            self.state = CircuitBreaker.CLOSED
+            self._failures = 0
+
+    def record_inconclusive(self):
+        """Doesn't count either way; if this was the probe, the next request probes"""
+        with self._lock:
+            if self.state == CircuitBreaker.HALF_OPEN:
+                self.state = CircuitBreaker.OPEN
+                self._opened_at = time.monotonic() - self.reset_timeout
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if (
+                self.state == CircuitBreaker.HALF_OPEN
+                or self._failures >= self.failure_threshold
+            ):
+                self.state = CircuitBreaker.OPEN
+                self._opened_at = time.monotonic()
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(
+    url: str, failure_threshold: int = 5, reset_timeout: float = 30
+) -> CircuitBreaker:
+    """The process-wide CircuitBreaker for `url`'s host"""
+    host = urlparse(url).netloc
+    with _circuit_breakers_lock:
+        if host not in _circuit_breakers:
+            _circuit_breakers[host] = CircuitBreaker(
+                failure_threshold=failure_threshold, reset_timeout=reset_timeout
+            )
+        return _circuit_breakers[host]
+
+
+class FairRequestLimiter:
+    """
+    Caps the number of requests in flight to a host across every user and thread.
+    When all `max_concurrent` slots are taken, waiters are served round-robin per
+    owner (i.e. per user) rather than first come, first served, so that one large
+    account's burst of detail requests can't starve everyone else's.
+    """
+
+    def __init__(self, max_concurrent: int = 8):
+        self.max_concurrent = max_concurrent
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        # owner -> FIFO of waiting threads' Events; `_turns` is the round-robin order
+        self._waiters = {}
+        self._turns = collections.deque()
+
+    def acquire(self, owner: str):
+        with self._lock:
+            if self._in_flight < self.max_concurrent and not self._turns:
+                self._in_flight += 1
+                return
+            event = threading.Event()
+            if owner not in self._waiters:
+                self._waiters[owner] = collections.deque()
+                self._turns.append(owner)
+            self._waiters[owner].append(event)
+        # The slot is handed over by release(); _in_flight already counts us
+        event.wait()
+
+    def release(self):
+        with self._lock:
+            if not self._turns:
+                self._in_flight -= 1
+                return
+            owner = self._turns.popleft()
+            waiters = self._waiters[owner]
+            event = waiters.popleft()
+            if waiters:
+                # Back of the line until every other owner has had a turn
+                self._turns.append(owner)
+            else:
+                del self._waiters[owner]
+        event.set()
+
+    @contextlib.contextmanager
+    def slot(self, owner: str):
+        self.acquire(owner)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return self._in_flight
+
+
+_request_limiters = {}
+_request_limiters_lock = threading.Lock()
+
+
+def get_request_limiter(url: str, max_concurrent: int = 8) -> FairRequestLimiter:
+    """The process-wide FairRequestLimiter for `url`'s host"""
+    host = urlparse(url).netloc
+    with _request_limiters_lock:
+        if host not in _request_limiters:
+            _request_limiters[host] = FairRequestLimiter(max_concurrent=max_concurrent)
+        return _request_limiters[host]
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "shared")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.shared = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for `key` is in flight, any
+    other thread asking for the same `key` waits for it and gets its result (or
+    its exception) instead of making a call of its own. Nothing is kept once the
+    call returns; that's the response cache's job.
+
+    When a call was shared, every caller gets its own deep copy of the result so
+    that they can't trip over each other's changes to it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Returns (result, shared); `shared` is True if another thread's call was joined"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result), True
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # No one can join once it's out of _calls, so `shared` is final
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        if call.shared:
+            # The waiters are copying call.result; keep it untouched
+            return copy.deepcopy(call.result), False
+        return call.result, False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._calls)
@@ -1,14 +1,43 @@
-import datetime
-import json
+from __future__ import annotations
+
+import copy
 import logging
+import threading
+import time
+
+from typing import TYPE_CHECKING, List
 
 from cryptoadvance.specter.services.service import Service, devstatus_alpha, devstatus_prod
+from cryptoadvance.specter.services.service_annotations_storage import ServiceAnnotationsStorage
+from cryptoadvance.specter.services.service_encrypted_storage import (
+    ServiceEncryptedStorage,
+    ServiceEncryptedStorageError,
+    ServiceEncryptedStorageManager,
+)
 # A SpecterError can be raised and will be shown to the user as a red banner
 from cryptoadvance.specter.specter_error import SpecterError
-from cryptoadvance.specter.user import User
-from cryptoadvance.specter.wallet import Wallet
 from flask import current_app as app
-# from flask_apscheduler import APScheduler
+from flask import g, has_app_context
+
+from .config import BaseConfig
+from .cursor import SyncCursor
+from .exceptions import BitcoinReserveApiException
+from .models import to_minor_units
+
+# Specter imports this module when it loads the extension, for every user, so only
+# what's needed to register the service is imported up front. The store, sync,
+# quotes, order watcher and the API client (with the HTTP stack) are imported on
+# first use, in the methods that build them.
+if TYPE_CHECKING:
+    from cryptoadvance.specter.user import User
+    from cryptoadvance.specter.wallet import Wallet
+
+    from .analytics import BitcoinReserveAnalytics
+    from .index import BitcoinReserveWithdrawalIndex
+    from .quotes import BitcoinReserveQuoteManager
+    from .storage import BitcoinReserveTransactionStore
+    from .sync import BitcoinReserveSyncScheduler
+    from .watcher import BitcoinReserveOrderWatcher
 
 logger = logging.getLogger(__name__)
 
@@ -30,33 +59,192 @@ class BitcoinReserveService(Service):
     # Those will end up as keys in a json-file
     SPECTER_WALLET_ALIAS = "wallet"
     API_TOKEN = "api_token"
+    SYNC_CURSOR = "sync_cursor"
+
+    # Superseded by SYNC_CURSOR; only cleared when migrating existing users
     LAST_TRANSACTION_TIME = "last_transaction_time"
 
-    # def callback_after_serverpy_init_app(self, scheduler: APScheduler):
-    #     def every5seconds(hello, world="world"):
-    #         with scheduler.app.app_context():
-    #             pass
-                #print(f"Called {hello} {world} every5seconds")
-        # Here you can schedule regular jobs. triggers can be one of "interval", "date" or "cron"
-        # Examples:
-        # interval: https://apscheduler.readthedocs.io/en/3.x/modules/triggers/interval.html
-        # scheduler.add_job("every5seconds4", every5seconds, trigger='interval', seconds=5, args=["hello"])
-        # Date: https://apscheduler.readthedocs.io/en/3.x/modules/triggers/date.html
-        # scheduler.add_job("MyId", my_job, trigger='date', run_date=date(2009, 11, 6), args=['text'])
-        # cron: https://apscheduler.readthedocs.io/en/3.x/modules/triggers/cron.html
-        # sched.add_job("anotherID", job_function, trigger='cron', day_of_week='mon-fri', hour=5, minute=30, end_date='2014-05-30')
-        # Maybe you should store the scheduler for later use:
-        # self.scheduler = scheduler
-
-    @classmethod
-    def get_associated_wallet(cls) -> Wallet:
+    # Held while the lazily built state below is created, so that concurrent first
+    # uses (e.g. the login hook and a background sync) don't each build their own;
+    # reentrant since the per-user getters build on each other
+    _state_lock = threading.RLock()
+
+    # Local per-user transaction history, keyed on username
+    _transaction_stores = {}
+
+    # Per-user txid / address -> order metadata; see get_withdrawal_index()
+    _withdrawal_indexes = {}
+
+    # Per-user cost basis / DCA aggregates; see get_analytics()
+    _analytics = {}
+
+    # One update() at a time per user; see get_sync_lock()
+    _sync_locks = {}
+    _sync_locks_lock = threading.Lock()
+
+    # Background sync; see callback_after_serverpy_init_app()
+    scheduler = None
+    _sync_scheduler = None
+
+    # Flash buy quotes; see get_quote_manager()
+    _quote_manager = None
+
+    # Open orders' status pollers; see get_order_watcher()
+    _order_watcher = None
+
+    def callback_after_serverpy_init_app(self, scheduler):
+        """
+        Called by Specter with its (flask_apscheduler) APScheduler once the app is
+        initialized; we use it for the recurring per-user background syncs.
+        """
+        cls = self.__class__
+        cls.scheduler = scheduler
+        if scheduler is None:
+            return
+        # Registered once the app is up rather than on each login; every run only
+        # syncs the users whose storage is unlocked anyway
+        with scheduler.app.app_context():
+            sync_scheduler = cls.get_sync_scheduler()
+            sync_scheduler.scheduler = scheduler
+            sync_scheduler.schedule_interval_sync()
+
+    @classmethod
+    def get_sync_scheduler(cls) -> BitcoinReserveSyncScheduler:
+        from .sync import BitcoinReserveSyncScheduler
+
+        with cls._state_lock:
+            if cls._sync_scheduler is None:
+                cls._sync_scheduler = BitcoinReserveSyncScheduler(
+                    app._get_current_object(), scheduler=cls.scheduler
+                )
+            return cls._sync_scheduler
+
+    @classmethod
+    def get_quote_manager(cls) -> BitcoinReserveQuoteManager:
+        from .quotes import BitcoinReserveQuoteManager
+
+        with cls._state_lock:
+            if cls._quote_manager is None:
+                cls._quote_manager = BitcoinReserveQuoteManager(
+                    app._get_current_object(),
+                    expiry_margin=app.config.get(
+                        "BITCOIN_RESERVE_QUOTE_EXPIRY_MARGIN",
+                        BaseConfig.BITCOIN_RESERVE_QUOTE_EXPIRY_MARGIN,
+                    ),
+                    keepalive=app.config.get(
+                        "BITCOIN_RESERVE_QUOTE_KEEPALIVE",
+                        BaseConfig.BITCOIN_RESERVE_QUOTE_KEEPALIVE,
+                    ),
+                )
+            return cls._quote_manager
+
+    @classmethod
+    def get_order_watcher(cls) -> BitcoinReserveOrderWatcher:
+        from .watcher import BitcoinReserveOrderWatcher
+
+        with cls._state_lock:
+            if cls._order_watcher is None:
+                cls._order_watcher = BitcoinReserveOrderWatcher(
+                    app._get_current_object(),
+                    min_interval=app.config.get(
+                        "BITCOIN_RESERVE_ORDER_POLL_MIN_INTERVAL",
+                        BaseConfig.BITCOIN_RESERVE_ORDER_POLL_MIN_INTERVAL,
+                    ),
+                    max_interval=app.config.get(
+                        "BITCOIN_RESERVE_ORDER_POLL_MAX_INTERVAL",
+                        BaseConfig.BITCOIN_RESERVE_ORDER_POLL_MAX_INTERVAL,
+                    ),
+                    backoff=app.config.get(
+                        "BITCOIN_RESERVE_ORDER_POLL_BACKOFF",
+                        BaseConfig.BITCOIN_RESERVE_ORDER_POLL_BACKOFF,
+                    ),
+                    on_final=cls._on_order_final,
+                )
+            return cls._order_watcher
+
+    @classmethod
+    def _on_order_final(cls, user_id: str, status: dict):
+        """A watched order is done; pull its transactions into the local history"""
+        user = app.specter.user_manager.get_user(user_id)
+        if user:
+            cls.get_sync_scheduler().trigger(user)
+
+    @classmethod
+    def _get_user_service_storage(cls, user: User) -> ServiceEncryptedStorage:
+        """
+        The (decrypted) ServiceEncryptedStorage for any user, not just the
+        current_user. Raises ServiceEncryptedStorageError if that user's storage
+        can't be decrypted (i.e. they're not logged in).
+        """
+        storage_manager = ServiceEncryptedStorageManager.get_instance()
+        storage = storage_manager.storage_by_user.get(user)
+        if not storage:
+            storage = ServiceEncryptedStorage(storage_manager.data_folder, user)
+            storage_manager.storage_by_user[user] = storage
+        return storage
+
+    @classmethod
+    def _get_service_data_memo(cls) -> dict:
+        """
+        Decrypted service data, keyed on user id, memoized for the lifetime of the
+        current app context (i.e. one request, or one background sync run) so that
+        the several credential/wallet lookups a single request makes don't each
+        re-read the encrypted storage. All writes below go through it.
+        """
+        if not has_app_context():
+            return None
+        if "bitcoinreserve_service_data" not in g:
+            g.bitcoinreserve_service_data = {}
+        return g.bitcoinreserve_service_data
+
+    @classmethod
+    def get_user_service_data(cls, user: User = None) -> dict:
+        """Works outside of a request context if `user` is specified"""
+        if user is None:
+            user = app.specter.user_manager.get_user()
+        memo = cls._get_service_data_memo()
+        if memo is not None and user.id in memo:
+            return copy.deepcopy(memo[user.id])
+
+        service_data = cls._get_user_service_storage(user).get_service_data(cls.id)
+        if memo is not None:
+            memo[user.id] = copy.deepcopy(service_data)
+        return service_data
+
+    @classmethod
+    def update_user_service_data(cls, service_data: dict, user: User = None):
+        if user is None:
+            user = app.specter.user_manager.get_user()
+        cls._get_user_service_storage(user).update_service_data(cls.id, service_data)
+        memo = cls._get_service_data_memo()
+        if memo is not None and user.id in memo:
+            memo[user.id].update(copy.deepcopy(service_data))
+
+    @classmethod
+    def get_current_user_service_data(cls) -> dict:
+        return cls.get_user_service_data()
+
+    @classmethod
+    def update_current_user_service_data(cls, service_data: dict):
+        cls.update_user_service_data(service_data)
+
+    @classmethod
+    def set_current_user_service_data(cls, service_data: dict):
+        super().set_current_user_service_data(service_data)
+        memo = cls._get_service_data_memo()
+        if memo is not None:
+            memo[app.specter.user_manager.get_user().id] = copy.deepcopy(service_data)
+
+    @classmethod
+    def get_associated_wallet(cls, user: User = None) -> Wallet:
         """Get the Specter `Wallet` that is currently associated with this service"""
-        service_data = cls.get_current_user_service_data()
+        service_data = cls.get_user_service_data(user)
         if not service_data or BitcoinReserveService.SPECTER_WALLET_ALIAS not in service_data:
             # Service is not initialized; nothing to do
             return
+        wallet_manager = user.wallet_manager if user else app.specter.wallet_manager
         try:
-            return app.specter.wallet_manager.get_by_alias(
+            return wallet_manager.get_by_alias(
                 service_data[BitcoinReserveService.SPECTER_WALLET_ALIAS]
             )
         except SpecterError as e:
@@ -70,6 +258,13 @@ class BitcoinReserveService(Service):
         """Set the Specter `Wallet` that is currently associated with this Service"""
         cls.update_current_user_service_data({BitcoinReserveService.SPECTER_WALLET_ALIAS: wallet.alias})
 
+        # The withdrawals synced so far get linked to the new wallet on the next sync
+        withdrawal_index = cls._withdrawal_indexes.get(
+            app.specter.user_manager.get_user().username
+        )
+        if withdrawal_index is not None:
+            withdrawal_index.mark_unlinked()
+
 
     @classmethod
     def set_api_credentials(cls, user: User, api_token: str):
@@ -81,8 +276,8 @@ class BitcoinReserveService(Service):
         user.add_service(BitcoinReserveService.id)
 
     @classmethod
-    def get_api_credentials(cls) -> dict:
-        service_data = cls.get_current_user_service_data()
+    def get_api_credentials(cls, user: User = None) -> dict:
+        service_data = cls.get_user_service_data(user)
         if BitcoinReserveService.API_TOKEN not in service_data:
             return {}
 
@@ -103,16 +298,157 @@ class BitcoinReserveService(Service):
         return BitcoinReserveService.get_api_credentials() != {}
 
     @classmethod
-    def update(cls):
+    def get_transaction_store(cls, user: User = None) -> BitcoinReserveTransactionStore:
+        """The current (or specified) user's locally synced transaction history"""
+        from .storage import BitcoinReserveTransactionStore
+
+        if user is None:
+            user = app.specter.user_manager.get_user()
+        with cls._state_lock:
+            if user.username not in cls._transaction_stores:
+                cls._transaction_stores[user.username] = BitcoinReserveTransactionStore(
+                    app.specter.data_folder, user.username
+                )
+            return cls._transaction_stores[user.username]
+
+    @classmethod
+    def get_withdrawal_index(cls, user: User = None) -> BitcoinReserveWithdrawalIndex:
+        """
+        The current (or specified) user's withdrawal index; built from the local
+        store on first use, then kept current by update().
+        """
+        from .index import BitcoinReserveWithdrawalIndex
+
+        if user is None:
+            user = app.specter.user_manager.get_user()
+        with cls._state_lock:
+            if user.username not in cls._withdrawal_indexes:
+                cls._withdrawal_indexes[user.username] = BitcoinReserveWithdrawalIndex.from_store(
+                    cls.id, cls.get_transaction_store(user)
+                )
+            return cls._withdrawal_indexes[user.username]
+
+    @classmethod
+    def get_analytics(cls, user: User = None) -> BitcoinReserveAnalytics:
+        """
+        The current (or specified) user's purchase analytics; built from the local
+        store on first use, then kept current by update().
+        """
+        from .analytics import BitcoinReserveAnalytics
+
+        if user is None:
+            user = app.specter.user_manager.get_user()
+        with cls._state_lock:
+            if user.username not in cls._analytics:
+                cls._analytics[user.username] = BitcoinReserveAnalytics.from_store(
+                    cls.get_transaction_store(user)
+                )
+            return cls._analytics[user.username]
+
+    @classmethod
+    def link_withdrawals_to_wallet(cls, withdrawals: List[dict], user: User = None):
+        """
+        Attach on-chain withdrawals to the associated wallet:
+        * each receiving address is associated with this service (and labeled,
+            unless the user already labeled it) and gets the order as its annotation;
+        * each withdrawal tx gets the order as its annotation.
+
+        However many withdrawals there are, that's at most one write of the wallet's
+        addresses file and one of its annotations file.
+        """
+        wallet = cls.get_associated_wallet(user)
+        if not wallet:
+            return
+
+        annotations = None
+        addresses_to_label = {}
+        for withdrawal in withdrawals:
+            address = withdrawal.get("withdrawal_address")
+            if not address or not wallet.is_address_mine(address):
+                continue
+            if annotations is None:
+                annotations = ServiceAnnotationsStorage(cls.id, wallet)
+            annotations.set_addr_annotations(address, withdrawal, autosave=False)
+            if withdrawal.get("withdrawal_identifier"):
+                annotations.set_tx_annotations(
+                    withdrawal["withdrawal_identifier"], withdrawal, autosave=False
+                )
+
+            addr_obj = wallet.get_address_obj(address)
+            if addr_obj["service_id"] == cls.id and addr_obj["label"]:
+                # Already linked on a previous sync
+                continue
+            addresses_to_label[address] = addr_obj["label"] or f"{cls.name} withdrawal"
+
+        if annotations is not None:
+            annotations.save()
+
+        # Only the last association saves the addresses file
+        for i, (address, label) in enumerate(addresses_to_label.items()):
+            wallet.associate_address_with_service(
+                address=address,
+                service_id=cls.id,
+                label=label,
+                autosave=i == len(addresses_to_label) - 1,
+            )
+
+    @classmethod
+    def get_sync_cursor(cls, user: User, service_data: dict) -> SyncCursor:
+        """
+        The user's SyncCursor; a fresh one (i.e. a full backfill) if the local store
+        is empty. Users synced before there was a cursor only have a
+        LAST_TRANSACTION_TIME watermark, but nothing older than it ever made it into
+        the local store, so they get the full backfill too.
+        """
+        if BitcoinReserveService.SYNC_CURSOR not in service_data:
+            return SyncCursor()
+        if cls.get_transaction_store(user).count() == 0:
+            # e.g. the store file was deleted; the saved cursor would skip everything
+            return SyncCursor()
+        return SyncCursor.from_dict(service_data[BitcoinReserveService.SYNC_CURSOR])
+
+    @classmethod
+    def get_sync_lock(cls, user: User) -> threading.Lock:
+        """Held for the whole of a user's update(); syncs of different users don't wait on each other"""
+        with cls._sync_locks_lock:
+            if user.username not in cls._sync_locks:
+                cls._sync_locks[user.username] = threading.Lock()
+            return cls._sync_locks[user.username]
+
+    @classmethod
+    def update(cls, user: User = None):
+        """
+        Incremental sync of the user's Bitcoin Reserve history into the local
+        transaction store. Normally runs in the background via the sync scheduler,
+        so `user` is specified explicitly there (no request context).
+
+        Concurrent syncs of the same user (the scheduler, the login hook, a page)
+        are serialized: each reads the sync cursor only once the previous one has
+        saved its watermark, so they never fetch the same pages twice or overwrite
+        each other's watermark.
+        """
+        if user is None:
+            user = app.specter.user_manager.get_user()
+        with cls.get_sync_lock(user):
+            cls._update(user)
+
+    @classmethod
+    def _update(cls, user: User):
         from . import client as bitcoinreserve_client
-        transactions = bitcoinreserve_client.get_transactions()
+        from .sync import fetch_sync_changes
+
+        try:
+            api_token = cls.get_api_credentials(user).get("api_token")
+            service_data = cls.get_user_service_data(user)
+        except ServiceEncryptedStorageError as e:
+            # User's encrypted storage is locked (e.g. logged out since the trigger)
+            logger.debug(repr(e))
+            return
+        if not api_token:
+            return
 
-        # The first entry is the summary data:
+        # Summary rows, newest first:
         """
-            {
-                "total_transaction_count": 29,
-                "page": 0
-            },
             {
                 "transaction_id": "1f88faf0-dfc4-410e-9163-7371f9aa9e30",
                 "transaction_status": "DONE",
@@ -124,29 +460,109 @@ class BitcoinReserveService(Service):
                 "out_amount": "28838.00000000"
             }
         """
-        last_transaction_time = BitcoinReserveService.get_current_user_service_data().get(BitcoinReserveService.LAST_TRANSACTION_TIME)
-        print(f"last_transaction_time: {last_transaction_time}")
-        new_last_transaction_time = datetime.datetime(2000, 1, 1).timestamp()
-        for index, tx in enumerate(transactions):
-            if index == 0:
-                print(f"""total_transaction_count: {tx.get("total_transaction_count")}""")
-                continue
+        cursor = cls.get_sync_cursor(user, service_data)
+        logger.debug(f"sync cursor watermark: {cursor.watermark}, {len(cursor.seen)} seen")
+
+        client = bitcoinreserve_client.get_client(api_token)
+        scanned, synced = fetch_sync_changes(client, cursor)
 
-            transaction_time = datetime.datetime.strptime(tx.get("transaction_time"), "%Y-%m-%d %H:%M:%S.%f").timestamp()
-            print(f"transaction_time: {transaction_time}")
+        # Keep everything locally so the UI can be served without hitting the API
+        withdrawal_index = cls.get_withdrawal_index(user)
+        analytics = cls.get_analytics(user)
+        store = cls.get_transaction_store(user)
+        store.save_transactions(synced)
+        analytics.add(synced)
+        cls.record_holdings(store, client, analytics, purchases_changed=bool(synced))
+
+        # Link new / updated withdrawals (and any whose linking failed before, or
+        # that were synced before the index was built) to the user's wallet
+        withdrawal_index.add(synced)
+        unlinked = withdrawal_index.get_unlinked()
+        if unlinked:
+            cls.link_withdrawals_to_wallet(unlinked, user=user)
+            withdrawal_index.mark_linked(
+                withdrawal["withdrawal_id"] for withdrawal in unlinked
+            )
 
-            if not last_transaction_time or transaction_time > last_transaction_time:
-                details = bitcoinreserve_client.get_transaction(tx.get("transaction_id"))
-                print(json.dumps(details, indent=4))
-                new_last_transaction_time = max(new_last_transaction_time, transaction_time)
-                print(f"new_last_transaction_time: {new_last_transaction_time}")
-        
-        if new_last_transaction_time > last_transaction_time:
+        new_cursor = cursor.advance(scanned)
+        logger.debug(f"{len(synced)} new/changed transactions; new watermark: {new_cursor.watermark}")
+        if new_cursor != cursor or BitcoinReserveService.SYNC_CURSOR not in service_data:
             # Update our service_data to mark these transactions as already scanned
-            BitcoinReserveService.update_current_user_service_data({
-                BitcoinReserveService.LAST_TRANSACTION_TIME: new_last_transaction_time
-            })
+            BitcoinReserveService.update_user_service_data({
+                BitcoinReserveService.SYNC_CURSOR: new_cursor.to_dict(),
+                BitcoinReserveService.LAST_TRANSACTION_TIME: None,
+            }, user=user)
+
+    @classmethod
+    def record_holdings(
+        cls,
+        store: BitcoinReserveTransactionStore,
+        client,
+        analytics: BitcoinReserveAnalytics,
+        purchases_changed: bool = True,
+    ):
+        """
+        Append the current fiat balances and cumulative sats bought / fiat spent
+        (from the analytics' running totals) to the user's time series, then roll
+        up aged points per BITCOIN_RESERVE_SERIES_ROLLUPS.
+        """
+        now = time.time()
+        values = {}
+        try:
+            # {"balance_eur": "0.00000000"}
+            for key, amount in client.get_fiat_balances().items():
+                currency = key[len("balance_"):] if key.startswith("balance_") else key
+                values[f"balance:{currency.upper()}"] = to_minor_units(amount, currency)
+        except BitcoinReserveApiException as e:
+            # Not worth failing the sync over; the next one will record it
+            logger.debug(f"Couldn't record balances: {e}")
+
+        if purchases_changed or "sats_bought" not in store.get_latest_series():
+            totals = analytics.get_totals()
+            values["sats_bought"] = sum(
+                currency_totals["sats"] for currency_totals in totals.values()
+            )
+            for currency, currency_totals in totals.items():
+                if currency:
+                    values[f"fiat_spent:{currency}"] = currency_totals["fiat_spent"]
+
+        store.append_series(values, now)
+        store.rollup_series(
+            app.config.get(
+                "BITCOIN_RESERVE_SERIES_ROLLUPS",
+                BaseConfig.BITCOIN_RESERVE_SERIES_ROLLUPS,
+            ),
+            now,
+        )
 
     @classmethod
     def on_user_login(cls):
-        cls.update()
+        # Don't make the login wait on the API; sync in the background instead
+        user = app.specter.user_manager.get_user()
+        cls.get_sync_scheduler().trigger(user)
+
+    @classmethod
+    def get_users_to_sync(cls) -> List[User]:
+        """
+        Every user with Bitcoin Reserve credentials whose service data we can
+        currently decrypt (i.e. who's logged in).
+        """
+        users = []
+        for user in app.specter.user_manager.users:
+            try:
+                if cls.get_api_credentials(user):
+                    users.append(user)
+            except ServiceEncryptedStorageError as e:
+                logger.debug(f"Not syncing {user.username}: {repr(e)}")
+        return users
+
+    @classmethod
+    def sync_all_users(cls) -> int:
+        """
+        Fan an incremental sync out to every user who can be synced (see
+        BitcoinReserveSyncScheduler). Returns the number of syncs queued.
+        """
+        users = cls.get_users_to_sync()
+        queued = cls.get_sync_scheduler().trigger_all(users)
+        logger.debug(f"Queued {queued} of {len(users)} user syncs")
+        return queued
@@ -0,0 +1,433 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from .models import TransactionDetails, as_dict
+
+
+logger = logging.getLogger(__name__)
+
+
+class BitcoinReserveTransactionStore:
+    """
+    Local per-user copy of the Bitcoin Reserve transaction history, kept in a SQLite
+    file under the Specter data folder:
+        <data_folder>/bitcoinreserve/<username>_transactions.sqlite
+
+    Each transaction is stored with its `get_transactions` summary row and, once
+    fetched, its `get_transaction` detail record. Lookups by transaction_id, by
+    transaction_time and by withdrawal address / txid (`withdrawal_identifier`) are
+    all indexed so the UI doesn't have to go back to the API.
+
+    The same file also keeps the user's balance / holdings time series (see
+    `append_series()`), downsampled as it ages so that months of history stay a
+    few hundred points.
+    """
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS transactions (
+            transaction_id TEXT PRIMARY KEY,
+            transaction_time REAL NOT NULL,
+            transaction_type TEXT,
+            transaction_status TEXT,
+            summary TEXT NOT NULL,
+            details TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_transactions_time ON transactions (transaction_time)",
+        """
+        CREATE TABLE IF NOT EXISTS withdrawals (
+            transaction_id TEXT NOT NULL,
+            withdrawal_serial_number INTEGER NOT NULL,
+            withdrawal_address TEXT,
+            withdrawal_identifier TEXT,
+            PRIMARY KEY (transaction_id, withdrawal_serial_number)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_withdrawals_address ON withdrawals (withdrawal_address)",
+        "CREATE INDEX IF NOT EXISTS idx_withdrawals_identifier ON withdrawals (withdrawal_identifier)",
+        # Bumped on every write; lets readers cheaply tell if anything changed
+        """
+        CREATE TABLE IF NOT EXISTS store_info (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        """,
+        # resolution: seconds per point, 0 for raw samples; values are ints
+        # (sats / fiat minor units)
+        """
+        CREATE TABLE IF NOT EXISTS series (
+            resolution INTEGER NOT NULL,
+            metric TEXT NOT NULL,
+            time REAL NOT NULL,
+            value INTEGER NOT NULL,
+            PRIMARY KEY (resolution, metric, time)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_series_time ON series (time)",
+    ]
+
+    def __init__(self, data_folder: str, username: str):
+        self.path = os.path.join(
+            data_folder, "bitcoinreserve", f"{username}_transactions.sqlite"
+        )
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._write_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    @contextmanager
+    def _connect(self):
+        # sqlite3 connections can't be shared across threads; they're cheap to open
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def save_transactions(self, transactions: Iterable[Tuple[dict, float, dict]]):
+        """
+        Insert or update (summary, transaction_time, details) entries in a single
+        write transaction. `details` may be None if it hasn't been fetched; an
+        already-stored detail record is then kept.
+        """
+        transactions = list(transactions)
+        if not transactions:
+            return
+        with self._write_lock, self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO store_info (key, value) VALUES ('revision', 1)
+                ON CONFLICT (key) DO UPDATE SET value = value + 1
+                """
+            )
+            for summary, transaction_time, details in transactions:
+                transaction_id = summary["transaction_id"]
+                conn.execute(
+                    """
+                    INSERT INTO transactions (
+                        transaction_id, transaction_time, transaction_type,
+                        transaction_status, summary, details
+                    ) VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (transaction_id) DO UPDATE SET
+                        transaction_time = excluded.transaction_time,
+                        transaction_type = excluded.transaction_type,
+                        transaction_status = excluded.transaction_status,
+                        summary = excluded.summary,
+                        details = COALESCE(excluded.details, transactions.details)
+                    """,
+                    (
+                        transaction_id,
+                        transaction_time,
+                        summary.get("transaction_type"),
+                        summary.get("transaction_status"),
+                        json.dumps(as_dict(summary)),
+                        json.dumps(as_dict(details)) if details else None,
+                    ),
+                )
+                if not details:
+                    continue
+
+                conn.execute(
+                    "DELETE FROM withdrawals WHERE transaction_id = ?", (transaction_id,)
+                )
+                conn.executemany(
+                    """
+                    INSERT INTO withdrawals (
+                        transaction_id, withdrawal_serial_number,
+                        withdrawal_address, withdrawal_identifier
+                    ) VALUES (?, ?, ?, ?)
+                    """,
+                    [
+                        (
+                            transaction_id,
+                            withdrawal.get("withdrawal_serial_number", index),
+                            withdrawal.get("withdrawal_address"),
+                            withdrawal.get("withdrawal_identifier"),
+                        )
+                        for index, withdrawal in enumerate(
+                            TransactionDetails(as_dict(details)).withdrawals
+                        )
+                    ],
+                )
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        return {
+            "transaction_id": row["transaction_id"],
+            "transaction_time": row["transaction_time"],
+            "summary": json.loads(row["summary"]),
+            "details": json.loads(row["details"]) if row["details"] else None,
+        }
+
+    def get_transaction(self, transaction_id: str) -> dict:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM transactions WHERE transaction_id = ?", (transaction_id,)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    @staticmethod
+    def _filter(
+        since: float = None,
+        until: float = None,
+        transaction_type: str = None,
+        transaction_status: str = None,
+    ) -> Tuple[str, list]:
+        """WHERE clause (and its params) shared by get_transactions() and count()"""
+        clauses = []
+        params = []
+        if since is not None:
+            clauses.append("transaction_time >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("transaction_time < ?")
+            params.append(until)
+        if transaction_type is not None:
+            clauses.append("transaction_type = ?")
+            params.append(transaction_type)
+        if transaction_status is not None:
+            clauses.append("transaction_status = ?")
+            params.append(transaction_status)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def get_transactions(
+        self,
+        limit: int = None,
+        offset: int = 0,
+        since: float = None,
+        until: float = None,
+        transaction_type: str = None,
+        transaction_status: str = None,
+    ) -> List[dict]:
+        """
+        Newest first, optionally limited to `since` <= transaction_time < `until`
+        and/or to one transaction_type / transaction_status
+        """
+        where, params = self._filter(since, until, transaction_type, transaction_status)
+        query = (
+            "SELECT * FROM transactions"
+            + where
+            + " ORDER BY transaction_time DESC, transaction_id LIMIT ? OFFSET ?"
+        )
+        params += [limit if limit is not None else -1, offset]
+        with self._connect() as conn:
+            return [self._to_dict(row) for row in conn.execute(query, params)]
+
+    def iter_transactions(
+        self,
+        since: float = None,
+        until: float = None,
+        transaction_type: str = None,
+        transaction_status: str = None,
+        batch_size: int = 500,
+    ) -> Iterator[dict]:
+        """
+        Same order and filters as get_transactions(), but reads `batch_size` rows at
+        a time so that any size of history can be walked in constant memory.
+
+        Each batch is its own short read that picks up after the last row of the
+        previous one (keyset pagination rather than OFFSET, which would rescan every
+        row before it), so no connection or read snapshot is held in between and a
+        slow consumer never keeps a sync from writing.
+        """
+        where, params = self._filter(since, until, transaction_type, transaction_status)
+        last = None
+        while True:
+            batch_where, batch_params = where, list(params)
+            if last is not None:
+                batch_where += " AND " if batch_where else " WHERE "
+                batch_where += (
+                    "(transaction_time < ? OR (transaction_time = ? AND transaction_id > ?))"
+                )
+                batch_params += [last[0], last[0], last[1]]
+            query = (
+                "SELECT * FROM transactions"
+                + batch_where
+                + " ORDER BY transaction_time DESC, transaction_id LIMIT ?"
+            )
+            with self._connect() as conn:
+                rows = conn.execute(query, batch_params + [batch_size]).fetchall()
+            for row in rows:
+                yield self._to_dict(row)
+            if len(rows) < batch_size:
+                return
+            last = (rows[-1]["transaction_time"], rows[-1]["transaction_id"])
+
+    def get_by_withdrawal_identifier(self, txid: str) -> dict:
+        """The transaction whose withdrawal was broadcast as on-chain `txid`"""
+        with self._connect() as conn:
+            row = conn.execute(
+                """
+                SELECT t.* FROM withdrawals w
+                JOIN transactions t ON t.transaction_id = w.transaction_id
+                WHERE w.withdrawal_identifier = ?
+                """,
+                (txid,),
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def get_by_withdrawal_address(self, address: str) -> List[dict]:
+        """All transactions that withdrew to `address`, newest first"""
+        with self._connect() as conn:
+            return [
+                self._to_dict(row)
+                for row in conn.execute(
+                    """
+                    SELECT t.* FROM withdrawals w
+                    JOIN transactions t ON t.transaction_id = w.transaction_id
+                    WHERE w.withdrawal_address = ?
+                    ORDER BY t.transaction_time DESC
+                    """,
+                    (address,),
+                )
+            ]
+
+    def count(
+        self,
+        since: float = None,
+        until: float = None,
+        transaction_type: str = None,
+        transaction_status: str = None,
+    ) -> int:
+        """Number of transactions matching the same filters as get_transactions()"""
+        where, params = self._filter(since, until, transaction_type, transaction_status)
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM transactions" + where, params
+            ).fetchone()[0]
+
+    def get_revision(self) -> int:
+        """Changes whenever transactions are saved; 0 for an empty store"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM store_info WHERE key = 'revision'"
+            ).fetchone()
+        return row[0] if row else 0
+
+    def get_statuses(self, since: float = None) -> Dict[str, str]:
+        """transaction_id -> transaction_status, optionally only from `since` on"""
+        query = "SELECT transaction_id, transaction_status FROM transactions"
+        params = []
+        if since is not None:
+            query += " WHERE transaction_time >= ?"
+            params.append(since)
+        with self._connect() as conn:
+            return {row[0]: row[1] for row in conn.execute(query, params)}
+
+    def get_latest_series(self) -> Dict[str, int]:
+        """metric -> its most recent value"""
+        with self._connect() as conn:
+            return {
+                row[0]: row[1]
+                for row in conn.execute(
+                    # SQLite returns the bare `value` column of the MAX(time) row
+                    "SELECT metric, value, MAX(time) FROM series GROUP BY metric"
+                )
+            }
+
+    def append_series(self, values: Dict[str, int], sample_time: float):
+        """
+        Add a raw sample of each metric. Metrics whose value hasn't changed since
+        their previous sample are skipped; the series are step functions.
+        """
+        latest = self.get_latest_series()
+        changed = [
+            (metric, sample_time, value)
+            for metric, value in values.items()
+            if value is not None and latest.get(metric) != value
+        ]
+        if not changed:
+            return
+        with self._write_lock, self._connect() as conn:
+            conn.executemany(
+                """
+                INSERT INTO series (resolution, metric, time, value) VALUES (0, ?, ?, ?)
+                ON CONFLICT (resolution, metric, time) DO UPDATE SET value = excluded.value
+                """,
+                changed,
+            )
+
+    def rollup_series(self, levels: List[Tuple[int, float]], now: float):
+        """
+        Downsample aged points. `levels` is [(resolution, horizon), ...] from fine to
+        coarse, e.g. [(3600, 1 day), (86400, 7 days)]: raw samples older than a day
+        become hourly points, hourly points older than a week become daily ones.
+        Each bucket keeps its last sample (value and time), so the step function's
+        steps stay where they were, just with fewer of them.
+        """
+        source = 0
+        with self._write_lock, self._connect() as conn:
+            for resolution, horizon in levels:
+                cutoff = now - horizon
+                conn.execute(
+                    """
+                    INSERT INTO series (resolution, metric, time, value)
+                    SELECT ?, metric, last_time, value FROM (
+                        SELECT metric, CAST(time / ? AS INTEGER) AS bucket,
+                            value, MAX(time) AS last_time
+                        FROM series
+                        WHERE resolution = ? AND time < ?
+                        GROUP BY metric, bucket
+                    ) WHERE true
+                    ON CONFLICT (resolution, metric, time) DO UPDATE SET value = excluded.value
+                    """,
+                    (resolution, resolution, source, cutoff),
+                )
+                # A bucket rolled up by an earlier run may just have got a later
+                # sample; only the latest point per bucket is kept
+                conn.execute(
+                    """
+                    DELETE FROM series WHERE resolution = ? AND time < (
+                        SELECT MAX(later.time) FROM series AS later
+                        WHERE later.resolution = series.resolution
+                            AND later.metric = series.metric
+                            AND CAST(later.time / ? AS INTEGER)
+                                = CAST(series.time / ? AS INTEGER)
+                    )
+                    """,
+                    (resolution, resolution, resolution),
+                )
+                conn.execute(
+                    "DELETE FROM series WHERE resolution = ? AND time < ?",
+                    (source, cutoff),
+                )
+                source = resolution
+
+    def get_series(
+        self, metrics: List[str] = None, since: float = None, until: float = None
+    ) -> Dict[str, List[Tuple[float, int]]]:
+        """
+        metric -> [(time, value), ...] oldest first, at whatever resolution each
+        stretch of time is stored in
+        """
+        clauses = []
+        params = []
+        if metrics:
+            clauses.append(f"metric IN ({', '.join('?' for _ in metrics)})")
+            params += list(metrics)
+        if since is not None:
+            clauses.append("time >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("time < ?")
+            params.append(until)
+        query = "SELECT metric, time, value FROM series"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY time"
+        series = {}
+        with self._connect() as conn:
+            for metric, time, value in conn.execute(query, params):
+                series.setdefault(metric, []).append((time, value))
+        return series
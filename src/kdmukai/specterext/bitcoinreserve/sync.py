@@ -0,0 +1,152 @@
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Tuple
+
+from .config import BaseConfig
+from .cursor import SyncCursor
+
+if TYPE_CHECKING:
+    # Only for annotations; fetch_sync_changes() is handed an already built client
+    from .api_client import BitcoinReserveClient
+
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_sync_changes(
+    client: "BitcoinReserveClient", cursor: SyncCursor
+) -> Tuple[List[Tuple[dict, float]], List[Tuple[dict, float, dict]]]:
+    """
+    The API half of an incremental sync. Returns every summary row from the
+    cursor's watermark on as (summary, transaction_time), for `cursor.advance()`,
+    and (summary, transaction_time, details) for the rows that are new or whose
+    status changed, for the store.
+
+    Needs nothing but its (picklable) arguments, so it can run in a worker process.
+    """
+    # Walks every page but stops once we're back to already-scanned history
+    scanned = []
+    new_transactions = []
+    for tx in client.iter_transactions(since=cursor.watermark):
+        transaction_time = tx.transaction_time
+        scanned.append((tx, transaction_time))
+        if not cursor.is_unchanged(tx):
+            # New, or its status changed since we last fetched its details
+            new_transactions.append((tx, transaction_time))
+
+    # Fetch the detail records in parallel (bounded per user); returned in order
+    all_details = client.get_transactions_details(
+        [tx.get("transaction_id") for tx, transaction_time in new_transactions]
+    )
+    synced = [
+        (tx, transaction_time, details)
+        for (tx, transaction_time), details in zip(new_transactions, all_details)
+    ]
+    return scanned, synced
+
+
+class BitcoinReserveSyncScheduler:
+    """
+    Runs `BitcoinReserveService.update()` for a user off the request thread.
+
+    * `trigger(user)` returns immediately; the sync runs on a small worker pool.
+    * Duplicate triggers are coalesced: while a user's sync is still queued, further
+        triggers are dropped; if it's already running, exactly one follow-up sync is
+        queued once it finishes.
+    * `trigger_all(users)` fans a sync out to every user; they share the worker
+        pool and the process-wide FairRequestLimiter, which caps upstream requests
+        in flight and hands out slots round-robin per user, so a large account
+        can't starve the others.
+    * If Specter handed us its APScheduler (see
+        `BitcoinReserveService.callback_after_serverpy_init_app`), a single
+        recurring job (with jitter) runs that fan-out for every user with
+        credentials on an interval.
+    """
+
+    def __init__(self, flask_app, scheduler=None):
+        self.app = flask_app
+        self.scheduler = scheduler
+        config = flask_app.config
+        self.interval = config.get(
+            "BITCOIN_RESERVE_SYNC_INTERVAL", BaseConfig.BITCOIN_RESERVE_SYNC_INTERVAL
+        )
+        self.jitter = config.get(
+            "BITCOIN_RESERVE_SYNC_JITTER", BaseConfig.BITCOIN_RESERVE_SYNC_JITTER
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.get(
+                "BITCOIN_RESERVE_SYNC_WORKERS", BaseConfig.BITCOIN_RESERVE_SYNC_WORKERS
+            ),
+            thread_name_prefix="bitcoinreserve-sync",
+        )
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._running = set()
+        self._rerun = set()
+
+    def trigger(self, user) -> bool:
+        """Queue a sync for `user`. Returns False if it was coalesced into one already pending."""
+        with self._lock:
+            if user.id in self._queued:
+                return False
+            if user.id in self._running:
+                self._rerun.add(user.id)
+                return False
+            self._queued.add(user.id)
+        self._executor.submit(self._run, user)
+        return True
+
+    def is_syncing(self, user) -> bool:
+        with self._lock:
+            return user.id in self._queued or user.id in self._running
+
+    def _run(self, user):
+        from .service import BitcoinReserveService
+
+        with self._lock:
+            self._queued.discard(user.id)
+            self._running.add(user.id)
+        try:
+            with self.app.app_context():
+                BitcoinReserveService.update(user=user)
+        except Exception as e:
+            # Never let a failed sync take down the worker; the next trigger retries
+            logger.exception(e)
+        finally:
+            with self._lock:
+                self._running.discard(user.id)
+                rerun = user.id in self._rerun
+                self._rerun.discard(user.id)
+            if rerun:
+                self.trigger(user)
+
+    def trigger_all(self, users) -> int:
+        """Queue a sync for each of `users`; returns how many weren't already pending"""
+        return sum(1 for user in users if self.trigger(user))
+
+    def schedule_interval_sync(self):
+        """Add the recurring sync of all users' histories, unless it's already scheduled"""
+        if not self.scheduler or self.scheduler.get_job("bitcoinreserve_sync_all"):
+            return
+
+        def interval_sync():
+            from .service import BitcoinReserveService
+
+            with self.app.app_context():
+                BitcoinReserveService.sync_all_users()
+
+        self.scheduler.add_job(
+            "bitcoinreserve_sync_all",
+            interval_sync,
+            trigger="interval",
+            seconds=self.interval,
+            jitter=self.jitter,
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+        )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,223 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+from typing import Callable, Iterator
+
+from .cursor import FINAL_TRANSACTION_STATUSES
+from .exceptions import BitcoinReserveApiException
+from .models import Order
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_order_final(status: dict) -> bool:
+    """True once neither the order nor any of its withdrawals can change anymore"""
+    order = Order(status)
+    if order.order_status not in FINAL_TRANSACTION_STATUSES:
+        return False
+    return all(
+        withdrawal.withdrawal_status in FINAL_TRANSACTION_STATUSES
+        for withdrawal in order.withdrawals
+    )
+
+
+def get_withdrawal_eta(status: dict) -> float:
+    """The latest `withdrawal_eta` of the order's withdrawals, if any"""
+    etas = [
+        withdrawal.withdrawal_eta
+        for withdrawal in Order(status).withdrawals
+        if withdrawal.withdrawal_eta
+    ]
+    return max(etas) if etas else None
+
+
+class BitcoinReserveOrderSubscription:
+    """One browser's view of an order's status changes; see BitcoinReserveOrderWatcher"""
+
+    def __init__(self, watcher: "BitcoinReserveOrderWatcher", key: tuple):
+        self.watcher = watcher
+        self.key = key
+        self._queue = queue.Queue()
+
+    def publish(self, status: dict):
+        self._queue.put(status)
+
+    def finish(self):
+        self._queue.put(None)
+
+    def get(self, timeout: float = None) -> dict:
+        """The next status; None once the order is final. Raises queue.Empty on timeout."""
+        return self._queue.get(timeout=timeout)
+
+    def events(self, keepalive: float = 15) -> Iterator[str]:
+        """
+        The status changes as server-sent events. Sends a comment every `keepalive`
+        seconds so that proxies don't drop an idle connection, and a final `done`
+        event once the order can't change anymore. Unsubscribes when closed.
+        """
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    status = self.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if status is None:
+                    yield "event: done\ndata: {}\n\n"
+                    return
+                yield f"data: {json.dumps(status)}\n\n"
+        finally:
+            self.close()
+
+    def close(self):
+        self.watcher.unsubscribe(self)
+
+
+class _OrderPoller:
+    def __init__(self, key: tuple, api_token: str):
+        self.key = key
+        self.api_token = api_token
+        self.subscriptions = []
+        self.status = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+
+class BitcoinReserveOrderWatcher:
+    """
+    Follows open orders' `get_order_status` server-side and pushes every change to
+    the subscribed browsers.
+
+    * There's one poller thread per (user, order), no matter how many tabs are
+        watching it; a new subscriber immediately gets the last known status.
+    * Polls every `min_interval` seconds right after it starts and after every
+        change, then backs off by `backoff` per unchanged poll up to `max_interval`,
+        but never sleeps past the order's `withdrawal_eta`, when the next change
+        is expected.
+    * Stops once the order is final (then calls `on_final(user_id, status)`), once
+        nobody is subscribed anymore or after `max_watch` seconds.
+    """
+
+    def __init__(
+        self,
+        flask_app,
+        min_interval: float = 2,
+        max_interval: float = 300,
+        backoff: float = 1.5,
+        max_watch: float = 24 * 3600,
+        on_final: Callable[[str, dict], None] = None,
+    ):
+        self.app = flask_app
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_watch = max_watch
+        self.on_final = on_final
+        self._lock = threading.Lock()
+        self._pollers = {}
+
+    def subscribe(
+        self, user_id: str, order_id: str, api_token: str
+    ) -> BitcoinReserveOrderSubscription:
+        key = (user_id, order_id)
+        subscription = BitcoinReserveOrderSubscription(self, key)
+        with self._lock:
+            poller = self._pollers.get(key)
+            if poller is None:
+                poller = _OrderPoller(key, api_token)
+                poller.thread = threading.Thread(
+                    target=self._poll,
+                    args=(poller,),
+                    name=f"bitcoinreserve-order-{order_id}",
+                    daemon=True,
+                )
+                self._pollers[key] = poller
+                poller.thread.start()
+            elif poller.status is not None:
+                subscription.publish(poller.status)
+            poller.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: BitcoinReserveOrderSubscription):
+        with self._lock:
+            poller = self._pollers.get(subscription.key)
+            if poller is None or subscription not in poller.subscriptions:
+                return
+            poller.subscriptions.remove(subscription)
+            if not poller.subscriptions:
+                del self._pollers[subscription.key]
+                poller.stopped.set()
+
+    def is_watching(self, user_id: str, order_id: str) -> bool:
+        with self._lock:
+            return (user_id, order_id) in self._pollers
+
+    def _next_delay(self, interval: float, status: dict) -> float:
+        eta = get_withdrawal_eta(status) if status else None
+        if eta is not None and eta > time.time():
+            return min(interval, max(self.min_interval, eta - time.time()))
+        return interval
+
+    def _poll(self, poller: _OrderPoller):
+        from . import client as bitcoinreserve_client
+
+        user_id, order_id = poller.key
+        started = time.monotonic()
+        interval = self.min_interval
+        while not poller.stopped.is_set():
+            try:
+                with self.app.app_context():
+                    status = bitcoinreserve_client.get_order_status(
+                        order_id, api_token=poller.api_token, use_cache=False
+                    )
+            except BitcoinReserveApiException as e:
+                logger.debug(f"Couldn't get the status of order {order_id}: {e}")
+                status = poller.status
+                interval = min(self.max_interval, interval * self.backoff)
+            else:
+                if status != poller.status:
+                    interval = self.min_interval
+                    with self._lock:
+                        poller.status = status
+                        subscriptions = list(poller.subscriptions)
+                    for subscription in subscriptions:
+                        subscription.publish(status)
+                else:
+                    interval = min(self.max_interval, interval * self.backoff)
+
+                if is_order_final(status):
+                    self._finish(poller)
+                    if self.on_final:
+                        try:
+                            with self.app.app_context():
+                                self.on_final(user_id, status)
+                        except Exception as e:
+                            logger.exception(e)
+                    return
+
+            if time.monotonic() - started > self.max_watch:
+                logger.debug(f"Gave up watching order {order_id}")
+                self._finish(poller)
+                return
+            poller.stopped.wait(self._next_delay(interval, status))
+
+    def _finish(self, poller: _OrderPoller):
+        with self._lock:
+            if self._pollers.get(poller.key) is poller:
+                del self._pollers[poller.key]
+            subscriptions = poller.subscriptions
+            poller.subscriptions = []
+            poller.stopped.set()
+        for subscription in subscriptions:
+            subscription.finish()
+
+    def shutdown(self):
+        with self._lock:
+            pollers = list(self._pollers.values())
+        for poller in pollers:
+            self._finish(poller)
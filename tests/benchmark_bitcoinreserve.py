@@ -0,0 +1,333 @@
+"""
+Offline performance benchmarks for the Bitcoin Reserve client and sync, run against
+MockBitcoinReserveApi (see mock_bitcoinreserve_api.py).
+
+Not collected by a plain `pytest` run (the file name doesn't match `test_*`); run
+them explicitly:
+
+    pytest tests/benchmark_bitcoinreserve.py -s
+
+Each benchmark prints its timings. Set BITCOIN_RESERVE_BENCHMARK_OUTPUT to a file
+path to also append them as json lines, e.g. to compare against a previous run.
+
+The assertions are deliberately loose bounds derived from the mock's latency
+(e.g. "a full sync must take well under the time of making every request one
+after the other") so they catch regressions, not jitter.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from cryptoadvance.specter.services.service_encrypted_storage import (
+    ServiceEncryptedStorageManager,
+)
+from kdmukai.specterext.bitcoinreserve import client as bitcoinreserve_client
+from kdmukai.specterext.bitcoinreserve.api_client import close_session
+from kdmukai.specterext.bitcoinreserve.metrics import api_metrics
+from kdmukai.specterext.bitcoinreserve.resilience import _circuit_breakers
+from kdmukai.specterext.bitcoinreserve.service import BitcoinReserveService
+
+from mock_bitcoinreserve_api import MockBitcoinReserveApi
+
+
+API_TOKEN = "mock-api-token"
+
+# Seconds added to every mock API response
+LATENCY = 0.01
+
+# Number of purchases in the benchmarked accounts (2 transactions each)
+ACCOUNT_SIZES = [10, 100, 500]
+
+# Must not be imported just by Specter loading the extension; only on first use
+LAZY_MODULES = [
+    "requests",
+    "sqlite3",
+    "kdmukai.specterext.bitcoinreserve.api_client",
+    "kdmukai.specterext.bitcoinreserve.client",
+    "kdmukai.specterext.bitcoinreserve.quotes",
+    "kdmukai.specterext.bitcoinreserve.storage",
+    "kdmukai.specterext.bitcoinreserve.sync",
+    "kdmukai.specterext.bitcoinreserve.watcher",
+]
+
+# Run in a fresh interpreter: what loading the extension costs on top of what
+# Specter itself has already imported by then
+IMPORT_TIME_SCRIPT = """
+import json, sys, time
+import flask
+import cryptoadvance.specter.config
+import cryptoadvance.specter.services.controller
+import cryptoadvance.specter.services.service
+before = set(sys.modules)
+start = time.perf_counter()
+from kdmukai.specterext.bitcoinreserve.service import BitcoinReserveService
+BitcoinReserveService.blueprint = flask.Blueprint("bitcoinreserve_endpoint", __name__)
+import kdmukai.specterext.bitcoinreserve.controller
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(set(sys.modules) - before)}))
+"""
+
+
+def record(name: str, **results):
+    results = dict(benchmark=name, **results)
+    print(" | ".join(f"{key}: {value}" for key, value in results.items()))
+    output = os.getenv("BITCOIN_RESERVE_BENCHMARK_OUTPUT")
+    if output:
+        with open(output, "a") as f:
+            f.write(json.dumps(results) + "\n")
+
+
+@pytest.fixture
+def bitcoinreserve_user(app_no_node):
+    """The admin user with an unlocked service storage and an api_token for the mock API"""
+    user = app_no_node.specter.user_manager.get_user("admin")
+    user.decrypt_user_secret("admin")
+    BitcoinReserveService.update_user_service_data(
+        {BitcoinReserveService.API_TOKEN: API_TOKEN}, user=user
+    )
+
+    yield user
+
+    ServiceEncryptedStorageManager.get_instance().delete_all_service_data(user)
+    # Don't carry one benchmark's users, pollers or quote timers into the next
+    for attr in ("_sync_scheduler", "_quote_manager", "_order_watcher"):
+        if getattr(BitcoinReserveService, attr):
+            getattr(BitcoinReserveService, attr).shutdown()
+            setattr(BitcoinReserveService, attr, None)
+    BitcoinReserveService._transaction_stores = {}
+    BitcoinReserveService._withdrawal_indexes = {}
+    BitcoinReserveService._analytics = {}
+    BitcoinReserveService._sync_locks = {}
+
+
+@pytest.fixture
+def use_mock_api(app_no_node):
+    """Points the client at a (running) MockBitcoinReserveApi and resets all client-side state"""
+
+    def use(api: MockBitcoinReserveApi):
+        app_no_node.config["BITCOIN_RESERVE_API_URL"] = api.url
+        close_session()
+        bitcoinreserve_client.invalidate_cache(API_TOKEN)
+        _circuit_breakers.clear()
+        api_metrics.reset()
+
+    return use
+
+
+@pytest.mark.parametrize("num_purchases", ACCOUNT_SIZES)
+def test_sync_time(app_no_node, bitcoinreserve_user, use_mock_api, num_purchases):
+    """Initial full sync, then an incremental sync with nothing new"""
+    with MockBitcoinReserveApi(history_size=num_purchases, latency=LATENCY) as api:
+        use_mock_api(api)
+        num_transactions = api.transaction_count
+        num_pages = -(-num_transactions // api.page_size)
+
+        start = time.perf_counter()
+        BitcoinReserveService.update(user=bitcoinreserve_user)
+        full_sync = time.perf_counter() - start
+        full_sync_requests = api.request_count()
+
+        store = BitcoinReserveService.get_transaction_store(bitcoinreserve_user)
+        assert store.count() == num_transactions
+
+        api.reset_request_counts()
+        start = time.perf_counter()
+        BitcoinReserveService.update(user=bitcoinreserve_user)
+        incremental_sync = time.perf_counter() - start
+        incremental_sync_requests = api.request_count()
+
+    record(
+        "sync_time",
+        transactions=num_transactions,
+        full_sync=round(full_sync, 3),
+        full_sync_requests=full_sync_requests,
+        incremental_sync=round(incremental_sync, 3),
+        incremental_sync_requests=incremental_sync_requests,
+    )
+
+    # Details are fetched concurrently and pages are prefetched; the sync must beat
+    # the pure latency of making the same requests one at a time (the mock server
+    # shares this process, so its own overhead is included in `full_sync`).
+    serial_time = (num_pages + num_transactions) * LATENCY
+    if num_transactions >= 100:
+        assert full_sync < serial_time
+
+    # Nothing changed upstream: at most the first page should be requested again
+    assert incremental_sync_requests <= 1
+    assert incremental_sync < 1
+
+
+@pytest.mark.parametrize("num_purchases", ACCOUNT_SIZES)
+def test_login_latency(app_no_node, bitcoinreserve_user, use_mock_api, num_purchases):
+    """The login hook must not wait on the API, no matter how large the account"""
+    with MockBitcoinReserveApi(history_size=num_purchases, latency=LATENCY) as api:
+        use_mock_api(api)
+        with app_no_node.test_request_context():
+            start = time.perf_counter()
+            BitcoinReserveService.on_user_login()
+            login_latency = time.perf_counter() - start
+
+        # ...and the background sync it kicked off should finish in a sensible time
+        sync_scheduler = BitcoinReserveService.get_sync_scheduler()
+        deadline = time.perf_counter() + 60
+        while sync_scheduler.is_syncing(bitcoinreserve_user):
+            assert time.perf_counter() < deadline
+            time.sleep(0.01)
+        time_to_synced = time.perf_counter() - start
+
+        store = BitcoinReserveService.get_transaction_store(bitcoinreserve_user)
+        assert store.count() == api.transaction_count
+
+    record(
+        "login_latency",
+        transactions=api.transaction_count,
+        login_latency=round(login_latency, 4),
+        time_to_synced=round(time_to_synced, 3),
+    )
+    assert login_latency < 0.25
+
+
+@pytest.mark.parametrize("error_rate", [0.0, 0.1])
+@pytest.mark.parametrize("max_workers", [1, 4, 8])
+def test_request_throughput(app_no_node, use_mock_api, max_workers, error_rate):
+    """Detail requests per second through the pooled session, with and without upstream errors"""
+    app_no_node.config["BITCOIN_RESERVE_API_BACKOFF_BASE"] = 0.01
+    with MockBitcoinReserveApi(history_size=100, latency=LATENCY, error_rate=error_rate) as api:
+        use_mock_api(api)
+        page = bitcoinreserve_client.get_transactions(0, api_token=API_TOKEN)
+        transaction_ids = [tx["transaction_id"] for tx in page[1:]] * 10
+
+        start = time.perf_counter()
+        details = bitcoinreserve_client.get_transactions_details(
+            transaction_ids, max_workers=max_workers, api_token=API_TOKEN
+        )
+        elapsed = time.perf_counter() - start
+
+        assert len(details) == len(transaction_ids)
+        retries = sum(series["retries"] for series in api_metrics.snapshot().values())
+
+    record(
+        "request_throughput",
+        max_workers=max_workers,
+        error_rate=error_rate,
+        requests=len(transaction_ids),
+        retries=retries,
+        elapsed=round(elapsed, 3),
+        requests_per_second=round(len(transaction_ids) / elapsed, 1),
+    )
+    if not error_rate:
+        # Should scale with the number of workers (up to the pool size)
+        assert len(transaction_ids) / elapsed > max_workers / LATENCY / 4
+
+
+def test_concurrent_users_throughput(app_no_node, use_mock_api):
+    """Several users' syncs share the process-wide session / connection pool"""
+    num_users = 8
+    api_tokens = tuple(f"{API_TOKEN}-{i}" for i in range(num_users))
+    with MockBitcoinReserveApi(
+        history_size=25, latency=LATENCY, api_tokens=api_tokens
+    ) as api:
+        use_mock_api(api)
+        num_transactions = api.transaction_count
+        num_pages = -(-num_transactions // api.page_size)
+
+        def sync_one(api_token):
+            with app_no_node.app_context():
+                ids = [
+                    tx["transaction_id"]
+                    for tx in bitcoinreserve_client.iter_transactions(api_token=api_token)
+                ]
+                bitcoinreserve_client.get_transactions_details(ids, api_token=api_token)
+
+        threads = [
+            threading.Thread(target=sync_one, args=(api_token,))
+            for api_token in api_tokens
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        total_requests = api.request_count()
+
+    record(
+        "concurrent_users_throughput",
+        users=num_users,
+        transactions_per_user=num_transactions,
+        requests=total_requests,
+        elapsed=round(elapsed, 3),
+        requests_per_second=round(total_requests / elapsed, 1),
+    )
+    # Different users' requests are never coalesced into one another
+    assert total_requests >= num_users * (num_pages + num_transactions)
+    assert elapsed < num_users * (num_transactions + 3) * LATENCY / 2
+
+
+def test_identical_requests_coalesce(app_no_node, use_mock_api):
+    """One user's identical requests in flight at the same time share one upstream call"""
+    num_threads = 8
+    # Long enough for every thread to join the first one's request
+    latency = 0.2
+    with MockBitcoinReserveApi(history_size=5, latency=latency) as api:
+        use_mock_api(api)
+        page = bitcoinreserve_client.get_transactions(0, api_token=API_TOKEN)
+        transaction_id = page[1]["transaction_id"]
+        api.reset_request_counts()
+        barrier = threading.Barrier(num_threads)
+        details = []
+
+        def get_details():
+            with app_no_node.app_context():
+                barrier.wait()
+                details.append(
+                    bitcoinreserve_client.get_transaction(transaction_id, api_token=API_TOKEN)
+                )
+
+        threads = [threading.Thread(target=get_details) for _ in range(num_threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        upstream_requests = api.request_count()
+        coalesced = sum(series["coalesced"] for series in api_metrics.snapshot().values())
+
+    record(
+        "identical_requests_coalesce",
+        callers=num_threads,
+        upstream_requests=upstream_requests,
+        coalesced=coalesced,
+        elapsed=round(elapsed, 3),
+    )
+    assert len(details) == num_threads
+    assert all(detail == details[0] for detail in details)
+    assert upstream_requests < num_threads
+    assert upstream_requests + coalesced == num_threads
+
+
+def test_import_time():
+    """Registering the extension (service + blueprint) must not load the HTTP stack or the store"""
+    runs = []
+    for _ in range(5):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_TIME_SCRIPT],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    modules = runs[0]["modules"]
+
+    record(
+        "import_time",
+        median_import_time=round(sorted(run["elapsed"] for run in runs)[len(runs) // 2], 4),
+        modules_imported=len(modules),
+    )
+    assert not [module for module in LAZY_MODULES if module in modules]
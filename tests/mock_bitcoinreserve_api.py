@@ -0,0 +1,397 @@
+"""
+A local stand-in for the Bitcoin Reserve API so that `client.py` and
+`BitcoinReserveService.update()` can be exercised (and benchmarked) offline.
+
+Implements the endpoints the extension uses:
+    POST /user/order/quote
+    POST /user/order/confirm
+    GET  /user/balance
+    GET  /user/order/status
+    GET  /api/user/transactions/<page_num>
+    GET  /api/user/transaction/<transaction_id>
+
+Latency, injected error rates and the size of the account's history are all
+configurable; every request is counted per endpoint so tests can assert on how
+many calls a sync made:
+
+    with MockBitcoinReserveApi(history_size=250, latency=0.01) as api:
+        app.config["BITCOIN_RESERVE_API_URL"] = api.url
+        ...
+        assert api.request_count(
+            "GET", "/api/user/transaction/<transaction_id>"
+        ) == api.transaction_count
+
+Only uses the standard library; the server runs on a daemon thread.
+"""
+import copy
+import datetime
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+TRANSACTION_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Collapse per-id / per-page paths into one counter per endpoint
+_ENDPOINT_PATTERNS = [
+    (re.compile(r"^/api/user/transactions/(?P<page_num>[^/]+)/?$"), "/api/user/transactions/<page_num>"),
+    (re.compile(r"^/api/user/transaction/(?P<transaction_id>[^/]+)/?$"), "/api/user/transaction/<transaction_id>"),
+    (re.compile(r"^/user/balance/?$"), "/user/balance"),
+    (re.compile(r"^/user/order/quote/?$"), "/user/order/quote"),
+    (re.compile(r"^/user/order/confirm/?$"), "/user/order/confirm"),
+    (re.compile(r"^/user/order/status/?$"), "/user/order/status"),
+]
+
+
+class MockBitcoinReserveApi:
+    def __init__(
+        self,
+        history_size: int = 50,
+        page_size: int = 20,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 0,
+        api_tokens=("mock-api-token",),
+        seed: int = 0,
+    ):
+        """
+        * `history_size`: number of purchases already in the account; each one is
+            a MARKET BUY plus its WITHDRAWAL, so twice as many transactions.
+        * `latency` (+ up to `latency_jitter`): seconds added to every response.
+        * `error_rate`: fraction of requests answered with a 503.
+        * `rate_limit_rate`: fraction of requests answered with a 429 carrying a
+            `Retry-After: <retry_after>` header.
+        * `api_tokens`: tokens accepted in the "Authorization: Token ..." header;
+            anything else gets a 401.
+        """
+        self.page_size = page_size
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.api_tokens = set(api_tokens)
+        # As documented: {"balance_eur": "0.00000000"}
+        self.balances = {"balance_eur": "10000.00000000", "balance_chf": "0.00000000"}
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._request_counts = Counter()
+
+        # Newest first, like the API
+        self._transactions = []
+        self._details = {}
+        self._purchase_by_withdrawal = {}
+        self._quotes = {}
+        self._orders = {}
+        self._now = datetime.datetime(2022, 1, 1)
+        for _ in range(history_size):
+            self._add_purchase(status="DONE", txid=self._random_txid())
+
+        self._server = None
+        self._thread = None
+
+    # -- test controls ------------------------------------------------------
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockBitcoinReserveApi":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="mock-bitcoinreserve", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def request_count(self, method: str = None, endpoint: str = None) -> int:
+        """Requests received so far, optionally only for one method / endpoint label"""
+        with self._lock:
+            return sum(
+                count
+                for (m, e), count in self._request_counts.items()
+                if (method is None or m == method) and (endpoint is None or e == endpoint)
+            )
+
+    def reset_request_counts(self):
+        with self._lock:
+            self._request_counts.clear()
+
+    @property
+    def transaction_count(self) -> int:
+        with self._lock:
+            return len(self._transactions)
+
+    def add_purchase(self, fiat_amount: str = "50.00", withdrawal_address: str = None, status: str = "DONE") -> str:
+        """Adds a MARKET BUY (and its WITHDRAWAL) to the top of the history; returns its id"""
+        with self._lock:
+            return self._add_purchase(
+                fiat_amount=fiat_amount,
+                withdrawal_address=withdrawal_address,
+                status=status,
+                txid=self._random_txid(),
+            )
+
+    def set_transaction_status(self, transaction_id: str, status: str, withdrawal_identifier: str = None):
+        """e.g. move a withdrawal from INITIATED to DONE, once its txid is known"""
+        with self._lock:
+            for summary in self._transactions:
+                if summary["transaction_id"] == transaction_id:
+                    summary["transaction_status"] = status
+            details = self._details[transaction_id]
+            details["transaction_status"] = status
+            withdrawals = [details]
+            purchase_id = self._purchase_by_withdrawal.get(transaction_id)
+            if purchase_id:
+                withdrawals.append(self._details[purchase_id]["withdrawals"])
+            for withdrawal in withdrawals:
+                if "withdrawal_status" in withdrawal:
+                    withdrawal["withdrawal_status"] = status
+                    if withdrawal_identifier:
+                        withdrawal["withdrawal_identifier"] = withdrawal_identifier
+
+    # -- fake account state -------------------------------------------------
+
+    def _random_id(self) -> str:
+        return str(uuid.UUID(int=self._random.getrandbits(128), version=4))
+
+    def _random_txid(self) -> str:
+        return "%064x" % self._random.getrandbits(256)
+
+    def _random_address(self) -> str:
+        return "bc1q" + "".join(self._random.choice("023456789acdefghjklmnpqrstuvwxyz") for _ in range(38))
+
+    def _next_time(self) -> str:
+        self._now += datetime.timedelta(minutes=self._random.randint(1, 600))
+        return self._now.strftime(TRANSACTION_TIME_FORMAT)
+
+    def _add_purchase(
+        self,
+        fiat_amount: str = "50.00",
+        withdrawal_address: str = None,
+        status: str = "DONE",
+        txid: str = None,
+        fiat_currency: str = "EUR",
+    ) -> str:
+        """Must hold self._lock (or be in __init__)"""
+        sats = int(float(fiat_amount) * 2900)
+        transaction_time = self._next_time()
+        purchase_id = self._random_id()
+        withdrawal_id = self._random_id()
+        withdrawal = {
+            "transaction_type": "WITHDRAWAL",
+            "transaction_id": withdrawal_id,
+            "withdrawal_serial_number": 0,
+            "withdrawal_status": status,
+            "withdrawal_address": withdrawal_address or self._random_address(),
+            "withdrawal_fee": "0",
+            "withdrawal_currency": "SATS",
+            "withdrawal_identifier": txid if status == "DONE" else None,
+        }
+        self._details[purchase_id] = {
+            "transaction_type": "MARKET BUY",
+            "transaction_id": purchase_id,
+            "transaction_status": "COMPLETE",
+            "sats_bought": str(sats),
+            "fiat_spent": fiat_amount,
+            "fiat_currency": fiat_currency,
+            "withdrawals": withdrawal,
+        }
+        self._details[withdrawal_id] = dict(withdrawal, transaction_status=status)
+        self._purchase_by_withdrawal[withdrawal_id] = purchase_id
+        self._transactions[0:0] = [
+            {
+                "transaction_id": withdrawal_id,
+                "transaction_status": status,
+                "transaction_type": "WITHDRAWAL",
+                "transaction_time": transaction_time,
+                "in_currency": None,
+                "in_amount": "None",
+                "out_currency": "SATS",
+                "out_amount": f"{sats}.00000000",
+            },
+            {
+                "transaction_id": purchase_id,
+                "transaction_status": "DONE",
+                "transaction_type": "MARKET BUY",
+                "transaction_time": transaction_time,
+                "in_currency": fiat_currency,
+                "in_amount": fiat_amount,
+                "out_currency": "SATS",
+                "out_amount": f"{sats}.00000000",
+            },
+        ]
+        return purchase_id
+
+    # -- request handling ---------------------------------------------------
+
+    def _handle(self, method: str, path: str, headers, payload: dict):
+        """Returns (status_code, extra_headers, json-serializable body)"""
+        label, params = path, {}
+        for pattern, endpoint_label in _ENDPOINT_PATTERNS:
+            match = pattern.match(path)
+            if match:
+                label, params = endpoint_label, match.groupdict()
+                break
+
+        with self._lock:
+            self._request_counts[(method, label)] += 1
+            roll = self._random.random()
+            delay = self.latency + self._random.uniform(0, self.latency_jitter)
+        if delay:
+            time.sleep(delay)
+
+        authorization = headers.get("Authorization") or ""
+        if not authorization.startswith("Token ") or authorization[6:] not in self.api_tokens:
+            return 401, {}, {"detail": "Invalid token."}
+        if roll < self.rate_limit_rate:
+            return 429, {"Retry-After": str(self.retry_after)}, {"detail": "Request was throttled."}
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 503, {}, {"detail": "Service unavailable"}
+
+        with self._lock:
+            if (method, label) == ("GET", "/api/user/transactions/<page_num>"):
+                page_num = int(params["page_num"])
+                start = page_num * self.page_size
+                return 200, {}, [
+                    {"total_transaction_count": len(self._transactions), "page": page_num}
+                ] + copy.deepcopy(self._transactions[start : start + self.page_size])
+
+            if (method, label) == ("GET", "/api/user/transaction/<transaction_id>"):
+                details = self._details.get(params["transaction_id"])
+                if details is None:
+                    return 404, {}, {"detail": "Not found."}
+                return 200, {}, copy.deepcopy(details)
+
+            if (method, label) == ("GET", "/user/balance"):
+                return 200, {}, dict(self.balances)
+
+            if (method, label) == ("POST", "/user/order/quote"):
+                fiat_amount = str(payload.get("fiat_deliver_amount", ""))
+                try:
+                    amount = float(fiat_amount)
+                except ValueError:
+                    return 400, {}, {"detail": "Invalid fiat_deliver_amount"}
+                quote = {
+                    "quote_id": self._random_id(),
+                    "bitcoin_receive_amount": round(amount / 34000, 8),
+                    "trade_fee_currency": payload.get("fiat_currency", "EUR"),
+                    "trade_fee_amount": round(amount * 0.0195, 2),
+                    "expiration_time_utc": time.time() + 30,
+                }
+                self._quotes[quote["quote_id"]] = dict(
+                    quote,
+                    fiat_amount=fiat_amount,
+                    withdrawal_address=payload.get("withdrawal_address"),
+                )
+                return 200, {}, quote
+
+            if (method, label) == ("POST", "/user/order/confirm"):
+                quote = self._quotes.pop(payload.get("quote_id"), None)
+                if quote is None or quote["expiration_time_utc"] < time.time():
+                    return 400, {}, {"detail": "Invalid or expired quote_id"}
+                purchase_id = self._add_purchase(
+                    fiat_amount=quote["fiat_amount"],
+                    withdrawal_address=quote["withdrawal_address"],
+                    status="INITIATED",
+                    fiat_currency=quote["trade_fee_currency"],
+                )
+                withdrawal = self._details[purchase_id]["withdrawals"]
+                order = {
+                    "order_id": purchase_id,
+                    "order_status": "COMPLETE",
+                    "quote_id": quote["quote_id"],
+                    "bitcoin_receive_amount": quote["bitcoin_receive_amount"],
+                    "trade_fee_currency": quote["trade_fee_currency"],
+                    "trade_fee_amount": quote["trade_fee_amount"],
+                    "withdrawal_address": quote["withdrawal_address"],
+                    "withdrawal_status": withdrawal["withdrawal_status"],
+                    "withdrawal_method": "ONCHAIN",
+                    "withdrawal_fee": 0.0,
+                    "withdrawal_eta": time.time() + 3600,
+                }
+                self._orders[purchase_id] = order
+                return 200, {}, order
+
+            if (method, label) == ("GET", "/user/order/status"):
+                order = self._orders.get(payload.get("order_id"))
+                if order is None:
+                    return 404, {}, {"detail": "Not found."}
+                return 200, {}, {
+                    "order_status": order["order_status"],
+                    "bitcoin_receive_amount": order["bitcoin_receive_amount"],
+                    "quote_id": order["quote_id"],
+                    "trade_fee_currency": order["trade_fee_currency"],
+                    "trade_fee_amount": order["trade_fee_amount"],
+                    "withdrawals": copy.deepcopy(
+                        self._details[order["order_id"]]["withdrawals"]
+                    ),
+                }
+
+        return 404, {}, {"detail": "Not found."}
+
+    def _make_handler(self):
+        mock_api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw_payload = self.rfile.read(length) if length else b""
+                try:
+                    payload = json.loads(raw_payload) if raw_payload else {}
+                except ValueError:
+                    payload = {}
+                status_code, headers, data = mock_api._handle(
+                    self.command, self.path, self.headers, payload
+                )
+                body = json.dumps(data).encode()
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = _respond
+            do_POST = _respond
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def mock_bitcoinreserve_api():
+    """A running MockBitcoinReserveApi with a small history and no latency or errors"""
+    with MockBitcoinReserveApi() as api:
+        yield api
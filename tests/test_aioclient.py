@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+import pytest
+
+from kdmukai.specterext.bitcoinreserve.api_config import BitcoinReserveApiConfig
+from kdmukai.specterext.bitcoinreserve.exceptions import (
+    BitcoinReserveApiCircuitOpenException,
+    BitcoinReserveApiRateLimitException,
+    BitcoinReserveApiTransientException,
+)
+from kdmukai.specterext.bitcoinreserve.resilience import (
+    CircuitBreaker,
+    _circuit_breakers,
+)
+
+from mock_bitcoinreserve_api import MockBitcoinReserveApi
+
+
+pytest.importorskip("aiohttp")
+
+from kdmukai.specterext.bitcoinreserve.aioclient import (  # noqa: E402
+    AsyncBitcoinReserveClient,
+)
+
+
+API_TOKEN = "mock-api-token"
+RESET_TIMEOUT = 0.05
+
+
+@pytest.fixture(autouse=True)
+def clear_circuit_breakers():
+    _circuit_breakers.clear()
+    yield
+    _circuit_breakers.clear()
+
+
+def make_config(api: MockBitcoinReserveApi, **kwargs) -> BitcoinReserveApiConfig:
+    return BitcoinReserveApiConfig(api_url=api.url, backoff_base=0.01, **kwargs)
+
+
+def test_retries():
+    async def run(api: MockBitcoinReserveApi):
+        config = make_config(api, max_retries=5, circuit_failure_threshold=100)
+        async with AsyncBitcoinReserveClient(config, API_TOKEN) as client:
+            # Some 503s along the way; every request still gets through
+            api.error_rate = 0.3
+            for _ in range(10):
+                assert await client.get_fiat_balances() == api.balances
+            assert api.request_count("GET", "/user/balance") > 10
+
+            # Gives up after max_retries
+            api.error_rate = 1
+            api.reset_request_counts()
+            with pytest.raises(BitcoinReserveApiTransientException):
+                await client.get_fiat_balances()
+            assert api.request_count("GET", "/user/balance") == 6
+
+            # A POST is only sent once...
+            with pytest.raises(BitcoinReserveApiTransientException):
+                await client.create_quote("10", "bc1qaddress")
+            assert api.request_count("POST", "/user/order/quote") == 1
+
+            # ...unless it was rate limited, i.e. never processed
+            api.error_rate = 0
+            api.rate_limit_rate = 1
+            with pytest.raises(BitcoinReserveApiRateLimitException):
+                await client.create_quote("10", "bc1qaddress")
+            assert api.request_count("POST", "/user/order/quote") == 1 + 6
+
+    with MockBitcoinReserveApi(history_size=0) as api:
+        asyncio.run(run(api))
+
+
+def test_circuit_breaker():
+    async def run(api: MockBitcoinReserveApi):
+        config = make_config(
+            api,
+            max_retries=0,
+            circuit_failure_threshold=2,
+            circuit_reset_timeout=RESET_TIMEOUT,
+        )
+        breaker = config.get_circuit_breaker()
+        async with AsyncBitcoinReserveClient(config, API_TOKEN) as client:
+            api.error_rate = 1
+            for _ in range(2):
+                with pytest.raises(BitcoinReserveApiTransientException):
+                    await client.get_fiat_balances()
+            assert breaker.state == CircuitBreaker.OPEN
+
+            # Fails fast, without a request
+            with pytest.raises(BitcoinReserveApiCircuitOpenException):
+                await client.get_fiat_balances()
+            assert api.request_count("GET", "/user/balance") == 2
+
+            # Rate limits never open it
+            api.error_rate = 0
+            await asyncio.sleep(RESET_TIMEOUT)
+            assert await client.get_fiat_balances() == api.balances
+            assert breaker.state == CircuitBreaker.CLOSED
+            api.rate_limit_rate = 1
+            for _ in range(3):
+                with pytest.raises(BitcoinReserveApiRateLimitException):
+                    await client.get_fiat_balances()
+            assert breaker.state == CircuitBreaker.CLOSED
+
+    with MockBitcoinReserveApi(history_size=0) as api:
+        asyncio.run(run(api))
+
+
+def test_transactions_details_in_order():
+    async def run(api: MockBitcoinReserveApi):
+        async with AsyncBitcoinReserveClient(make_config(api), API_TOKEN) as client:
+            page = await client.get_transactions(0)
+            assert page[0]["total_transaction_count"] == api.transaction_count
+            transaction_ids = [tx["transaction_id"] for tx in page[1:]]
+            details = await client.get_transactions_details(
+                transaction_ids, max_concurrency=3
+            )
+            assert [tx["transaction_id"] for tx in details] == transaction_ids
+
+    with MockBitcoinReserveApi(
+        history_size=5, latency=0.01, latency_jitter=0.02
+    ) as api:
+        asyncio.run(run(api))
+
+
+def test_cancellation_isnt_a_failure():
+    async def run(api: MockBitcoinReserveApi):
+        config = make_config(
+            api, circuit_failure_threshold=1, circuit_reset_timeout=RESET_TIMEOUT
+        )
+        breaker = config.get_circuit_breaker()
+        async with AsyncBitcoinReserveClient(config, API_TOKEN) as client:
+            api.latency = 1
+            for _ in range(3):
+                task = asyncio.ensure_future(client.get_fiat_balances())
+                await asyncio.sleep(0.05)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+            assert breaker.state == CircuitBreaker.CLOSED
+
+            # A cancelled probe doesn't re-open the circuit for another
+            # reset_timeout; the next request probes right away
+            breaker.record_failure()
+            time.sleep(RESET_TIMEOUT)
+            task = asyncio.ensure_future(client.get_fiat_balances())
+            await asyncio.sleep(0.05)
+            assert breaker.state == CircuitBreaker.HALF_OPEN
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert breaker.state == CircuitBreaker.OPEN
+
+            api.latency = 0
+            assert await client.get_fiat_balances() == api.balances
+            assert breaker.state == CircuitBreaker.CLOSED
+
+    with MockBitcoinReserveApi(history_size=0) as api:
+        asyncio.run(run(api))
@@ -0,0 +1,128 @@
+import datetime
+
+import pytest
+
+from kdmukai.specterext.bitcoinreserve.analytics import BitcoinReserveAnalytics
+from kdmukai.specterext.bitcoinreserve.storage import BitcoinReserveTransactionStore
+
+
+def timestamp(*args) -> float:
+    return datetime.datetime(*args).timestamp()
+
+
+def buy(
+    transaction_id: str,
+    transaction_time: float,
+    sats_bought: str,
+    fiat_spent: str,
+    fiat_currency: str = "EUR",
+    transaction_status: str = "COMPLETE",
+):
+    summary = {
+        "transaction_id": transaction_id,
+        "transaction_type": "MARKET BUY",
+        "transaction_status": transaction_status,
+    }
+    details = {
+        "transaction_id": transaction_id,
+        "sats_bought": sats_bought,
+        "fiat_spent": fiat_spent,
+        "fiat_currency": fiat_currency,
+        "withdrawals": [{"withdrawal_fee": "500", "withdrawal_currency": "SATS"}],
+    }
+    return summary, transaction_time, details
+
+
+def test_totals():
+    analytics = BitcoinReserveAnalytics()
+    assert analytics.add(
+        [
+            buy("a", timestamp(2022, 1, 3), "100000", "40.00"),
+            buy("b", timestamp(2022, 1, 10), "200000", "80.00"),
+            buy("x", timestamp(2022, 1, 11), "1", "1.00", transaction_status="FAILED"),
+            # Not a purchase
+            ({"transaction_id": "w", "transaction_type": "WITHDRAWAL"}, 0, {"x": 1}),
+        ]
+    ) == 3
+    assert len(analytics) == 3
+
+    totals = analytics.get_totals()
+    assert totals == {
+        "EUR": {
+            "purchases": 2,
+            "sats": 300000,
+            "fiat_spent": 12000,
+            "trade_fees": 0,
+            "withdrawal_fees": 1000,
+            # €40,000.00 per BTC, in cents
+            "average_price": 4000000,
+            "sats_per_fiat": 2500,
+            "fiat_exponent": 2,
+        }
+    }
+
+
+def test_update_in_place():
+    analytics = BitcoinReserveAnalytics()
+    analytics.add([buy("a", timestamp(2022, 1, 3), "100000", "40.00")])
+    analytics.add([buy("a", timestamp(2022, 1, 3), "1", "1.00", "EUR", "CANCELLED")])
+    assert len(analytics) == 1
+    assert analytics.get_totals() == {}
+
+    analytics.add([buy("a", timestamp(2022, 1, 3), "110000", "40.00")])
+    assert analytics.get_totals()["EUR"]["sats"] == 110000
+
+
+def test_jpy():
+    """No minor unit: fiat amounts are whole yen"""
+    analytics = BitcoinReserveAnalytics()
+    analytics.add([buy("a", timestamp(2022, 1, 3), "100000", "5000", "JPY")])
+    totals = analytics.get_totals()["JPY"]
+    assert totals["fiat_spent"] == 5000
+    # ¥5,000,000 per BTC
+    assert totals["average_price"] == 5000000
+    assert totals["sats_per_fiat"] == 20
+    assert totals["fiat_exponent"] == 0
+
+
+def test_periods():
+    analytics = BitcoinReserveAnalytics()
+    analytics.add(
+        [
+            buy("a", timestamp(2022, 1, 3, 12), "100000", "40.00"),
+            buy("b", timestamp(2022, 1, 5, 12), "100000", "40.00"),
+            buy("c", timestamp(2022, 2, 1, 12), "100000", "5000", fiat_currency="JPY"),
+            buy("d", timestamp(2022, 2, 2, 12), "100000", "40.00"),
+        ]
+    )
+    assert [
+        (row["period_start"], row["currency"], row["purchases"], row["fiat_exponent"])
+        for row in analytics.get_periods("month")
+    ] == [
+        ("2022-01-01", "EUR", 2, 2),
+        ("2022-02-01", "EUR", 1, 2),
+        ("2022-02-01", "JPY", 1, 0),
+    ]
+    # 2022-01-03 was a Monday
+    assert [row["period_start"] for row in analytics.get_periods("week")] == [
+        "2022-01-03",
+        "2022-01-31",
+        "2022-01-31",
+    ]
+    assert len(analytics.get_periods("day")) == 4
+    assert analytics.get_periods("year")[0]["sats"] == 300000
+
+    with pytest.raises(ValueError):
+        analytics.get_periods("decade")
+
+
+def test_from_store(tmp_path):
+    store = BitcoinReserveTransactionStore(str(tmp_path), "alice")
+    purchases = [
+        buy("a", timestamp(2022, 1, 3), "100000", "40.00"),
+        buy("b", timestamp(2022, 1, 10), "200000", "80.00"),
+    ]
+    store.save_transactions(purchases)
+    live = BitcoinReserveAnalytics()
+    live.add(purchases)
+    assert BitcoinReserveAnalytics.from_store(store).get_totals() == live.get_totals()
@@ -0,0 +1,87 @@
+import pytest
+
+from kdmukai.specterext.bitcoinreserve import api_client
+from kdmukai.specterext.bitcoinreserve.api_client import BitcoinReserveClient
+from kdmukai.specterext.bitcoinreserve.api_config import BitcoinReserveApiConfig
+
+from mock_bitcoinreserve_api import MockBitcoinReserveApi
+
+
+PAGES = "/api/user/transactions/<page_num>"
+
+
+class SpyExecutor(api_client.ThreadPoolExecutor):
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.was_shut_down = False
+        SpyExecutor.instances.append(self)
+
+    def shutdown(self, *args, **kwargs):
+        self.was_shut_down = True
+        super().shutdown(*args, **kwargs)
+
+
+@pytest.fixture
+def api():
+    # 50 transactions: 3 pages
+    with MockBitcoinReserveApi(history_size=25, page_size=20) as api:
+        yield api
+
+
+@pytest.fixture
+def client(api):
+    return BitcoinReserveClient.for_api_token(
+        BitcoinReserveApiConfig(api_url=api.url, cache_ttls={}), "mock-api-token"
+    )
+
+
+def all_transactions(client: BitcoinReserveClient) -> list:
+    return list(client.iter_transactions(prefetch=False))
+
+
+def test_iter_transactions_in_page_order(api, client):
+    transactions = all_transactions(client)
+    assert len(transactions) == api.transaction_count
+    # Newest first, like the API
+    times = [tx.transaction_time for tx in transactions]
+    assert times == sorted(times, reverse=True)
+    assert api.request_count("GET", PAGES) == 3
+
+    # Prefetching the next page doesn't change a thing
+    api.reset_request_counts()
+    prefetched = list(client.iter_transactions())
+    assert [tx["transaction_id"] for tx in prefetched] == [
+        tx["transaction_id"] for tx in transactions
+    ]
+    assert api.request_count("GET", PAGES) == 3
+
+
+def test_iter_transactions_since(api, client):
+    transactions = all_transactions(client)
+    since = transactions[29].transaction_time
+    api.reset_request_counts()
+
+    recent = list(client.iter_transactions(since=since))
+    # Transactions at exactly `since` are included
+    assert [tx["transaction_id"] for tx in recent] == [
+        tx["transaction_id"] for tx in transactions if tx.transaction_time >= since
+    ]
+    # The cutoff is on the second page; the third isn't even prefetched
+    assert api.request_count("GET", PAGES) == 2
+
+
+def test_iter_transactions_closed_early(api, client, monkeypatch):
+    monkeypatch.setattr(SpyExecutor, "instances", [])
+    monkeypatch.setattr(api_client, "ThreadPoolExecutor", SpyExecutor)
+
+    transactions = client.iter_transactions()
+    next(transactions)
+    (executor,) = SpyExecutor.instances
+    assert not executor.was_shut_down
+
+    transactions.close()
+    assert executor.was_shut_down
+    # At most the prefetched second page was requested
+    assert api.request_count("GET", PAGES) <= 2
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+from kdmukai.specterext.bitcoinreserve import api_client
+from kdmukai.specterext.bitcoinreserve.api_client import BitcoinReserveClient
+from kdmukai.specterext.bitcoinreserve.api_config import BitcoinReserveApiConfig
+from kdmukai.specterext.bitcoinreserve.cache import TTLCache
+
+
+TTL = 0.05
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+
+    class request:
+        body = b""
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self.text = str(payload)
+        self.content = self.text.encode()
+
+    def json(self):
+        return dict(self.payload)
+
+
+class CountingSession:
+    """Answers every request with a new balance, so cache hits are easy to spot"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def request(self, **kwargs):
+        self.calls += 1
+        return FakeResponse({"balance_eur": str(self.calls)})
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = CountingSession()
+    monkeypatch.setattr(api_client, "get_session", lambda pool_size=10: session)
+    monkeypatch.setattr(api_client, "_response_cache", None)
+    return session
+
+
+def test_ttl_expiry():
+    cache = TTLCache()
+    cache.set("key", {"a": 1}, ttl=TTL)
+    assert cache.get("key") == (True, {"a": 1})
+    time.sleep(TTL)
+    assert cache.get("key") == (False, None)
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a") == (True, 1)
+    cache.set("c", 3, ttl=60)
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.get("c") == (True, 3)
+
+
+def test_values_are_copied():
+    cache = TTLCache()
+    value = {"nested": {"a": 1}}
+    cache.set("key", value, ttl=60)
+    value["nested"]["a"] = 2
+    cache.get("key")[1]["nested"]["a"] = 3
+    assert cache.get("key") == (True, {"nested": {"a": 1}})
+
+
+def test_invalidate():
+    cache = TTLCache()
+    cache.set(("alice", 1), 1, ttl=60)
+    cache.set(("bob", 1), 2, ttl=60)
+    cache.invalidate(lambda key: key[0] == "alice")
+    assert cache.get(("alice", 1)) == (False, None)
+    assert cache.get(("bob", 1)) == (True, 2)
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_client_cached_request(session):
+    config = BitcoinReserveApiConfig(
+        api_url="http://cache.test", cache_ttls={"/user/balance": TTL}
+    )
+    alice = BitcoinReserveClient.for_api_token(config, "alice")
+    bob = BitcoinReserveClient.for_api_token(config, "bob")
+
+    assert alice.get_fiat_balances() == {"balance_eur": "1"}
+    assert alice.get_fiat_balances() == {"balance_eur": "1"}
+    # Every user has their own entries
+    assert bob.get_fiat_balances() == {"balance_eur": "2"}
+    assert session.calls == 2
+
+    # Endpoints without a TTL are never cached
+    alice.authenticated_request("/user/order/history")
+    alice.authenticated_request("/user/order/history")
+    assert session.calls == 4
+
+    alice.invalidate_cache()
+    assert alice.get_fiat_balances() == {"balance_eur": "5"}
+    assert bob.get_fiat_balances() == {"balance_eur": "2"}
+
+    time.sleep(TTL)
+    assert bob.get_fiat_balances() == {"balance_eur": "6"}
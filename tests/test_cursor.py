@@ -0,0 +1,115 @@
+from kdmukai.specterext.bitcoinreserve.cursor import SyncCursor
+from kdmukai.specterext.bitcoinreserve.sync import fetch_sync_changes
+
+
+def summary(transaction_id: str, transaction_status: str) -> dict:
+    return {"transaction_id": transaction_id, "transaction_status": transaction_status}
+
+
+class Summary(dict):
+    def __init__(
+        self, transaction_id: str, transaction_status: str, transaction_time: float
+    ):
+        super().__init__(summary(transaction_id, transaction_status))
+        self.transaction_time = transaction_time
+
+
+class FakeClient:
+    """Newest first, like the API; records which details were fetched"""
+
+    def __init__(self, history):
+        self.history = history
+        self.fetched = []
+
+    def iter_transactions(self, since: float = None):
+        for tx in self.history:
+            if since is None or tx.transaction_time >= since:
+                yield tx
+
+    def get_transactions_details(self, transaction_ids):
+        self.fetched.extend(transaction_ids)
+        return [{"transaction_id": tx_id} for tx_id in transaction_ids]
+
+
+def test_advance_all_final():
+    cursor = SyncCursor().advance(
+        [
+            (summary("a", "DONE"), 1),
+            (summary("b", "DONE"), 3),
+            (summary("c", "DONE"), 3),
+        ]
+    )
+    # Only the newest transactions are kept in `seen`
+    assert cursor.watermark == 3
+    assert cursor.seen == {"b": "DONE", "c": "DONE"}
+
+
+def test_advance_stops_at_oldest_pending():
+    cursor = SyncCursor().advance(
+        [
+            (summary("a", "DONE"), 1),
+            (summary("b", "PENDING"), 2),
+            (summary("c", "DONE"), 3),
+            (summary("d", "PENDING"), 4),
+        ]
+    )
+    assert cursor.watermark == 2
+    assert cursor.seen == {"b": "PENDING", "c": "DONE", "d": "PENDING"}
+
+    # Once the pending ones are final the watermark moves up to the newest
+    cursor = cursor.advance(
+        [
+            (summary("b", "COMPLETED"), 2),
+            (summary("c", "DONE"), 3),
+            (summary("d", "CANCELLED"), 4),
+        ]
+    )
+    assert cursor.watermark == 4
+    assert cursor.seen == {"d": "CANCELLED"}
+
+
+def test_advance_never_moves_back():
+    cursor = SyncCursor(5, {"a": "DONE"})
+    assert cursor.advance([]) == cursor
+    # A row older than the watermark (e.g. the API's clock skewing) is ignored
+    assert cursor.advance([(summary("b", "PENDING"), 4)]).watermark == 5
+
+
+def test_is_unchanged():
+    cursor = SyncCursor(1, {"a": "PENDING", "b": "DONE"})
+    assert cursor.is_unchanged(summary("b", "DONE"))
+    assert not cursor.is_unchanged(summary("a", "DONE"))
+    assert not cursor.is_unchanged(summary("c", "DONE"))
+
+
+def test_dict_round_trip():
+    cursor = SyncCursor(2.5, {"a": "PENDING"})
+    assert SyncCursor.from_dict(cursor.to_dict()) == cursor
+    assert SyncCursor.from_dict(None) == SyncCursor()
+
+
+def test_fetch_sync_changes():
+    client = FakeClient(
+        [
+            Summary("c", "DONE", 3),
+            Summary("b", "PENDING", 2),
+            Summary("a", "DONE", 1),
+        ]
+    )
+    scanned, synced = fetch_sync_changes(client, SyncCursor())
+    assert [tx["transaction_id"] for tx, transaction_time in scanned] == ["c", "b", "a"]
+    assert [details for tx, transaction_time, details in synced] == [
+        {"transaction_id": "c"},
+        {"transaction_id": "b"},
+        {"transaction_id": "a"},
+    ]
+    cursor = SyncCursor().advance(scanned)
+    assert cursor.watermark == 2
+
+    # Next sync: only "b" changed; "a" is behind the watermark and isn't scanned
+    client.history[1] = Summary("b", "DONE", 2)
+    client.fetched = []
+    scanned, synced = fetch_sync_changes(client, cursor)
+    assert len(scanned) == 2
+    assert client.fetched == ["b"]
+    assert cursor.advance(scanned) == SyncCursor(3, {"c": "DONE"})
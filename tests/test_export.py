@@ -0,0 +1,126 @@
+import csv
+import datetime
+import io
+import json
+
+import pytest
+
+from kdmukai.specterext.bitcoinreserve import export
+from kdmukai.specterext.bitcoinreserve.export import (
+    CSV_FIELDS,
+    iter_api_transactions,
+    iter_export,
+    iter_store_transactions,
+)
+from kdmukai.specterext.bitcoinreserve.models import TransactionSummary
+from kdmukai.specterext.bitcoinreserve.storage import BitcoinReserveTransactionStore
+
+
+TRANSACTION_TIME = datetime.datetime(2022, 1, 18, 5, 28, 35, 68650).timestamp()
+
+
+def order(transaction_id: str, transaction_time: float = TRANSACTION_TIME):
+    summary = {
+        "transaction_id": transaction_id,
+        "transaction_status": "DONE",
+        "transaction_type": "ORDER",
+        "in_currency": "EUR",
+        "in_amount": "10.00",
+        "out_currency": "SATS",
+        "out_amount": "28838.00000000",
+    }
+    details = {
+        "transaction_id": transaction_id,
+        "fiat_currency": "EUR",
+        "withdrawals": [
+            {"withdrawal_address": "bc1qone", "withdrawal_fee": "500"},
+            {"withdrawal_address": "bc1qtwo", "withdrawal_fee": "None"},
+        ],
+    }
+    return summary, transaction_time, details
+
+
+def read_csv(chunks) -> list:
+    return list(csv.DictReader(io.StringIO("".join(chunks))))
+
+
+def test_csv():
+    rows = read_csv(iter_export([order("a")], "csv"))
+    assert len(rows) == 1
+    row = rows[0]
+    assert list(row) == CSV_FIELDS
+    assert row["transaction_time"] == "2022-01-18 05:28:35.068650"
+    assert row["out_amount"] == "28838.00000000"
+    assert row["fiat_currency"] == "EUR"
+    # Several withdrawals share a cell; "None" is left out
+    assert row["withdrawal_address"] == "bc1qone bc1qtwo"
+    assert row["withdrawal_fee"] == "500"
+    assert row["withdrawal_identifier"] == ""
+
+
+def test_csv_header_only():
+    assert "".join(iter_export([], "csv")) == ",".join(CSV_FIELDS) + "\r\n"
+
+
+def test_jsonl():
+    summary, transaction_time, details = order("a")
+    lines = "".join(iter_export([order("a"), order("b")], "jsonl")).splitlines()
+    assert len(lines) == 2
+    record = json.loads(lines[0])
+    assert record["transaction_id"] == "a"
+    assert record["withdrawal_address"] == "bc1qone bc1qtwo"
+    # Nothing the API returned is lost
+    assert record["summary"] == summary
+    assert record["details"] == details
+
+
+def test_chunks(monkeypatch):
+    monkeypatch.setattr(export, "CHUNK_ROWS", 3)
+    transactions = [order(str(i)) for i in range(7)]
+    assert len(list(iter_export(transactions, "jsonl"))) == 3
+    chunks = list(iter_export(transactions, "csv"))
+    # The header is in the first chunk
+    assert len(chunks) == 3
+    assert len(read_csv(chunks)) == 7
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        iter_export([], "xlsx")
+
+
+def test_from_store(tmp_path):
+    store = BitcoinReserveTransactionStore(str(tmp_path), "alice")
+    store.save_transactions([order("a", 1), order("b", 2), order("c", 3)])
+    rows = read_csv(iter_export(iter_store_transactions(store, since=2), "csv"))
+    assert [row["transaction_id"] for row in rows] == ["c", "b"]
+    assert rows[0]["withdrawal_address"] == "bc1qone bc1qtwo"
+
+
+def test_from_api():
+    history = [
+        TransactionSummary(dict(order(transaction_id)[0], transaction_time=time))
+        for transaction_id, time in (
+            ("c", "2022-01-18 05:28:37.000000"),
+            ("b", "2022-01-18 05:28:36.000000"),
+            ("a", "2022-01-18 05:28:35.000000"),
+        )
+    ]
+
+    class FakeClient:
+        def iter_transactions(self, since: float = None):
+            return (tx for tx in history if tx.transaction_time >= since)
+
+    rows = list(
+        iter_api_transactions(
+            FakeClient(),
+            since=history[2].transaction_time,
+            until=history[0].transaction_time,
+        )
+    )
+    assert [(summary["transaction_id"], details) for summary, _, details in rows] == [
+        ("b", None),
+        ("a", None),
+    ]
+    # Summary rows only: no withdrawal columns
+    assert read_csv(iter_export(rows, "csv"))[0]["withdrawal_address"] == ""
@@ -0,0 +1,122 @@
+from kdmukai.specterext.bitcoinreserve.index import BitcoinReserveWithdrawalIndex
+from kdmukai.specterext.bitcoinreserve.storage import BitcoinReserveTransactionStore
+
+
+SERVICE_ID = "bitcoinreserve"
+
+
+def buy(withdrawal_status: str = "INITIATED"):
+    summary = {
+        "transaction_id": "buy",
+        "transaction_type": "MARKET BUY",
+        "transaction_status": "COMPLETE",
+    }
+    details = {
+        "transaction_id": "buy",
+        "sats_bought": "147810",
+        "fiat_spent": "50.00",
+        "fiat_currency": "EUR",
+        # The withdrawal as it was when the buy's details were fetched
+        "withdrawals": {
+            "transaction_id": "withdrawal",
+            "withdrawal_status": withdrawal_status,
+            "withdrawal_address": "bc1qaddress",
+        },
+    }
+    return summary, 1, details
+
+
+def withdrawal(withdrawal_status: str = "DONE"):
+    summary = {
+        "transaction_id": "withdrawal",
+        "transaction_type": "WITHDRAWAL",
+        "transaction_status": withdrawal_status,
+        "out_currency": "SATS",
+        "out_amount": "147810.00000000",
+    }
+    details = {
+        "transaction_id": "withdrawal",
+        "withdrawal_status": withdrawal_status,
+        "withdrawal_address": "bc1qaddress",
+        "withdrawal_identifier": "txid",
+    }
+    return summary, 2, details
+
+
+def test_add_merges_the_buy_and_its_withdrawal():
+    index = BitcoinReserveWithdrawalIndex(SERVICE_ID)
+    changed = index.add([buy()])
+    assert [entry["withdrawal_status"] for entry in changed] == ["INITIATED"]
+    assert index.get_by_txid("txid") is None
+
+    changed = index.add([withdrawal()])
+    assert len(changed) == 1
+    entry = index.get_by_txid("txid")
+    assert entry == index.get_by_address("bc1qaddress")[0]
+    assert entry["withdrawal_status"] == "DONE"
+    assert entry["order_id"] == "buy"
+    assert entry["sats_bought"] == 147810
+    assert entry["out_amount"] == 147810
+    assert len(index) == 1
+
+    # Nothing new: nothing changed
+    assert index.add([buy(), withdrawal()]) == []
+
+
+def test_stale_buy_record_doesnt_win():
+    """The buy's nested copy is older than the withdrawal's own record"""
+    index = BitcoinReserveWithdrawalIndex(SERVICE_ID)
+    # Newest first, as a sync hands them over
+    index.add([withdrawal(), buy()])
+    assert index.get_by_txid("txid")["withdrawal_status"] == "DONE"
+
+
+def test_rebuild_from_store(tmp_path):
+    store = BitcoinReserveTransactionStore(str(tmp_path), "alice")
+    live = BitcoinReserveWithdrawalIndex(SERVICE_ID)
+    for transactions in ([buy(), withdrawal("INITIATED")], [withdrawal("DONE")]):
+        store.save_transactions(transactions)
+        live.add(transactions)
+
+    # e.g. after a restart
+    rebuilt = BitcoinReserveWithdrawalIndex.from_store(SERVICE_ID, store)
+    assert live.get_by_txid("txid")["withdrawal_status"] == "DONE"
+    assert rebuilt.get_by_txid("txid") == live.get_by_txid("txid")
+
+
+def test_tag_tx():
+    index = BitcoinReserveWithdrawalIndex(SERVICE_ID)
+    index.add([buy(), withdrawal()])
+
+    tx = {"txid": "txid", "address": "bc1qother"}
+    assert index.tag_tx(tx)
+    assert tx["service_id"] == SERVICE_ID
+    assert tx[SERVICE_ID]["order_id"] == "buy"
+
+    # Matched on the receiving address if the txid isn't known (yet)
+    tx = {"txid": "unknown", "address": ["bc1qother", "bc1qaddress"]}
+    assert index.tag_tx(tx)
+    assert tx[SERVICE_ID]["withdrawal_id"] == "withdrawal"
+
+    tx = {"txid": "unknown", "address": "bc1qother"}
+    assert not index.tag_tx(tx)
+    assert "service_id" not in tx
+
+
+def test_unlinked():
+    index = BitcoinReserveWithdrawalIndex(SERVICE_ID)
+    index.add([buy()])
+    assert [entry["withdrawal_id"] for entry in index.get_unlinked()] == ["withdrawal"]
+
+    index.mark_linked(["withdrawal"])
+    assert index.get_unlinked() == []
+    index.add([buy()])
+    assert index.get_unlinked() == []
+
+    # Changed again: it has to be linked again
+    index.add([withdrawal()])
+    assert len(index.get_unlinked()) == 1
+    index.mark_linked(["withdrawal"])
+
+    index.mark_unlinked()
+    assert len(index.get_unlinked()) == 1
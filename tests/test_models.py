@@ -0,0 +1,72 @@
+import datetime
+
+import pytest
+
+from kdmukai.specterext.bitcoinreserve.models import (
+    Order,
+    TransactionDetails,
+    TransactionSummary,
+    parse_amount,
+    parse_transaction_time,
+    to_minor_units,
+)
+
+
+def timestamp(*args) -> float:
+    return datetime.datetime(*args).timestamp()
+
+
+def test_parse_transaction_time():
+    # fromisoformat() fast path
+    assert parse_transaction_time("2022-01-18 05:28:35.068650") == timestamp(
+        2022, 1, 18, 5, 28, 35, 68650
+    )
+    assert parse_transaction_time("2022-01-18 05:28:35.0686") == timestamp(
+        2022, 1, 18, 5, 28, 35, 68600
+    )
+    # Not ISO 8601 (no zero padding); the strptime() fallback still reads it
+    assert parse_transaction_time("2022-1-18 5:28:35.068650") == timestamp(
+        2022, 1, 18, 5, 28, 35, 68650
+    )
+    with pytest.raises(ValueError):
+        parse_transaction_time("yesterday")
+
+
+def test_amounts():
+    assert to_minor_units("28838.00000000", "SATS") == 28838
+    assert to_minor_units("0.00028838", "BTC") == 28838
+    assert to_minor_units("12.34", "eur") == 1234
+    assert to_minor_units(1500, "JPY") == 1500
+    assert to_minor_units("None", "EUR") is None
+    assert parse_amount("not a number") is None
+
+
+def test_summary_parses_lazily():
+    raw = {
+        "transaction_id": "a",
+        "transaction_time": "not parsed until it's used",
+        "out_currency": "SATS",
+        "out_amount": "28838.00000000",
+    }
+    summary = TransactionSummary(raw)
+    assert summary.transaction_id == "a"
+    assert summary.out_amount == 28838
+    # Still a read-only mapping over the raw json
+    assert summary["out_amount"] == "28838.00000000"
+    assert dict(summary) == raw
+    assert summary == raw
+    assert summary.to_dict() is raw
+    with pytest.raises(ValueError):
+        summary.transaction_time
+
+
+def test_withdrawals():
+    withdrawal = {"withdrawal_address": "bc1qaddress", "withdrawal_fee": "500"}
+    assert TransactionDetails({"withdrawals": withdrawal}).withdrawals == [withdrawal]
+    assert TransactionDetails({"withdrawals": [withdrawal]}).withdrawals == [withdrawal]
+    assert TransactionDetails({"withdrawals": {}}).withdrawals == []
+    assert TransactionDetails({}).withdrawals == []
+    # confirm_order lists the withdrawal on the order itself
+    order = Order(dict(withdrawal, order_id="o"))
+    assert [w.withdrawal_address for w in order.withdrawals] == ["bc1qaddress"]
+    assert order.withdrawals[0].withdrawal_fee == 500
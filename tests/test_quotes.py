@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+from flask import Flask
+
+from kdmukai.specterext.bitcoinreserve import client as bitcoinreserve_client
+from kdmukai.specterext.bitcoinreserve.exceptions import (
+    BitcoinReserveApiException,
+    BitcoinReserveQuoteChangedException,
+)
+from kdmukai.specterext.bitcoinreserve.quotes import BitcoinReserveQuoteManager
+
+
+ADDRESS = "bc1qaddress"
+
+
+class FakeApi:
+    """Hands out numbered quotes that are valid for `lifetime` seconds"""
+
+    def __init__(self, monkeypatch, lifetime: float = 60):
+        self.lifetime = lifetime
+        self.quotes = []
+        self.confirmed = []
+        self.block = None
+        self.fail = False
+        monkeypatch.setattr(bitcoinreserve_client, "create_quote", self.create_quote)
+        monkeypatch.setattr(bitcoinreserve_client, "confirm_order", self.confirm_order)
+
+    def create_quote(self, fiat_amount, withdrawal_address, fiat_currency, api_token):
+        if self.block:
+            self.block.wait(5)
+        if self.fail:
+            raise BitcoinReserveApiException("Service unavailable", status_code=503)
+        quote = {
+            "quote_id": f"quote-{len(self.quotes)}",
+            "bitcoin_receive_amount": "0.00100000",
+            "trade_fee_amount": "0.50",
+            "trade_fee_currency": fiat_currency,
+            "expiration_time_utc": time.time() + self.lifetime,
+        }
+        self.quotes.append(quote)
+        return quote
+
+    def confirm_order(self, quote_id: str, api_token: str = None):
+        self.confirmed.append(quote_id)
+        return {"quote_id": quote_id, "order_status": "COMPLETE"}
+
+
+@pytest.fixture
+def manager():
+    manager = BitcoinReserveQuoteManager(Flask(__name__), expiry_margin=0.1)
+    yield manager
+    manager.shutdown()
+
+
+def test_reuse(manager, monkeypatch):
+    api = FakeApi(monkeypatch)
+    quote = manager.get_quote("alice", "token", "100", ADDRESS)
+    assert quote["quote_id"] == "quote-0"
+    # The same order, however the amount is spelled
+    assert manager.get_quote("alice", "token", "100.00", ADDRESS) == quote
+    assert len(api.quotes) == 1
+
+    # Another user's or another amount's quote is its own
+    manager.get_quote("bob", "token", "100", ADDRESS)
+    manager.get_quote("alice", "token", "50", ADDRESS)
+    assert len(api.quotes) == 3
+
+
+def test_expiry(manager, monkeypatch):
+    api = FakeApi(monkeypatch, lifetime=0.4)
+    manager.get_quote("alice", "token", "100", ADDRESS)
+    # The background refresh (at 0.2s) fails; the quote is kept until it's within
+    # the expiry margin (at 0.3s)
+    api.fail = True
+    time.sleep(0.25)
+    assert manager.get_quote("alice", "token", "100", ADDRESS)["quote_id"] == "quote-0"
+
+    api.fail = False
+    time.sleep(0.1)
+    assert manager.get_quote("alice", "token", "100", ADDRESS)["quote_id"] == "quote-1"
+    assert len(api.quotes) == 2
+
+
+def test_concurrent_misses_share_one_quote(manager, monkeypatch):
+    api = FakeApi(monkeypatch)
+    api.block = threading.Event()
+    quotes = []
+    threads = [
+        threading.Thread(
+            target=lambda: quotes.append(
+                manager.get_quote("alice", "token", "100", ADDRESS)
+            )
+        )
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    api.block.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(api.quotes) == 1
+    assert {quote["quote_id"] for quote in quotes} == {"quote-0"}
+    # ...so the quote any of them was shown can be confirmed
+    manager.confirm_order("alice", "token", "100", ADDRESS, quote_id="quote-0")
+    assert api.confirmed == ["quote-0"]
+
+
+def test_timer_refresh(manager, monkeypatch):
+    api = FakeApi(monkeypatch, lifetime=0.5)
+    assert manager.get_quote("alice", "token", "100", ADDRESS)["quote_id"] == "quote-0"
+    # Refreshed in the background 2 * expiry_margin before it expires
+    deadline = time.time() + 2
+    while len(api.quotes) < 2 and time.time() < deadline:
+        time.sleep(0.05)
+    assert manager.get_quote("alice", "token", "100", ADDRESS)["quote_id"] == "quote-1"
+
+    # Not refreshed once nobody asks for it anymore
+    manager.keepalive = 0
+    time.sleep(0.6)
+    assert len(api.quotes) == 2
+
+
+def test_confirm_mismatch(manager, monkeypatch):
+    api = FakeApi(monkeypatch)
+    quote = manager.get_quote("alice", "token", "100", ADDRESS)
+
+    with pytest.raises(BitcoinReserveQuoteChangedException) as e:
+        manager.confirm_order("alice", "token", "100", ADDRESS, quote_id="stale")
+    # The current quote is offered instead, and nothing was bought
+    assert e.value.quote["quote_id"] == quote["quote_id"]
+    assert api.confirmed == []
+
+    quote_id = quote["quote_id"]
+    manager.confirm_order("alice", "token", "100", ADDRESS, quote_id=quote_id)
+    assert api.confirmed == [quote_id]
+    # A confirmed quote is used up
+    with pytest.raises(BitcoinReserveQuoteChangedException) as e:
+        manager.confirm_order("alice", "token", "100", ADDRESS, quote_id=quote_id)
+    assert e.value.quote["quote_id"] == "quote-1"
+    assert api.confirmed == [quote_id]
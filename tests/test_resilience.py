@@ -0,0 +1,372 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from kdmukai.specterext.bitcoinreserve import api_client
+from kdmukai.specterext.bitcoinreserve.api_client import BitcoinReserveClient
+from kdmukai.specterext.bitcoinreserve.api_config import BitcoinReserveApiConfig
+from kdmukai.specterext.bitcoinreserve.exceptions import (
+    BitcoinReserveApiCircuitOpenException,
+    BitcoinReserveApiException,
+    BitcoinReserveApiRateLimitException,
+    BitcoinReserveApiTransientException,
+)
+from kdmukai.specterext.bitcoinreserve.resilience import (
+    CircuitBreaker,
+    FairRequestLimiter,
+    RetryPolicy,
+    SingleFlight,
+    _circuit_breakers,
+    classify_error_response,
+)
+
+
+RESET_TIMEOUT = 0.05
+
+
+class FakeResponse:
+    status_code = 200
+    text = "{}"
+    headers = {}
+    content = b"{}"
+
+    class request:
+        body = b""
+
+    def json(self):
+        return {"ok": True}
+
+
+class RateLimitedResponse(FakeResponse):
+    status_code = 429
+    text = "Too many requests"
+
+    def __init__(self, retry_after: str):
+        self.headers = {"Retry-After": retry_after}
+
+
+class FakeSession:
+    """
+    Raises (or, if it's a response, returns) the next queued error for each
+    request; a 200 once there are none left
+    """
+
+    def __init__(self):
+        self.errors = []
+
+    def request(self, **kwargs):
+        if self.errors:
+            error = self.errors.pop(0)
+            if isinstance(error, FakeResponse):
+                return error
+            raise error
+        return FakeResponse()
+
+
+@pytest.fixture
+def fake_session(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(api_client, "get_session", lambda pool_size=10: session)
+    _circuit_breakers.clear()
+    yield session
+    _circuit_breakers.clear()
+
+
+def test_classify_error_response():
+    assert type(classify_error_response(400, "bad")) is BitcoinReserveApiException
+    assert type(classify_error_response(404, "gone")) is BitcoinReserveApiException
+
+    error = classify_error_response(429, "slow down", {"Retry-After": "7"})
+    assert isinstance(error, BitcoinReserveApiRateLimitException)
+    assert error.retry_after == 7
+
+    for status_code in (408, 500, 502, 503):
+        error = classify_error_response(status_code, "oops")
+        assert isinstance(error, BitcoinReserveApiTransientException)
+        assert error.status_code == status_code
+
+
+def test_retry_policy():
+    policy = RetryPolicy(max_retries=2, backoff_base=1, backoff_max=10, max_retry_after=30)
+    transient = BitcoinReserveApiTransientException("503")
+
+    assert 0 <= policy.get_delay(0, "GET", transient) <= 1
+    assert 0 <= policy.get_delay(1, "GET", transient) <= 2
+    assert policy.get_delay(2, "GET", transient) is None
+
+    # Not transient, or not idempotent: never retried...
+    assert policy.get_delay(0, "GET", BitcoinReserveApiException("400")) is None
+    assert policy.get_delay(0, "POST", transient) is None
+
+    # ...except a POST that was rate limited, i.e. never processed
+    rate_limited = BitcoinReserveApiRateLimitException("429", retry_after=5)
+    assert policy.get_delay(0, "POST", rate_limited) == 5
+    too_long = BitcoinReserveApiRateLimitException("429", retry_after=60)
+    assert policy.get_delay(0, "GET", too_long) is None
+
+
+def test_circuit_breaker_states():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=RESET_TIMEOUT)
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(BitcoinReserveApiCircuitOpenException):
+        breaker.before_request()
+
+    # One probe is let through once the reset timeout has passed
+    time.sleep(RESET_TIMEOUT)
+    breaker.before_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(BitcoinReserveApiCircuitOpenException):
+        breaker.before_request()
+
+    # A failed probe re-opens the circuit; a successful one closes it
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(RESET_TIMEOUT)
+    breaker.before_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_breaker_stale_probe():
+    """A probe that never reports back doesn't keep the circuit half-open forever"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=RESET_TIMEOUT)
+    breaker.record_failure()
+    time.sleep(RESET_TIMEOUT)
+    breaker.before_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    time.sleep(RESET_TIMEOUT)
+    # Counts as failed; this request becomes the next probe
+    breaker.before_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_breaker_inconclusive():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=RESET_TIMEOUT)
+    breaker.record_inconclusive()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    time.sleep(RESET_TIMEOUT)
+    breaker.before_request()
+    # The probe was inconclusive: still open, but the next request probes again
+    breaker.record_inconclusive()
+    assert breaker.state == CircuitBreaker.OPEN
+    breaker.before_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_client_rate_limits_dont_open_the_breaker(fake_session):
+    client = BitcoinReserveClient.for_api_token(
+        BitcoinReserveApiConfig(
+            api_url="http://ratelimit.test",
+            max_retries=3,
+            backoff_base=0,
+            circuit_failure_threshold=2,
+        ),
+        "token",
+    )
+    breaker = client.config.get_circuit_breaker()
+
+    # Retried after the Retry-After delay, and never counted as host failures
+    fake_session.errors.extend(RateLimitedResponse("0.1") for _ in range(3))
+    start = time.monotonic()
+    assert client.authenticated_request("/user/balance") == {"ok": True}
+    assert time.monotonic() - start >= 0.3
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    # Given up on: still doesn't count
+    fake_session.errors.extend(RateLimitedResponse("0") for _ in range(4))
+    with pytest.raises(BitcoinReserveApiRateLimitException):
+        client.authenticated_request("/user/balance")
+    fake_session.errors.extend(RateLimitedResponse("0") for _ in range(4))
+    with pytest.raises(BitcoinReserveApiRateLimitException):
+        client.authenticated_request("/user/balance")
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_client_unclassified_errors_settle_the_breaker(fake_session):
+    """
+    The probe failing with an exception that isn't a Timeout / ConnectionError
+    must still re-open the circuit rather than leave it stuck half-open
+    """
+    client = BitcoinReserveClient.for_api_token(
+        BitcoinReserveApiConfig(
+            api_url="http://breaker.test",
+            max_retries=0,
+            circuit_failure_threshold=1,
+            circuit_reset_timeout=RESET_TIMEOUT,
+        ),
+        "token",
+    )
+    breaker = client.config.get_circuit_breaker()
+
+    fake_session.errors.append(requests.ConnectionError("down"))
+    with pytest.raises(BitcoinReserveApiTransientException):
+        client.authenticated_request("/user/balance")
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(BitcoinReserveApiCircuitOpenException):
+        client.authenticated_request("/user/balance")
+
+    # Any other requests error is transient too
+    time.sleep(RESET_TIMEOUT)
+    fake_session.errors.append(requests.exceptions.ChunkedEncodingError("cut off"))
+    with pytest.raises(BitcoinReserveApiTransientException):
+        client.authenticated_request("/user/balance")
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # Something entirely unexpected propagates as is, but still counts as a failure
+    time.sleep(RESET_TIMEOUT)
+    fake_session.errors.append(RuntimeError("bug"))
+    with pytest.raises(RuntimeError):
+        client.authenticated_request("/user/balance")
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # ...and the next probe can still close the circuit
+    time.sleep(RESET_TIMEOUT)
+    assert client.authenticated_request("/user/balance") == {"ok": True}
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def wait_for_waiters(limiter: FairRequestLimiter, count: int):
+    deadline = time.monotonic() + 5
+    while sum(len(waiters) for waiters in limiter._waiters.values()) < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_fair_request_limiter_round_robin():
+    limiter = FairRequestLimiter(max_concurrent=1)
+    served = []
+
+    def request(owner):
+        with limiter.slot(owner):
+            served.append(owner)
+
+    limiter.acquire("main")
+    # alice queues up three requests before bob gets to queue his one...
+    threads = []
+    for count, owner in enumerate(["alice", "alice", "alice", "bob"], start=1):
+        threads.append(threading.Thread(target=request, args=(owner,)))
+        threads[-1].start()
+        wait_for_waiters(limiter, count)
+    limiter.release()
+    for thread in threads:
+        thread.join()
+
+    # ...but bob doesn't have to wait for all of them
+    assert served == ["alice", "bob", "alice", "alice"]
+    assert limiter.in_flight == 0
+
+
+def test_fair_request_limiter_cap():
+    limiter = FairRequestLimiter(max_concurrent=3)
+    lock = threading.Lock()
+    in_flight = []
+    peak = [0]
+
+    def request(owner):
+        with limiter.slot(owner):
+            with lock:
+                in_flight.append(owner)
+                peak[0] = max(peak[0], len(in_flight))
+            time.sleep(0.001)
+            with lock:
+                in_flight.remove(owner)
+
+    threads = [
+        threading.Thread(target=request, args=(f"user{i % 4}",)) for i in range(40)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 3
+    assert limiter.in_flight == 0
+
+
+def test_single_flight_coalesces():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def call():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return {"balance_eur": "1"}
+
+    def do(key):
+        results.append(single_flight.do(key, call))
+
+    leader = threading.Thread(target=do, args=("balance",))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=do, args=("balance",)) for i in range(3)]
+    for thread in followers:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while single_flight._calls["balance"].shared < 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(shared for result, shared in results) == [False, True, True, True]
+    # Everyone got their own copy
+    assert all(result == {"balance_eur": "1"} for result, shared in results)
+    assert len({id(result) for result, shared in results}) == 4
+    assert len(single_flight) == 0
+
+    # Nothing is kept once the call has returned
+    assert single_flight.do("balance", lambda: 2) == (2, False)
+
+
+def test_single_flight_errors():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def call():
+        started.set()
+        release.wait()
+        raise BitcoinReserveApiTransientException("503")
+
+    def do():
+        try:
+            single_flight.do("balance", call)
+        except BitcoinReserveApiTransientException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=do)]
+    threads[0].start()
+    started.wait()
+    threads.append(threading.Thread(target=do))
+    threads[1].start()
+    deadline = time.monotonic() + 5
+    while single_flight._calls["balance"].shared < 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    # The follower sees the leader's exception rather than calling again
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
+    assert len(single_flight) == 0
+    assert single_flight.do("balance", lambda: "ok") == ("ok", False)
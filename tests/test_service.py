@@ -0,0 +1,176 @@
+import copy
+
+from types import SimpleNamespace
+
+import pytest
+
+from flask import Flask
+
+from kdmukai.specterext.bitcoinreserve import client as bitcoinreserve_client
+from kdmukai.specterext.bitcoinreserve.service import BitcoinReserveService
+
+
+USER = SimpleNamespace(id="alice", username="alice")
+
+
+class FakeStorage:
+    """A user's ServiceEncryptedStorage; counts the (decrypting) reads"""
+
+    def __init__(self, service_data: dict):
+        self.service_data = service_data
+        self.reads = 0
+
+    def get_service_data(self, service_id: str) -> dict:
+        self.reads += 1
+        return copy.deepcopy(self.service_data)
+
+    def update_service_data(self, service_id: str, service_data: dict):
+        self.service_data.update(copy.deepcopy(service_data))
+
+
+class Summary(dict):
+    def __init__(self, transaction_time: float, **summary):
+        super().__init__(summary)
+        self.transaction_time = transaction_time
+
+
+class FakeClient:
+    """Newest first, like the API"""
+
+    def __init__(self):
+        self.history = []
+        self.details = {}
+
+    def iter_transactions(self, since: float = None):
+        for tx in self.history:
+            if since is None or tx.transaction_time >= since:
+                yield tx
+
+    def get_transactions_details(self, transaction_ids):
+        return [self.details[transaction_id] for transaction_id in transaction_ids]
+
+    def get_fiat_balances(self) -> dict:
+        return {"balance_eur": "0.00000000"}
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    storage = FakeStorage({BitcoinReserveService.API_TOKEN: "token"})
+    monkeypatch.setattr(
+        BitcoinReserveService,
+        "_get_user_service_storage",
+        classmethod(lambda cls, user: storage),
+    )
+    return storage
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, storage):
+    app = Flask(__name__)
+    app.specter = SimpleNamespace(
+        data_folder=str(tmp_path),
+        user_manager=SimpleNamespace(get_user=lambda user_id=None: USER),
+    )
+    for attr in (
+        "_transaction_stores",
+        "_withdrawal_indexes",
+        "_analytics",
+        "_sync_locks",
+    ):
+        monkeypatch.setattr(BitcoinReserveService, attr, {})
+    return app
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(
+        bitcoinreserve_client, "get_client", lambda api_token=None: client
+    )
+    return client
+
+
+def add_withdrawal(client: FakeClient):
+    client.history.insert(
+        0,
+        Summary(
+            1,
+            transaction_id="withdrawal",
+            transaction_type="WITHDRAWAL",
+            transaction_status="DONE",
+        ),
+    )
+    client.details["withdrawal"] = {
+        "transaction_id": "withdrawal",
+        "withdrawal_status": "DONE",
+        "withdrawal_address": "bc1qaddress",
+        "withdrawal_identifier": "txid",
+    }
+
+
+def test_withdrawals_are_linked_until_it_succeeds(app, fake_client, monkeypatch):
+    linked = []
+
+    def link_withdrawals_to_wallet(cls, withdrawals, user=None):
+        if not linked:
+            linked.append(None)
+            raise RuntimeError("wallet file is locked")
+        linked.append(sorted(withdrawal["withdrawal_id"] for withdrawal in withdrawals))
+
+    monkeypatch.setattr(
+        BitcoinReserveService,
+        "link_withdrawals_to_wallet",
+        classmethod(link_withdrawals_to_wallet),
+    )
+    add_withdrawal(fake_client)
+
+    with app.app_context():
+        with pytest.raises(RuntimeError):
+            BitcoinReserveService.update(USER)
+        # The withdrawal is indexed already, but it wasn't linked yet
+        BitcoinReserveService.update(USER)
+        assert linked == [None, ["withdrawal"]]
+
+        # Once linked, it's left alone
+        BitcoinReserveService.update(USER)
+        assert linked == [None, ["withdrawal"]]
+
+    # After a restart the index is rebuilt from the store; what's in there is
+    # linked again, even though there's nothing new to sync
+    monkeypatch.setattr(BitcoinReserveService, "_withdrawal_indexes", {})
+    with app.app_context():
+        BitcoinReserveService.update(USER)
+    assert linked == [None, ["withdrawal"], ["withdrawal"]]
+
+
+def api_token() -> str:
+    return BitcoinReserveService.get_api_credentials(USER).get("api_token")
+
+
+def test_service_data_memo(app, storage):
+    with app.test_request_context():
+        assert api_token() == "token"
+        service_data = BitcoinReserveService.get_user_service_data(USER)
+        assert storage.reads == 1
+
+        # Handed out as copies
+        service_data[BitcoinReserveService.API_TOKEN] = "changed"
+        assert api_token() == "token"
+
+        # Writes go to the storage and the memo
+        BitcoinReserveService.update_user_service_data(
+            {BitcoinReserveService.API_TOKEN: "new token"}, user=USER
+        )
+        assert storage.service_data[BitcoinReserveService.API_TOKEN] == "new token"
+        assert api_token() == "new token"
+        assert storage.reads == 1
+
+    # The next request reads the storage again
+    with app.test_request_context():
+        assert api_token() == "new token"
+        assert storage.reads == 2
+
+    # No app context, nothing to memoize in
+    BitcoinReserveService.get_user_service_data(USER)
+    BitcoinReserveService.get_user_service_data(USER)
+    assert storage.reads == 4
@@ -0,0 +1,159 @@
+import pytest
+
+from kdmukai.specterext.bitcoinreserve.storage import BitcoinReserveTransactionStore
+
+
+def transaction(
+    transaction_id: str, transaction_time: float, details: dict = None, **summary
+):
+    summary = dict(
+        {"transaction_type": "ORDER", "transaction_status": "DONE"},
+        transaction_id=transaction_id,
+        **summary,
+    )
+    return summary, transaction_time, details
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BitcoinReserveTransactionStore(str(tmp_path), "alice")
+
+
+def ids(rows):
+    return [row["transaction_id"] for row in rows]
+
+
+def test_filters_and_count(store):
+    store.save_transactions(
+        [
+            transaction("a", 1),
+            transaction("b", 2, transaction_type="WITHDRAWAL"),
+            transaction("c", 3, transaction_status="PENDING"),
+            transaction("d", 4),
+        ]
+    )
+    assert ids(store.get_transactions()) == ["d", "c", "b", "a"]
+    assert ids(store.get_transactions(limit=2, offset=1)) == ["c", "b"]
+    assert ids(store.get_transactions(since=2, until=4)) == ["c", "b"]
+    assert ids(store.get_transactions(transaction_type="WITHDRAWAL")) == ["b"]
+    assert ids(store.get_transactions(transaction_status="DONE", since=2)) == ["d", "b"]
+
+    assert store.count() == 4
+    assert store.count(since=2, until=4) == 2
+    assert store.count(transaction_status="PENDING") == 1
+
+
+def test_revision(store):
+    assert store.get_revision() == 0
+    store.save_transactions([transaction("a", 1)])
+    revision = store.get_revision()
+    assert revision > 0
+
+    # Nothing to save: nothing changed
+    store.save_transactions([])
+    assert store.get_revision() == revision
+
+    store.save_transactions([transaction("a", 1, transaction_status="FAILED")])
+    assert store.get_revision() > revision
+    assert store.get_transaction("a")["summary"]["transaction_status"] == "FAILED"
+
+
+def test_details_are_kept(store):
+    details = {
+        "transaction_id": "a",
+        "withdrawals": {
+            "withdrawal_address": "bc1qaddress",
+            "withdrawal_identifier": "txid",
+        },
+    }
+    store.save_transactions([transaction("a", 1, details)])
+    # A later summary-only update doesn't drop the detail record
+    store.save_transactions([transaction("a", 1, transaction_status="COMPLETED")])
+
+    assert store.get_transaction("a")["details"] == details
+    assert store.get_by_withdrawal_identifier("txid")["transaction_id"] == "a"
+    assert ids(store.get_by_withdrawal_address("bc1qaddress")) == ["a"]
+    assert store.get_by_withdrawal_identifier("unknown") is None
+
+
+def test_iter_transactions_pages_by_key(store):
+    # Several transactions share a time, so pages have to break ties by id
+    store.save_transactions(
+        transaction(f"tx{i:02}", i // 3, transaction_status=("DONE", "PENDING")[i % 2])
+        for i in range(20)
+    )
+    expected = ids(store.get_transactions())
+    for batch_size in (1, 2, 3, 7, 20, 50):
+        assert ids(store.iter_transactions(batch_size=batch_size)) == expected
+
+    assert ids(store.iter_transactions(since=2, until=5, batch_size=2)) == ids(
+        store.get_transactions(since=2, until=5)
+    )
+    assert ids(store.iter_transactions(transaction_status="DONE", batch_size=4)) == ids(
+        store.get_transactions(transaction_status="DONE")
+    )
+
+
+def test_iter_transactions_reads_no_snapshot(store):
+    """Writes in between batches are allowed; rows after the last one read show up"""
+    store.save_transactions(transaction(f"tx{i}", i) for i in range(4))
+    rows = store.iter_transactions(batch_size=2)
+    assert next(rows)["transaction_id"] == "tx3"
+    store.save_transactions([transaction("tx0b", 0)])
+    assert ids(rows) == ["tx2", "tx1", "tx0", "tx0b"]
+
+
+HOUR = 3600
+DAY = 24 * HOUR
+ROLLUPS = [(HOUR, DAY), (DAY, 7 * DAY)]
+
+
+def test_append_series_only_changes(store):
+    store.append_series({"sats_bought": 100, "balance:EUR": 5000}, 10)
+    store.append_series({"sats_bought": 100, "balance:EUR": 4000}, 20)
+    # None: not known this time; not a change either
+    store.append_series({"sats_bought": None, "balance:EUR": 4000}, 30)
+    assert store.get_series() == {
+        "sats_bought": [(10, 100)],
+        "balance:EUR": [(10, 5000), (20, 4000)],
+    }
+    assert store.get_latest_series() == {"sats_bought": 100, "balance:EUR": 4000}
+
+    store.append_series({"sats_bought": 200}, 40)
+    assert store.get_latest_series()["sats_bought"] == 200
+    assert store.get_series(["sats_bought"], since=20) == {"sats_bought": [(40, 200)]}
+
+
+def test_rollup_series(store):
+    # Every half hour for 10 days, each one a change
+    now = 10 * DAY
+    step = HOUR // 2
+    for i, sample_time in enumerate(range(0, now, step)):
+        store.append_series({"sats_bought": i}, sample_time)
+    latest = store.get_latest_series()
+
+    store.rollup_series(ROLLUPS, now)
+    series = store.get_series()["sats_bought"]
+    times = [time for time, value in series]
+    # Daily points for the first 3 days, hourly ones for the 6 after, then raw
+    assert len(times) == 3 + 6 * 24 + 2 * 24
+    assert times == sorted(times)
+    # Each point is its bucket's last sample, at that sample's time
+    assert series[0] == (DAY - step, DAY // step - 1)
+    assert series[3] == (3 * DAY + step, (3 * DAY + step) // step)
+    assert store.get_latest_series() == latest
+
+    # Idempotent
+    store.rollup_series(ROLLUPS, now)
+    assert store.get_series()["sats_bought"] == series
+
+
+def test_rollup_series_bucket_rolled_up_twice(store):
+    store.append_series({"sats_bought": 1}, 10)
+    store.rollup_series([(HOUR, 100)], 120)
+    assert store.get_series() == {"sats_bought": [(10, 1)]}
+
+    # A later sample in the same hour is rolled up by the next run
+    store.append_series({"sats_bought": 2}, 20)
+    store.rollup_series([(HOUR, 100)], 130)
+    assert store.get_series() == {"sats_bought": [(20, 2)]}
@@ -0,0 +1,129 @@
+import threading
+import time
+
+from types import SimpleNamespace
+
+import pytest
+
+from flask import Flask
+
+from kdmukai.specterext.bitcoinreserve.service import BitcoinReserveService
+from kdmukai.specterext.bitcoinreserve.sync import BitcoinReserveSyncScheduler
+
+
+ALICE = SimpleNamespace(id="alice", username="alice")
+BOB = SimpleNamespace(id="bob", username="bob")
+
+
+class FakeUpdate:
+    """Stands in for BitcoinReserveService.update(); each run waits to be released"""
+
+    def __init__(self):
+        self.started = []
+        self.release = threading.Semaphore(0)
+
+    def __call__(self, user=None):
+        self.started.append(user.id)
+        self.release.acquire(timeout=5)
+
+    def wait_for(self, count: int):
+        deadline = time.monotonic() + 5
+        while len(self.started) < count:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+
+class FakeAPScheduler:
+    def __init__(self, app):
+        self.app = app
+        self.jobs = {}
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def add_job(self, job_id, func, **kwargs):
+        self.jobs[job_id] = SimpleNamespace(func=func, kwargs=kwargs)
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config["BITCOIN_RESERVE_SYNC_WORKERS"] = 1
+    return app
+
+
+@pytest.fixture
+def update(monkeypatch):
+    update = FakeUpdate()
+    monkeypatch.setattr(BitcoinReserveService, "update", update)
+    return update
+
+
+def wait_until_idle(sync_scheduler: BitcoinReserveSyncScheduler, *users):
+    deadline = time.monotonic() + 5
+    while any(sync_scheduler.is_syncing(user) for user in users):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_queued_triggers_coalesce(app, update):
+    sync_scheduler = BitcoinReserveSyncScheduler(app)
+    assert sync_scheduler.trigger(ALICE)
+    update.wait_for(1)
+
+    # The only worker is busy with alice: bob's sync stays queued...
+    assert sync_scheduler.trigger(BOB)
+    # ...and triggering it again doesn't queue another one
+    assert not sync_scheduler.trigger(BOB)
+    assert sync_scheduler.is_syncing(BOB)
+
+    update.release.release(2)
+    wait_until_idle(sync_scheduler, ALICE, BOB)
+    assert update.started == ["alice", "bob"]
+    sync_scheduler.shutdown()
+
+
+def test_running_sync_reruns_once(app, update):
+    sync_scheduler = BitcoinReserveSyncScheduler(app)
+    sync_scheduler.trigger(ALICE)
+    update.wait_for(1)
+
+    # Something may have changed since the running sync fetched the first page:
+    # one follow-up sync, however many triggers
+    assert not sync_scheduler.trigger(ALICE)
+    assert not sync_scheduler.trigger(ALICE)
+
+    update.release.release()
+    update.wait_for(2)
+    update.release.release()
+    wait_until_idle(sync_scheduler, ALICE)
+    assert update.started == ["alice", "alice"]
+    sync_scheduler.shutdown()
+
+
+def test_interval_sync_scheduled_at_startup(app, monkeypatch):
+    monkeypatch.setattr(BitcoinReserveService, "_sync_scheduler", None)
+    monkeypatch.setattr(BitcoinReserveService, "scheduler", None)
+    scheduler = FakeAPScheduler(app)
+    service = BitcoinReserveService.__new__(BitcoinReserveService)
+
+    service.callback_after_serverpy_init_app(scheduler)
+    job = scheduler.get_job("bitcoinreserve_sync_all")
+    assert job.kwargs["trigger"] == "interval"
+    assert job.kwargs["max_instances"] == 1
+
+    # Registered only once
+    with app.app_context():
+        BitcoinReserveService.get_sync_scheduler().schedule_interval_sync()
+    assert scheduler.get_job("bitcoinreserve_sync_all") is job
+
+    # Each run fans a sync out to every user who can be synced
+    synced = []
+    monkeypatch.setattr(
+        BitcoinReserveService,
+        "sync_all_users",
+        classmethod(lambda cls: synced.append(1)),
+    )
+    job.func()
+    assert synced == [1]
+    BitcoinReserveService._sync_scheduler.shutdown()
@@ -0,0 +1,88 @@
+import json
+import threading
+
+from flask import Flask
+
+from kdmukai.specterext.bitcoinreserve import client as bitcoinreserve_client
+from kdmukai.specterext.bitcoinreserve.watcher import BitcoinReserveOrderWatcher
+
+
+def status(order_status: str, withdrawal_status: str) -> dict:
+    return {
+        "order_id": "order",
+        "order_status": order_status,
+        "withdrawals": [
+            {
+                "withdrawal_address": "bc1qaddress",
+                "withdrawal_status": withdrawal_status,
+            }
+        ],
+    }
+
+
+class FakeApi:
+    """Answers `get_order_status` polls from a script; the last answer repeats"""
+
+    def __init__(self, monkeypatch, statuses: list):
+        self.statuses = statuses
+        self.polls = 0
+        monkeypatch.setattr(
+            bitcoinreserve_client, "get_order_status", self.get_order_status
+        )
+
+    def get_order_status(self, order_id: str, api_token: str = None, use_cache=True):
+        assert not use_cache
+        self.polls += 1
+        return self.statuses[min(self.polls, len(self.statuses)) - 1]
+
+
+def test_initiated_to_done(monkeypatch):
+    FakeApi(
+        monkeypatch,
+        [
+            status("COMPLETE", "INITIATED"),
+            status("COMPLETE", "INITIATED"),
+            status("COMPLETE", "DONE"),
+        ],
+    )
+    finals = []
+    final = threading.Event()
+
+    def on_final(user_id: str, final_status: dict):
+        finals.append((user_id, final_status))
+        final.set()
+
+    watcher = BitcoinReserveOrderWatcher(
+        Flask(__name__), min_interval=0.01, on_final=on_final
+    )
+    subscription = watcher.subscribe("alice", "order", "token")
+    events = subscription.events(keepalive=5)
+    assert next(events) == "retry: 5000\n\n"
+
+    # Unchanged polls aren't pushed
+    remaining = list(events)
+    assert [json.loads(event[len("data: ") :]) for event in remaining[:-1]] == [
+        status("COMPLETE", "INITIATED"),
+        status("COMPLETE", "DONE"),
+    ]
+    assert remaining[-1] == "event: done\ndata: {}\n\n"
+
+    assert final.wait(5)
+    assert finals == [("alice", status("COMPLETE", "DONE"))]
+    assert not watcher.is_watching("alice", "order")
+
+
+def test_one_poller_per_order(monkeypatch):
+    FakeApi(monkeypatch, [status("COMPLETE", "INITIATED")])
+    watcher = BitcoinReserveOrderWatcher(Flask(__name__), min_interval=0.01)
+    first = watcher.subscribe("alice", "order", "token")
+    assert first.get(timeout=5) == status("COMPLETE", "INITIATED")
+
+    # A second tab gets the last known status right away, from the same poller
+    second = watcher.subscribe("alice", "order", "token")
+    assert second.get(timeout=0) == status("COMPLETE", "INITIATED")
+
+    first.close()
+    assert watcher.is_watching("alice", "order")
+    second.close()
+    assert not watcher.is_watching("alice", "order")